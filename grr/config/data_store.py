@@ -10,9 +10,50 @@ config_lib.DEFINE_integer("Datastore.maximum_blob_size", 512 * 1024,
 config_lib.DEFINE_string("Datastore.implementation", "FakeDataStore",
                          "Storage subsystem to use.")
 
+config_lib.DEFINE_semantic_value(
+    rdfvalue.Duration,
+    "Datastore.blob_existence_cache_ttl",
+    default="1h",
+    description="How long a blob found to exist is assumed to keep existing "
+    "before the blob store is asked again. Blobs may be deleted by the blob "
+    "garbage collection, so DataRetention.blobs_min_age has to be longer "
+    "than this.")
+
 config_lib.DEFINE_string("Blobstore.implementation", "MemoryStreamBlobstore",
                          "Blob storage subsystem to use.")
 
+config_lib.DEFINE_bool(
+    "Blobstore.compression", True,
+    "Compress blobs that compress well before storing them. Blobs consisting "
+    "of zeros only are always stored in compact form.")
+
+config_lib.DEFINE_bool(
+    "Blobstore.verify_digests", False,
+    "Check every blob read against its digest. Only needed if blobs written "
+    "before blob encoding was introduced might start with the encoding "
+    "marker, since hashing every read costs CPU time.")
+
+config_lib.DEFINE_string(
+    "FilesystemBlobstore.location",
+    default="%(Config.prefix)/var/grr-blobstore",
+    help="Directory the filesystem blob store keeps blobs in.")
+
+config_lib.DEFINE_integer(
+    "FilesystemBlobstore.threads", 10,
+    "Number of threads used to read and write blobs in a single batch.")
+
+config_lib.DEFINE_bool(
+    "FilesystemBlobstore.use_presence_index", False,
+    "Answer blob existence checks from an in-memory index of stored blobs. "
+    "Blobs written by other processes sharing the same directory are only "
+    "seen by the index after a restart, so only enable this if a single "
+    "process writes to the blob store.")
+
+config_lib.DEFINE_integer(
+    "FilesystemBlobstore.presence_index_capacity", 10000000,
+    "Number of blobs the presence index is sized for. Above this the index "
+    "gets less selective and more existence checks go to disk.")
+
 config_lib.DEFINE_string("Database.implementation", "",
                          "Relational database system to use.")
 
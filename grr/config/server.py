@@ -35,7 +35,82 @@ config_lib.DEFINE_integer("Threadpool.size", 50,
 
 config_lib.DEFINE_integer(
     "Worker.queue_shards", 5, "Queue notifications will be sharded across "
-    "this number of datastore subjects.")
+    "this number of datastore subjects. This is the default for queues whose "
+    "number of shards was not changed with "
+    "QueueManager.SetNotificationShardCount.")
+
+config_lib.DEFINE_bool(
+    "Worker.shard_leasing", False,
+    "If set, workers divide the notification shards of their queues among "
+    "themselves by leasing them through the data store, and every worker "
+    "only reads the shards it holds. Otherwise all workers read all shards.")
+
+config_lib.DEFINE_semantic_value(
+    rdfvalue.Duration, "Worker.shard_lease_time", "120s",
+    "Lease time of notification shards with Worker.shard_leasing. Shards of a "
+    "worker that is gone are picked up by other workers after this time.")
+
+config_lib.DEFINE_string(
+    "Worker.wakeup_channel", "",
+    "If set, the WakeupChannel implementation idle workers wait on for new "
+    "notifications, e.g. UnixSocketWakeupChannel if workers run on the same "
+    "host as the frontends. Workers still poll their queues if they are not "
+    "woken up.")
+
+config_lib.DEFINE_semantic_value(
+    rdfvalue.Duration, "Worker.flow_batch_time", "0s",
+    "If set, a worker keeps a flow locked and in memory for up to this long "
+    "after processing it and processes further notifications for it as they "
+    "come in. The flow is only written back once at the end.")
+
+config_lib.DEFINE_bool(
+    "Worker.profiling", False,
+    "If enabled, the wall time, CPU time, data store time and number of "
+    "responses of every flow state method run are recorded in stats metrics "
+    "per flow and state. Workers also keep a summary of these and log it when "
+    "they receive SIGUSR2.")
+
+config_lib.DEFINE_semantic_value(
+    rdfvalue.Duration, "Worker.heartbeat_interval", "0s",
+    "If set, workers announce that they are alive this often and lock flows "
+    "with a lease of three intervals that is renewed with every heartbeat. "
+    "The flows of workers that stop heartbeating are notified again by the "
+    "other workers, so they are picked up within seconds of a crash.")
+
+config_lib.DEFINE_integer(
+    "Worker.response_prefetch_bytes", 0,
+    "If set, flow responses are read in the background while the flow "
+    "processes earlier responses, but at most this many bytes ahead. "
+    "Otherwise responses are read in batches of up to 10000.")
+
+config_lib.DEFINE_bool(
+    "Worker.fair_scheduling", False,
+    "If set, flows are processed in separate lanes for interactive flows, "
+    "hunts and system flows like cron jobs and well known flows. Lanes share "
+    "the worker's thread pool according to their weights, so a big hunt "
+    "can't starve interactive flows.")
+
+config_lib.DEFINE_integer(
+    "Worker.interactive_lane_weight", 10,
+    "Weight of the interactive flows lane with Worker.fair_scheduling.")
+
+config_lib.DEFINE_integer(
+    "Worker.hunts_lane_weight", 3,
+    "Weight of the hunts lane with Worker.fair_scheduling.")
+
+config_lib.DEFINE_integer(
+    "Worker.system_lane_weight", 1,
+    "Weight of the system flows lane with Worker.fair_scheduling.")
+
+config_lib.DEFINE_integer(
+    "Worker.lane_queue_size", 1000,
+    "Maximum number of flows waiting in each lane with "
+    "Worker.fair_scheduling. Notifications for flows in a full lane are left "
+    "in the data store for a later poll.")
+
+config_lib.DEFINE_string(
+    "UnixSocketWakeupChannel.directory", "%(Config.prefix)/var/grr-wakeup",
+    "Directory waiting workers create their wakeup sockets in.")
 
 config_lib.DEFINE_list(
     "Frontend.well_known_flows", ["TransferStore", "Stats"],
@@ -113,6 +188,16 @@ config_lib.DEFINE_integer(
     "Maximum time messages remain valid within the "
     "system.")
 
+config_lib.DEFINE_integer(
+    "Frontend.client_metadata_flush_interval", 0,
+    "If non-zero, client ping updates to the relational database are "
+    "buffered for up to this many seconds and written in batches.")
+
+config_lib.DEFINE_integer(
+    "Frontend.client_metadata_batch_size", 1000,
+    "Maximum number of buffered client ping updates before a batch is "
+    "written regardless of Frontend.client_metadata_flush_interval.")
+
 config_lib.DEFINE_string("Frontend.upload_store", "FileUploadFileStore",
                          "The implementation of the upload file store.")
 
@@ -120,6 +205,20 @@ config_lib.DEFINE_string("FileUploadFileStore.root_dir",
                          "%(Config.prefix)/var/grr-filestore",
                          "Where to store files uploaded.")
 
+config_lib.DEFINE_semantic_value(
+    rdfvalue.Duration,
+    "FileUploadFileStore.unfinished_upload_ttl",
+    default="7d",
+    description="Unfinished resumable uploads that were not written to for "
+    "this long are removed. If not set, they are kept forever.")
+
+config_lib.DEFINE_string(
+    "NSRLFileStore.index_file", "",
+    "If set, an NSRL hash index built by import_nsrl_hashes. Hash lookups in "
+    "the NSRL file store are then answered from this index instead of the "
+    "data store, so it has to be rebuilt after importing new hashes. The index "
+    "is opened once per process.")
+
 config_lib.DEFINE_bool(
     "Server.initialized", False, "True once config_updater initialize has been "
     "run at least once.")
@@ -255,6 +354,35 @@ config_lib.DEFINE_string(
     help="Inactive clients marked with "
     "this label will be retained forever.")
 
+config_lib.DEFINE_semantic_value(
+    rdfvalue.Duration,
+    "DataRetention.blobs_min_age",
+    default=None,
+    description="Blobs not referenced by any file older than this are marked "
+    "for deletion and deleted once they stayed unreferenced for this long. "
+    "This has to be longer than Datastore.blob_existence_cache_ttl plus the "
+    "time any file download may take, since blobs are stored before the "
+    "files referencing them. If not set, blobs will be retained forever.")
+
+config_lib.DEFINE_bool(
+    "DataRetention.blobs_dry_run", False,
+    "Only count unreferenced blobs instead of deleting them.")
+
+config_lib.DEFINE_integer(
+    "DataRetention.blobs_deletion_batch_size", 1000,
+    "Number of unreferenced blobs deleted at once.")
+
+config_lib.DEFINE_integer(
+    "DataRetention.blobs_max_deletions_per_run", 100000,
+    "Maximum number of unreferenced blobs deleted by one run of the blob "
+    "cleaner, the next run continues where it stopped. 0 means no limit.")
+
+config_lib.DEFINE_bool(
+    "DataRetention.blobs_reachable_set_on_disk", False,
+    "Keep the set of referenced blobs in a temporary file instead of in "
+    "memory while collecting unreferenced blobs. This needs about 32 bytes "
+    "per blob on disk instead of several times that in memory.")
+
 config_lib.DEFINE_integer(
     "Hunt.default_crash_limit",
     default=100,
@@ -122,8 +122,17 @@ class Fingerprinter(object):
                           hashlib.sha512)
   AUTHENTICODE_HASH_CLASSES = (hashlib.md5, hashlib.sha1)
 
-  def __init__(self, file_obj):
+  def __init__(self, file_obj, pool=None):
+    """Constructor.
+
+    Args:
+      file_obj: The file to fingerprint.
+      pool: An optional thread pool (e.g. a multiprocessing.pool.ThreadPool).
+            If given, all hashers process a block in parallel while the next
+            block is read from the file.
+    """
     self.fingers = []
+    self.pool = pool
     self.file = file_obj
     self.file.seek(0, os.SEEK_END)
     self.filelength = self.file.tell()
@@ -154,8 +163,8 @@ class Fingerprinter(object):
     for finger in self.fingers:
       finger.ConsumeRange(start, end)
 
-  def _HashBlock(self, block, start, end):
-    """_HashBlock feeds data blocks into the hashers of fingers.
+  def _FingersForBlock(self, start, end):
+    """Returns the fingers a block has to be fed into.
 
     This function must be called before adjusting fingers for next
     interval, otherwise the lack of remaining ranges will cause the
@@ -165,13 +174,16 @@ class Fingerprinter(object):
     unexpected use of that logic.
 
     Args:
-      block: The data block.
       start: Beginning offset of this block.
       end: Offset of the next byte after the block.
 
+    Returns:
+      A list of Finger objects.
+
     Raises:
       RuntimeError: If the provided and expected ranges don't match.
     """
+    fingers = []
     for finger in self.fingers:
       expected_range = finger.CurrentRange()
       if expected_range is None:
@@ -181,7 +193,34 @@ class Fingerprinter(object):
           (start < expected_range.start and end > expected_range.start)):
         raise RuntimeError('Cutting across fingers.')
       if start == expected_range.start:
-        finger.HashBlock(block)
+        fingers.append(finger)
+    return fingers
+
+  def _HashBlock(self, block, start, end):
+    """_HashBlock feeds data blocks into the hashers of fingers.
+
+    See _FingersForBlock for the constraints on start and end.
+
+    Args:
+      block: The data block.
+      start: Beginning offset of this block.
+      end: Offset of the next byte after the block.
+    """
+    for finger in self._FingersForBlock(start, end):
+      finger.HashBlock(block)
+
+  def _HashBlockAsync(self, block, fingers):
+    """Feeds a block into all hashers of the fingers using the pool.
+
+    Args:
+      block: The data block.
+      fingers: The fingers to feed, as returned by _FingersForBlock.
+
+    Returns:
+      An AsyncResult that is ready once all hashers have processed the block.
+    """
+    hashers = [hasher for finger in fingers for hasher in finger.hashers]
+    return self.pool.map_async(lambda hasher: hasher.update(block), hashers)
 
   def HashIt(self):
     """Finalizing function for the Fingerprint class.
@@ -202,6 +241,10 @@ class Fingerprinter(object):
     Raises:
        RuntimeError: when internal inconsistencies occur.
     """
+    # With a pool, hashing a block overlaps with reading the next one. Each
+    # hasher still sees the blocks in order since a block is only handed out
+    # once all hashers are done with the previous one.
+    pending = None
     while True:
       interval = self._GetNextInterval()
       if interval is None:
@@ -210,9 +253,18 @@ class Fingerprinter(object):
       block = self.file.read(interval.end - interval.start)
       if len(block) != interval.end - interval.start:
         raise RuntimeError('Short read on file.')
-      self._HashBlock(block, interval.start, interval.end)
+      if self.pool is None:
+        self._HashBlock(block, interval.start, interval.end)
+      else:
+        fingers = self._FingersForBlock(interval.start, interval.end)
+        if pending is not None:
+          pending.get()
+        pending = self._HashBlockAsync(block, fingers)
       self._AdjustIntervals(interval.start, interval.end)
 
+    if pending is not None:
+      pending.get()
+
     results = []
     for finger in self.fingers:
       res = {}
@@ -0,0 +1,56 @@
+#!/usr/bin/env python
+"""Tests for the fingerprinter."""
+
+import hashlib
+from multiprocessing import pool
+import os
+import StringIO
+
+from grr.lib import fingerprint
+from grr.lib import flags
+from grr.test_lib import test_lib
+
+
+class FingerprinterTest(test_lib.GRRBaseTest):
+
+  def _Fingerprint(self, file_obj, thread_pool=None):
+    fingerprinter = fingerprint.Fingerprinter(file_obj, pool=thread_pool)
+    fingerprinter.EvalGeneric()
+    fingerprinter.EvalPecoff()
+    return fingerprinter.HashIt()
+
+  def testHashingWithPoolMatchesSequentialHashing(self):
+    thread_pool = pool.ThreadPool(processes=4)
+    try:
+      with open(os.path.join(self.base_path, "hello.exe"), "rb") as fd:
+        expected = self._Fingerprint(fd)
+        self.assertEqual([r["name"] for r in expected], ["generic", "pecoff"])
+        self.assertEqual(self._Fingerprint(fd, thread_pool=thread_pool),
+                         expected)
+    finally:
+      thread_pool.close()
+      thread_pool.join()
+
+  def testHashingWithPoolSpansMultipleBlocks(self):
+    data = os.urandom(1024) * 3000
+    thread_pool = pool.ThreadPool(processes=4)
+    try:
+      result = self._Fingerprint(
+          StringIO.StringIO(data), thread_pool=thread_pool)
+    finally:
+      thread_pool.close()
+      thread_pool.join()
+
+    self.assertGreater(len(data), 2 * fingerprint.Fingerprinter.BLOCK_SIZE)
+    # Hasher names are reported in upper case by some OpenSSL builds.
+    generic = {k.lower(): v for k, v in result[0].iteritems()}
+    self.assertEqual(generic["sha256"], hashlib.sha256(data).digest())
+    self.assertEqual(generic["md5"], hashlib.md5(data).digest())
+
+
+def main(argv):
+  test_lib.main(argv)
+
+
+if __name__ == "__main__":
+  flags.StartMain(main)
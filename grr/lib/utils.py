@@ -911,6 +911,29 @@ class RollingMemoryStream(object):
 
     return value
 
+  def WriteAndReset(self, b):  # pylint: disable=invalid-name
+    """Writes b and gets stream buffer since the last reset.
+
+    This is equivalent to write() followed by GetValueAndReset() but returns b
+    as it is, without copying it through the buffer, if nothing else was
+    written since the last reset.
+
+    Args:
+      b: The data to write.
+
+    Returns:
+      Stream buffer since the last reset, including b.
+    """
+    if not self._stream:
+      raise ArchiveAlreadyClosedError("Attempting to write to a closed stream.")
+
+    if self._stream.tell():
+      self.write(b)
+      return self.GetValueAndReset()
+
+    self._offset += len(b)
+    return b
+
 
 class ArchiveAlreadyClosedError(Error):
   pass
@@ -1077,8 +1100,8 @@ class StreamingZipGenerator(object):
       chunk = self.cur_cmpr.compress(chunk)
       self.cur_compress_size += len(chunk)
 
-    self._stream.write(chunk)
-    return self._stream.GetValueAndReset()
+    # File chunks can be big, they are passed on without copying.
+    return self._stream.WriteAndReset(chunk)
 
   def WriteFileFooter(self):
     """Writes the file footer (finished the file)."""
@@ -351,6 +351,18 @@ class RollingMemoryStreamTest(test_lib.GRRBaseTest):
     self.stream.write("bar")
     self.assertEqual(self.stream.GetValueAndReset(), "bar")
 
+  def testWriteAndResetPassesDataThroughIfNothingIsBuffered(self):
+    data = "blah" * 1000
+    self.assertIs(self.stream.WriteAndReset(data), data)
+    self.assertEqual(self.stream.tell(), len(data))
+    self.assertEqual(self.stream.GetValueAndReset(), "")
+
+  def testWriteAndResetReturnsBufferedValue(self):
+    self.stream.write("foo")
+    self.assertEqual(self.stream.WriteAndReset("bar"), "foobar")
+    self.assertEqual(self.stream.tell(), 6)
+    self.assertEqual(self.stream.GetValueAndReset(), "")
+
   def testWriteAfterCloseRaises(self):
     self.stream.close()
     with self.assertRaises(utils.ArchiveAlreadyClosedError):
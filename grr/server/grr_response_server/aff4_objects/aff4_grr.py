@@ -9,7 +9,6 @@ import time
 
 from grr.lib import rdfvalue
 from grr.lib import registry
-from grr.lib import utils
 from grr.lib.rdfvalues import client as rdf_client
 from grr.lib.rdfvalues import cloud
 from grr.lib.rdfvalues import crypto as rdf_crypto
@@ -673,6 +672,28 @@ class VFSBlobImage(VFSFile):
 
   MULTI_STREAM_CHUNKS_READ_AHEAD = 1000
 
+  # Upper bound for the total size of the blobs read ahead in a single batch.
+  # With big chunks the chunk count alone would allow batches of hundreds of
+  # megabytes.
+  MULTI_STREAM_READ_AHEAD_BYTES = 32 * 1024 * 1024
+
+  @classmethod
+  def _GroupChunkIds(cls, fds):
+    """Groups chunk ids into batches bounded by count and total size."""
+    batch = []
+    batch_bytes = 0
+    for chunk_id, fd in cls._GenerateChunkIds(fds):
+      batch.append((chunk_id, fd))
+      batch_bytes += fd.chunksize
+      if (len(batch) >= cls.MULTI_STREAM_CHUNKS_READ_AHEAD or
+          batch_bytes >= cls.MULTI_STREAM_READ_AHEAD_BYTES):
+        yield batch
+        batch = []
+        batch_bytes = 0
+
+    if batch:
+      yield batch
+
   @classmethod
   def _MultiStream(cls, fds):
     """Effectively streams data from multiple opened BlobImage objects.
@@ -692,8 +713,7 @@ class VFSBlobImage(VFSFile):
 
     broken_fds = set()
     missing_blobs_fd_pairs = []
-    for chunk_fd_pairs in utils.Grouper(
-        cls._GenerateChunkIds(fds), cls.MULTI_STREAM_CHUNKS_READ_AHEAD):
+    for chunk_fd_pairs in cls._GroupChunkIds(fds):
       results_map = data_store.DB.ReadBlobs(
           dict(chunk_fd_pairs).keys(), token=fds[0].token)
 
@@ -722,6 +742,9 @@ class VFSBlobImage(VFSFile):
   def Initialize(self):
     super(VFSBlobImage, self).Initialize()
     self.content_dirty = False
+    # (digest, length) of blobs added since the last flush, their references
+    # are recorded in the blob reference index on flush.
+    self.new_blob_refs = []
     if self.mode == "w":
       self.index = StringIO.StringIO("")
       self.finalized = False
@@ -735,6 +758,7 @@ class VFSBlobImage(VFSFile):
     super(VFSBlobImage, self).Truncate(0)
     self.index = StringIO.StringIO("")
     self.finalized = False
+    self.new_blob_refs = []
 
   def _GetChunkForWriting(self, chunk):
     """Chunks must be added using the AddBlob() method."""
@@ -781,11 +805,22 @@ class VFSBlobImage(VFSFile):
     if chunk.dirty:
       data_store.DB.StoreBlob(chunk.getvalue(), token=self.token)
 
+  def _WriteBlobReferences(self):
+    if self.mutation_pool:
+      self.mutation_pool.BlobReferenceIndexAddItems(self.urn,
+                                                    self.new_blob_refs)
+    else:
+      with data_store.DB.GetMutationPool() as mutation_pool:
+        mutation_pool.BlobReferenceIndexAddItems(self.urn, self.new_blob_refs)
+    self.new_blob_refs = []
+
   def Flush(self):
     if self.content_dirty:
       self.Set(self.Schema.SIZE(self.size))
       self.Set(self.Schema.HASHES(self.index.getvalue()))
       self.Set(self.Schema.FINALIZED(self.finalized))
+    if self.new_blob_refs:
+      self._WriteBlobReferences()
     super(VFSBlobImage, self).Flush()
 
   def AppendContent(self, src_fd):
@@ -829,6 +864,7 @@ class VFSBlobImage(VFSFile):
     self.index.seek(0, 2)
     self.index.write(blob_hash)
     self.size += length
+    self.new_blob_refs.append((blob_hash.encode("hex"), length))
 
     if length < self.chunksize:
       self.finalized = True
@@ -492,6 +492,26 @@ class BlobImageTest(aff4_test_lib.AFF4ObjectTest):
 
     self.assertEqual(count, 0)
 
+  @mock.patch.object(aff4_grr.VFSBlobImage, "MULTI_STREAM_READ_AHEAD_BYTES", 25)
+  def testMultiStreamLimitsReadAheadBySize(self):
+    with aff4.FACTORY.Create(
+        "aff4:/foo", aff4_type=aff4_grr.VFSBlobImage, token=self.token) as fd:
+      fd.SetChunksize(10)
+      fd.AppendContent(StringIO.StringIO("".join(
+          str(i) * 10 for i in range(7))))
+
+    fd = aff4.FACTORY.Open("aff4:/foo", token=self.token)
+    with mock.patch.object(
+        data_store.DB, "ReadBlobs",
+        wraps=data_store.DB.ReadBlobs) as read_blobs:
+      content = [
+          chunk for _, chunk, e in aff4.AFF4Stream.MultiStream([fd]) if not e
+      ]
+
+    self.assertEqual(content, [str(i) * 10 for i in range(7)])
+    self.assertEqual(
+        [len(args[0]) for args, _ in read_blobs.call_args_list], [3, 3, 1])
+
 
 def main(argv):
   # Run the full test suite
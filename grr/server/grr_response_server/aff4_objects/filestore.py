@@ -8,17 +8,70 @@ under aff4:/files to handle new file hash and new file creations.
 import hashlib
 
 import logging
+from multiprocessing import pool
+import threading
 
+from grr import config
 from grr.lib import fingerprint
 from grr.lib import rdfvalue
 from grr.lib import registry
+from grr.lib import utils
 from grr.lib.rdfvalues import nsrl as rdf_nsrl
 from grr.server.grr_response_server import access_control
 from grr.server.grr_response_server import aff4
 from grr.server.grr_response_server import data_store
+from grr.server.grr_response_server import nsrl_index
 from grr.server.grr_response_server.aff4_objects import aff4_grr
 
 
+# SHA-256 hashes of files known to be in the hash file store. Files are not
+# removed from the file store, so entries never need to be invalidated.
+hash_existence_cache = utils.FastStore(100000)
+
+# Threads shared by all fingerprinters hashing files for the hash file store.
+_HASH_POOL_SIZE = 8
+_hash_pool = None
+_hash_pool_lock = threading.Lock()
+
+
+def _GetHashPool():
+  global _hash_pool
+  with _hash_pool_lock:
+    if _hash_pool is None:
+      _hash_pool = pool.ThreadPool(processes=_HASH_POOL_SIZE)
+    return _hash_pool
+
+
+# The NSRL hash index, opened on first use and shared by all NSRL file stores.
+_nsrl_index = None
+_nsrl_index_path = None
+_nsrl_index_lock = threading.Lock()
+
+
+def _GetNSRLIndex():
+  """Returns the configured NSRL hash index or None if there is none.
+
+  An index that can't be opened is reported once and treated as if none was
+  configured, so lookups fall back to the data store.
+
+  Returns:
+    A nsrl_index.HashIndex or None.
+  """
+  global _nsrl_index, _nsrl_index_path
+  path = config.CONFIG["NSRLFileStore.index_file"]
+  with _nsrl_index_lock:
+    if path != _nsrl_index_path:
+      _nsrl_index = None
+      _nsrl_index_path = path
+      if path:
+        try:
+          _nsrl_index = nsrl_index.HashIndex(path)
+        except (EnvironmentError, ValueError) as e:
+          logging.error("Unable to open NSRL index %s, falling back to the "
+                        "data store: %s", path, e)
+    return _nsrl_index
+
+
 class FileStore(aff4.AFF4Volume):
   """Filestore for files downloaded from clients.
 
@@ -66,7 +119,9 @@ class FileStore(aff4.AFF4Volume):
     """
     hashes = set(hashes)
     for child in self.GetChildrenByPriority(allow_external=external):
-      for urn, hash_obj in child.CheckHashes(hashes):
+      # Children may yield before they are done with their input, so they get
+      # a copy of the hashes that are discarded here.
+      for urn, hash_obj in child.CheckHashes(list(hashes)):
         yield urn, hash_obj
 
         hashes.discard(hash_obj)
@@ -258,14 +313,24 @@ class HashFileStore(FileStore):
       Tuples of (RDFURN, hash object) that exist in the store.
     """
     hash_map = {}
+    cached_hits = {}
     for hsh in hashes:
       if hsh.HasField("sha256"):
         # The canonical name of the file is where we store the file hash.
-        hash_map[aff4.ROOT_URN.Add("files/hash/generic/sha256").Add(
-            str(hsh.sha256))] = hsh
+        urn = aff4.ROOT_URN.Add("files/hash/generic/sha256").Add(
+            str(hsh.sha256))
+        if str(hsh.sha256) in hash_existence_cache:
+          cached_hits[urn] = hsh
+        else:
+          hash_map[urn] = hsh
+
+    for urn, hsh in cached_hits.iteritems():
+      yield urn, hsh
 
     for metadata in aff4.FACTORY.Stat(list(hash_map)):
-      yield metadata["urn"], hash_map[metadata["urn"]]
+      hsh = hash_map[metadata["urn"]]
+      hash_existence_cache.Put(str(hsh.sha256), True)
+      yield metadata["urn"], hsh
 
   def _GetHashers(self, hash_types):
     return [
@@ -290,7 +355,9 @@ class HashFileStore(FileStore):
       if found_all:
         return hashes
 
-    fingerprinter = fingerprint.Fingerprinter(fd)
+    # Hashers release the GIL, so hashing on the pool runs all hashers in
+    # parallel and overlaps with reading the next block from the blob store.
+    fingerprinter = fingerprint.Fingerprinter(fd, pool=_GetHashPool())
     if "generic" in self.HASH_TYPES:
       hashers = self._GetHashers(self.HASH_TYPES["generic"])
       fingerprinter.EvalGeneric(hashers=hashers)
@@ -386,6 +453,8 @@ class HashFileStore(FileStore):
           canonical_urn, mode="rw", token=self.token) as new_fd:
         new_fd.Set(new_fd.Schema.STAT(None))
 
+    hash_existence_cache.Put(str(hashes.sha256), True)
+
     self._AddToIndex(canonical_urn, fd.urn)
 
     for hash_type, hash_digest in hashes.ListSetFields():
@@ -497,9 +566,18 @@ class HashFileStore(FileStore):
       raise ValueError("age==aff4.ALL_TIMES is not supported.")
     timestamp = aff4.FACTORY.ParseAgeSpecification(age)
 
-    index_objects = list(aff4.FACTORY.MultiOpen(hashes, token=token))
+    # Canonical sha256 hashes hold the index themselves, only the other hash
+    # types are symlinks that have to be opened to find it.
     index_locations = {}
-    for o in index_objects:
+    symlinks = []
+    for hsh in hashes:
+      if (getattr(hsh, "fingerprint_type", None) == "generic" and
+          getattr(hsh, "hash_type", None) == "sha256"):
+        index_locations.setdefault(hsh, []).append(None)
+      else:
+        symlinks.append(hsh)
+
+    for o in aff4.FACTORY.MultiOpen(symlinks, token=token):
       index_locations.setdefault(o.urn, []).append(o.symlink_urn)
     for hash_obj, client_files in data_store.DB.FileHashIndexQueryMultiple(
         index_locations, timestamp=timestamp):
@@ -508,6 +586,40 @@ class HashFileStore(FileStore):
         hash_obj = original_hash or hash_obj
         yield (FileStoreHash(hash_obj), client_files)
 
+  @classmethod
+  def GetFilesForBlobs(cls, blob_hashes, age=aff4.NEWEST_TIME):
+    """Yields (blob_hash, file_urns) pairs for all the specified blobs.
+
+    Args:
+      blob_hashes: Hex SHA-256 digests of blobs.
+      age: AFF4 age specification, see GetClientsForHashes.
+
+    Yields:
+      (blob_hash, file_urns) tuples, where file_urns is a list of RDFURNs of
+      files that contain the blob. Blobs no file references are omitted.
+
+    Raises:
+      ValueError: if age was set to aff4.ALL_TIMES.
+    """
+    if age == aff4.ALL_TIMES:
+      raise ValueError("age==aff4.ALL_TIMES is not supported.")
+    timestamp = aff4.FACTORY.ParseAgeSpecification(age)
+
+    for blob_hash, file_urns in data_store.DB.BlobReferenceIndexQueryMultiple(
+        blob_hashes, timestamp=timestamp):
+      yield blob_hash, file_urns
+
+  @classmethod
+  def GetClientsForBlobs(cls, blob_hashes, age=aff4.NEWEST_TIME):
+    """Yields (blob_hash, client_ids) pairs for all the specified blobs."""
+    for blob_hash, file_urns in cls.GetFilesForBlobs(blob_hashes, age=age):
+      client_ids = set()
+      for file_urn in file_urns:
+        client_id = file_urn.Split(2)[0]
+        if aff4_grr.VFSGRRClient.CLIENT_ID_RE.match(client_id):
+          client_ids.add(client_id)
+      yield blob_hash, sorted(client_ids)
+
 
 class NSRLFile(FileStoreImage):
   """Represents a file from the NSRL database."""
@@ -560,6 +672,10 @@ class NSRLFileStore(HashFileStore):
     return
 
   def NSRLInfoForSHA1s(self, hashes):
+    index = _GetNSRLIndex()
+    if index is not None:
+      hashes = [h for h in hashes if index.ContainsSHA1(str(h))]
+
     urns = {self.PATH.Add(h): h for h in hashes}
     return {
         urns[obj.urn]: obj
@@ -572,6 +688,9 @@ class NSRLFileStore(HashFileStore):
     Only unique sha1 hashes are checked, if there is duplication in the hashes
     input it is the caller's responsibility to maintain any necessary mappings.
 
+    If an NSRL index is configured, hashes are looked up in the index and the
+    data store is not accessed at all.
+
     Args:
       hashes: A list of Hash objects to check.
       unused_external: Ignored.
@@ -579,6 +698,18 @@ class NSRLFileStore(HashFileStore):
     Yields:
       Tuples of (RDFURN, hash object) that exist in the store.
     """
+    index = _GetNSRLIndex()
+    if index is not None:
+      seen = set()
+      for hsh in hashes:
+        if not hsh.HasField("sha1"):
+          continue
+        digest = hsh.sha1.SerializeToString()
+        if digest in index and digest not in seen:
+          seen.add(digest)
+          yield self.PATH.Add(str(hsh.sha1)), hsh
+      return
+
     hash_map = {}
     for hsh in hashes:
       if hsh.HasField("sha1"):
@@ -589,8 +720,16 @@ class NSRLFileStore(HashFileStore):
     for metadata in aff4.FACTORY.Stat(list(hash_map)):
       yield metadata["urn"], hash_map[metadata["urn"]]
 
-  def AddHash(self, sha1, md5, crc, file_name, file_size, product_code_list,
-              op_system_code_list, special_code):
+  def AddHash(self,
+              sha1,
+              md5,
+              crc,
+              file_name,
+              file_size,
+              product_code_list,
+              op_system_code_list,
+              special_code,
+              mutation_pool=None):
     """Adds a new file from the NSRL hash database.
 
     We create a new subject in:
@@ -606,13 +745,19 @@ class NSRLFileStore(HashFileStore):
       product_code_list: List of products this file is part of.
       op_system_code_list: List of operating systems this file is part of.
       special_code: Special code (malicious/special/normal file).
+      mutation_pool: An optional MutationPool object to write to. If not given,
+                     the hash is written immediately.
     """
     file_store_urn = self.PATH.Add(sha1)
 
     special_code = self.FILE_TYPES.get(special_code, self.FILE_TYPES[""])
 
     with aff4.FACTORY.Create(
-        file_store_urn, NSRLFile, mode="w", token=self.token) as fd:
+        file_store_urn,
+        NSRLFile,
+        mode="w",
+        mutation_pool=mutation_pool,
+        token=self.token) as fd:
       fd.Set(
           fd.Schema.NSRL(
               sha1=sha1.decode("hex"),
@@ -2,16 +2,21 @@
 """Tests for the filestore."""
 
 import hashlib
+import logging
 import os
 import StringIO
 import time
 
+import mock
+
 from grr.lib import flags
 from grr.lib import rdfvalue
 from grr.lib import utils
+from grr.lib.rdfvalues import crypto as rdf_crypto
 from grr.lib.rdfvalues import file_finder as rdf_file_finder
 from grr.lib.rdfvalues import paths as rdf_paths
 from grr.server.grr_response_server import aff4
+from grr.server.grr_response_server import nsrl_index
 from grr.server.grr_response_server.aff4_objects import aff4_grr
 from grr.server.grr_response_server.aff4_objects import filestore
 from grr.server.grr_response_server.aff4_objects import filestore_test_lib
@@ -398,6 +403,33 @@ class HashFileStoreTest(aff4_test_lib.AFF4ObjectTest):
         pathspec, client_id=self.client_id, token=self.token)
     self.assertEqual(len(self._GetBackRefs(filename)), 0)
 
+  def testCheckHashesCachesExistingHashes(self):
+    existing = rdf_crypto.Hash(sha256=hashlib.sha256("existing").digest())
+    missing = rdf_crypto.Hash(sha256=hashlib.sha256("missing").digest())
+
+    fs = aff4.FACTORY.Open(
+        filestore.HashFileStore.PATH,
+        aff4_type=filestore.HashFileStore,
+        token=self.token)
+    existing_urn = fs.PATH.Add("generic/sha256").Add(str(existing.sha256))
+    missing_urn = fs.PATH.Add("generic/sha256").Add(str(missing.sha256))
+    with aff4.FACTORY.Create(
+        existing_urn, aff4.AFF4MemoryStream, token=self.token) as fd:
+      fd.Write("existing")
+
+    with mock.patch.object(
+        aff4.FACTORY, "Stat", wraps=aff4.FACTORY.Stat) as stat:
+      for _ in range(2):
+        hits = list(fs.CheckHashes([existing, missing]))
+        self.assertEqual(hits, [(existing_urn, existing)])
+
+      # Once a hash is known to be in the file store it is not looked up
+      # again.
+      self.assertEqual(stat.call_count, 2)
+      self.assertItemsEqual(stat.call_args_list[0][0][0],
+                            [existing_urn, missing_urn])
+      self.assertEqual(stat.call_args_list[1][0][0], [missing_urn])
+
   def _GetBackRefs(self, filename):
     res = []
     data = open(filename, "rb").read()
@@ -463,6 +495,90 @@ class HashFileStoreTest(aff4_test_lib.AFF4ObjectTest):
     self.assertEqual(info.md5, "bb0a15eefe63fd41f8dc9dee01c5cf9a")
     self.assertEqual(info.file_size, 100)
 
+  def testGetClientsForBlobs(self):
+    shared = hashlib.sha256("shared").digest()
+    unique = hashlib.sha256("unique").digest()
+    files = []
+    for client_id, blobs in [("C.1000000000000000", [shared, unique]),
+                             ("C.1000000000000001", [shared])]:
+      with aff4.FACTORY.Create(
+          rdfvalue.RDFURN(client_id).Add("fs/os/file"),
+          aff4_grr.VFSBlobImage,
+          token=self.token) as fd:
+        fd.SetChunksize(1024)
+        for blob in blobs:
+          fd.AddBlob(blob, 1024)
+        files.append(fd.urn)
+
+    missing = hashlib.sha256("missing").hexdigest()
+    blob_hashes = [shared.encode("hex"), unique.encode("hex"), missing]
+
+    hits = dict(filestore.HashFileStore.GetFilesForBlobs(blob_hashes))
+    self.assertItemsEqual(hits[shared.encode("hex")], files)
+    self.assertEqual(hits[unique.encode("hex")], files[:1])
+    self.assertNotIn(missing, hits)
+
+    hits = dict(filestore.HashFileStore.GetClientsForBlobs(blob_hashes))
+    self.assertEqual(hits[shared.encode("hex")],
+                     ["C.1000000000000000", "C.1000000000000001"])
+    self.assertEqual(hits[unique.encode("hex")], ["C.1000000000000000"])
+
+  def _WriteNSRLIndex(self, name, sha1s):
+    # The index is only reopened when the configured path changes.
+    index_file = os.path.join(self.temp_dir, name)
+    with nsrl_index.IndexWriter(index_file) as writer:
+      for sha1 in sha1s:
+        writer.Add(sha1)
+    return test_lib.ConfigOverrider({"NSRLFileStore.index_file": index_file})
+
+  def testCheckHashesNSRLUsesIndex(self):
+    known = hashlib.sha1("known").digest()
+    unknown = hashlib.sha1("unknown").digest()
+    nsrl_fs = aff4.FACTORY.Open("aff4:/files/nsrl", token=self.token)
+
+    with self._WriteNSRLIndex("nsrl.idx", [known.encode("hex")]):
+      with mock.patch.object(aff4.FACTORY, "Stat") as stat:
+        hits = list(
+            nsrl_fs.CheckHashes([
+                rdf_crypto.Hash(sha1=known),
+                rdf_crypto.Hash(sha1=unknown),
+                rdf_crypto.Hash(sha1=known)
+            ]))
+        self.assertFalse(stat.called)
+
+    self.assertEqual(len(hits), 1)
+    urn, hsh = hits[0]
+    self.assertEqual(urn, nsrl_fs.PATH.Add(known.encode("hex")))
+    self.assertEqual(hsh.sha1, known)
+
+  def testNSRLInfoSkipsHashesNotInIndex(self):
+    nsrl_fs = self._SetupNSRLFiles()
+    sha1 = "e1f7e62b3909263f3a2518bbae6a9ee36d5b502b"
+
+    with self._WriteNSRLIndex("known.idx", [sha1]):
+      self.assertIn(sha1, nsrl_fs.NSRLInfoForSHA1s([sha1]))
+
+    with self._WriteNSRLIndex("empty.idx", []):
+      self.assertEqual(nsrl_fs.NSRLInfoForSHA1s([sha1]), {})
+
+  def testNSRLInfoFallsBackToDataStoreWithBrokenIndex(self):
+    nsrl_fs = aff4.FACTORY.Open("aff4:/files/nsrl", token=self.token)
+    sha1 = "e1f7e62b3909263f3a2518bbae6a9ee36d5b502b"
+    nsrl_fs.AddHash(sha1, "bb0a15eefe63fd41f8dc9dee01c5cf9a", None, "idea.dll",
+                    100, None, None, "M")
+
+    index_file = os.path.join(self.temp_dir, "broken.idx")
+    with open(index_file, "wb") as fd:
+      fd.write("not an index")
+
+    for path in [index_file, os.path.join(self.temp_dir, "missing.idx")]:
+      with test_lib.ConfigOverrider({"NSRLFileStore.index_file": path}):
+        with mock.patch.object(logging, "error") as error:
+          for _ in range(2):
+            self.assertIn(sha1, nsrl_fs.NSRLInfoForSHA1s([sha1]))
+          # The broken index is only reported once.
+          self.assertEqual(error.call_count, 1)
+
   def testGetClientsForHashesNSRL(self):
     """Tests GetClientsForHashes for the NSRL filestore.
 
@@ -57,3 +57,11 @@ class FilestoreStats(aff4.AFF4Object):
     FILESTORE_FILESIZE_HISTOGRAM = aff4.Attribute(
         "aff4:stats/filestore/filesize", stats.Graph,
         "Filesize histogram of files in the filestore")
+
+    FILESTORE_BLOB_COUNT = aff4.Attribute(
+        "aff4:stats/filestore/blob_count", stats.Graph,
+        "Number of stored blobs and of references to them from files")
+
+    FILESTORE_BLOB_SIZE = aff4.Attribute(
+        "aff4:stats/filestore/blob_size", stats.GraphFloat,
+        "Size in GB of stored blobs and of the file data referencing them")
@@ -381,6 +381,8 @@ def main(argv):
     httpd.serve_forever()
   except KeyboardInterrupt:
     print "Caught keyboard interrupt, stopping"
+  finally:
+    httpd.frontend.Stop()
 
 
 if __name__ == "__main__":
@@ -14,11 +14,13 @@ import requests
 from google.protobuf import json_format
 
 from grr.lib import flags
+from grr.lib import rdfvalue
 from grr.lib import utils
 from grr.lib.rdfvalues import file_finder as rdf_file_finder
 from grr.lib.rdfvalues import paths as rdf_paths
 from grr.lib.rdfvalues import rekall_types as rdf_rekall_types
 from grr.server.grr_response_server import aff4
+from grr.server.grr_response_server import file_store
 from grr.server.grr_response_server import flow
 from grr.server.grr_response_server import frontend_lib
 from grr.server.grr_response_server.aff4_objects import aff4_grr
@@ -279,6 +281,104 @@ class GRRHTTPServerTest(test_lib.GRRBaseTest):
     self.assertEqual(profile.version, "v1.0")
     self.assertEqual(profile.data[:2], "\x1f\x8b")
 
+  def testUploadIsDisabledByDefault(self):
+    req = requests.post(self.base_url + "upload", data="foo")
+    self.assertEqual(req.status_code, 404)
+
+
+class FileUploadFileStoreTest(test_lib.GRRBaseTest):
+  """Tests for unfinished uploads in the FileUploadFileStore."""
+
+  def setUp(self):
+    super(FileUploadFileStoreTest, self).setUp()
+    self.config_overrider = test_lib.ConfigOverrider({
+        "FileUploadFileStore.root_dir": self.temp_dir
+    })
+    self.config_overrider.Start()
+    self.store = file_store.FileUploadFileStore()
+
+  def tearDown(self):
+    self.config_overrider.Stop()
+    super(FileUploadFileStoreTest, self).tearDown()
+
+  def testResumeUpload(self):
+    data = os.urandom(100000)
+
+    fd = self.store.CreateFileStoreFile()
+    fd.Write(data[:30000])
+    fd.Close()
+
+    fd = self.store.ResumeFileStoreFile(fd.upload_id)
+    self.assertEqual(fd.offset, 30000)
+    # Data has to continue where the upload stopped.
+    with self.assertRaises(file_store.UploadOffsetError):
+      fd.Write(data[20000:20100], offset=20000)
+    fd.Write(data[30000:], offset=30000)
+
+    file_id = fd.Finalize()
+    self.assertEqual(file_id, hashlib.sha256(data).hexdigest())
+    self.assertEqual(self.store.OpenForReading(file_id).read(), data)
+
+    # The upload is gone once it's finalized.
+    with self.assertRaises(file_store.UnknownUploadError):
+      self.store.ResumeFileStoreFile(fd.upload_id)
+
+  def testWritesToTheSameUploadAreSerialized(self):
+    fd = self.store.CreateFileStoreFile()
+    fd.Write("foo")
+
+    resumed = []
+    thread = threading.Thread(target=lambda: resumed.append(
+        self.store.ResumeFileStoreFile(fd.upload_id)))
+    thread.start()
+    thread.join(0.5)
+    self.assertFalse(resumed)
+
+    fd.Write("bar")
+    fd.Close()
+    thread.join()
+    self.assertEqual(resumed[0].offset, 6)
+    resumed[0].Close()
+
+  def testUploadFinalizedWhileWaitingIsUnknown(self):
+    fd = self.store.CreateFileStoreFile()
+    fd.Write("foo")
+
+    errors = []
+
+    def Resume():
+      try:
+        self.store.ResumeFileStoreFile(fd.upload_id)
+      except file_store.UnknownUploadError as e:
+        errors.append(e)
+
+    thread = threading.Thread(target=Resume)
+    thread.start()
+    thread.join(0.5)
+    fd.Finalize()
+    thread.join()
+    self.assertEqual(len(errors), 1)
+
+  def testExpireUploads(self):
+    old = self.store.CreateFileStoreFile()
+    old.Write("foo")
+    old.Close()
+    os.utime(old.tmp_path, (100, 100))
+
+    recent = self.store.CreateFileStoreFile()
+    recent.Write("bar")
+    recent.Close()
+
+    in_use = self.store.CreateFileStoreFile()
+    os.utime(in_use.tmp_path, (100, 100))
+
+    self.assertEqual(self.store.ExpireUploads(rdfvalue.Duration("1d")), 1)
+    with self.assertRaises(file_store.UnknownUploadError):
+      self.store.ResumeFileStoreFile(old.upload_id)
+    self.store.ResumeFileStoreFile(recent.upload_id).Close()
+    in_use.Close()
+    self.store.ResumeFileStoreFile(in_use.upload_id).Close()
+
 
 def main(args):
   test_lib.main(args)
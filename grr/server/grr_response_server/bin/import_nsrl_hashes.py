@@ -2,79 +2,235 @@
 """Script for importing NSRL files."""
 
 import csv
+import functools
+from multiprocessing import pool
 import os
+import time
 
 # pylint: disable=unused-import,g-bad-import-order
 from grr.server.grr_response_server import server_plugins
 # pylint: enable=unused-import,g-bad-import-order
 
 from grr.lib import flags
+from grr.lib import rdfvalue
 from grr.lib import utils
 from grr.server.grr_response_server import aff4
 from grr.server.grr_response_server import data_store
+from grr.server.grr_response_server import nsrl_index
 from grr.server.grr_response_server import server_startup
 
 from grr.server.grr_response_server.aff4_objects import filestore
 
 flags.DEFINE_string("filename", "", "File with hashes.")
-flags.DEFINE_integer("start", None, "Start row in the file.")
 
+flags.DEFINE_integer("batch_size", 10000,
+                     "Number of hashes written with a single mutation pool.")
 
-def _ImportRow(store, row, product_code_list, op_system_code_list):
+flags.DEFINE_integer("threads", 4,
+                     "Number of threads writing hashes in parallel.")
+
+flags.DEFINE_string(
+    "checkpoint_file", "",
+    "File the import progress is recorded in. If the file exists, the import "
+    "resumes where the previous run stopped.")
+
+flags.DEFINE_string(
+    "index_file", "",
+    "If set, a sorted SHA-1 index of all hashes in the file is written here "
+    "after the import. Without --filename, the index is built from all hashes "
+    "in the data store instead. See NSRLFileStore.index_file.")
+
+
+def _ParseHash(row, product_code_list, op_system_code_list):
+  """Returns the NSRLFileStore.AddHash arguments for a row."""
   sha1 = row[0].lower()
   md5 = row[1].lower()
   crc = int(row[2].lower(), 16)
   file_name = utils.SmartUnicode(row[3])
   file_size = int(row[4])
   special_code = row[7]
-  store.AddHash(sha1, md5, crc, file_name, file_size, product_code_list,
-                op_system_code_list, special_code)
-
-
-def ImportFile(store, filename, start):
-  """Import hashes from 'filename' into 'store'."""
-  with open(filename, "rb") as fp:
-    reader = csv.reader(fp, delimiter=",", quotechar="\"")
-    i = 0
-    current_row = None
-    product_code_list = []
-    op_system_code_list = []
-    for row in reader:
-      # Skip first row.
-      i += 1
-      if i and i % 5000 == 0:
-        data_store.DB.Flush()
-        print "Imported %d hashes" % i
-      if i > 1:
-        if len(row) != 8:
-          continue
-        try:
-          if i < start:
-            continue
-          if current_row:
-            if current_row[0] == row[0]:
-              # Same hash, add product/system
-              product_code_list.append(int(row[5]))
-              op_system_code_list.append(row[6])
-              continue
-            # Fall through and add current row.
-          else:
-            # First row.
-            current_row = row
-            product_code_list = [int(row[5])]
-            op_system_code_list = [row[6]]
-            continue
-          _ImportRow(store, current_row, product_code_list, op_system_code_list)
-          # Set new hash.
-          current_row = row
-          product_code_list = [int(row[5])]
-          op_system_code_list = [row[6]]
-        except Exception as e:  # pylint: disable=broad-except
-          print "Failed at %d with %s" % (i, str(e))
-          return i - 1
+  return (sha1, md5, crc, file_name, file_size, product_code_list,
+          op_system_code_list, special_code)
+
+
+class _LineReader(object):
+  """Iterates over the lines of a file, keeping track of the offset.
+
+  File iteration reads ahead, so fp.tell() doesn't say how far a csv reader
+  consuming the file got. A csv reader pulls one line at a time until a record
+  is complete, so after each record the offset is at a record boundary.
+  """
+
+  def __init__(self, fp):
+    self.fp = fp
+    self.offset = fp.tell()
+
+  def __iter__(self):
+    return self
+
+  def next(self):
+    line = self.fp.readline()
+    if not line:
+      raise StopIteration()
+
+    self.offset += len(line)
+    return line
+
+
+def ReadHashes(fp, offset=0):
+  """Reads hashes from an NSRL file.
+
+  The file has one row per file and product it is part of, rows for the same
+  file are consecutive and merged into a single hash. Malformed rows are
+  reported and skipped.
+
+  Args:
+    fp: The NSRL file, open for reading.
+    offset: Position in the file to start reading at, either 0 or an offset
+      previously yielded by this function.
+
+  Yields:
+    Tuples of NSRLFileStore.AddHash arguments and the offset of the row
+    following the last row of this hash, i.e. where to resume reading once
+    this hash is imported.
+  """
+  fp.seek(offset)
+  lines = _LineReader(fp)
+  reader = csv.reader(lines, delimiter=",", quotechar="\"")
+  current_row = None
+  product_code_list = []
+  op_system_code_list = []
+  while True:
+    row_offset = lines.offset
+    try:
+      row = next(reader)
+    except StopIteration:
+      break
+    except csv.Error as e:
+      print "Skipping malformed row at offset %d: %s" % (row_offset, e)
+      continue
+
+    # Skip the header and malformed rows.
+    if not row or len(row) != 8 or row[0] == "SHA-1":
+      continue
+
+    try:
+      _ParseHash(row, None, None)
+      product_code = int(row[5])
+    except ValueError as e:
+      print "Skipping malformed row at offset %d: %s" % (row_offset, e)
+      continue
+
     if current_row:
-      _ImportRow(store, current_row, product_code_list, op_system_code_list)
-    return i
+      if current_row[0] == row[0]:
+        # Same hash, add product/system
+        product_code_list.append(product_code)
+        op_system_code_list.append(row[6])
+        continue
+
+      yield (_ParseHash(current_row, product_code_list, op_system_code_list),
+             row_offset)
+
+    current_row = row
+    product_code_list = [product_code]
+    op_system_code_list = [row[6]]
+
+  if current_row:
+    yield (_ParseHash(current_row, product_code_list, op_system_code_list),
+           lines.offset)
+
+
+def _ReadCheckpoint(checkpoint_file):
+  if not checkpoint_file or not os.path.exists(checkpoint_file):
+    return 0
+
+  with open(checkpoint_file, "rb") as fd:
+    return int(fd.read().strip())
+
+
+def _WriteCheckpoint(checkpoint_file, offset):
+  if not checkpoint_file:
+    return
+
+  tmp_file = checkpoint_file + ".tmp"
+  with open(tmp_file, "wb") as fd:
+    fd.write("%d\n" % offset)
+  os.rename(tmp_file, checkpoint_file)
+
+
+def _WriteHashes(store, hashes):
+  mutation_pool = data_store.DB.GetMutationPool()
+  for hash_args in hashes:
+    store.AddHash(*hash_args, mutation_pool=mutation_pool)
+  mutation_pool.Flush()
+
+
+def ImportFile(store,
+               filename,
+               batch_size=10000,
+               threads=4,
+               checkpoint_file=None):
+  """Import hashes from 'filename' into 'store'.
+
+  Hashes are written in batches by parallel writers. Progress is only
+  checkpointed once all hashes up to that point are written, so a resumed
+  import never skips a hash.
+
+  Args:
+    store: The NSRLFileStore to import into.
+    filename: The NSRL file to import.
+    batch_size: Number of hashes written with a single mutation pool.
+    threads: Number of threads writing batches in parallel.
+    checkpoint_file: Optional file to record progress in and resume from.
+
+  Returns:
+    The number of hashes imported.
+  """
+  offset = _ReadCheckpoint(checkpoint_file)
+  if offset:
+    print "Resuming import at offset %d" % offset
+
+  write_pool = pool.ThreadPool(processes=threads)
+  imported = 0
+  start_time = time.time()
+  try:
+    with open(filename, "rb") as fp:
+      hashes = ReadHashes(fp, offset=offset)
+      for chunk in utils.Grouper(hashes, batch_size * threads):
+        batches = utils.Grouper((hash_args for hash_args, _ in chunk),
+                                batch_size)
+        write_pool.map(functools.partial(_WriteHashes, store), list(batches))
+
+        _, offset = chunk[-1]
+        _WriteCheckpoint(checkpoint_file, offset)
+
+        imported += len(chunk)
+        print "Imported %d hashes (%.0f hashes/s)" % (
+            imported, imported / max(time.time() - start_time, 1e-6))
+  finally:
+    write_pool.close()
+    write_pool.join()
+
+  return imported
+
+
+def BuildIndex(filename, index_file):
+  """Writes a sorted SHA-1 index of all hashes in 'filename'."""
+  with nsrl_index.IndexWriter(index_file) as writer:
+    with open(filename, "rb") as fp:
+      for hash_args, _ in ReadHashes(fp):
+        writer.Add(hash_args[0])
+
+
+def BuildIndexFromDataStore(index_file):
+  """Writes a sorted SHA-1 index of all hashes in the NSRL file store."""
+  # NSRL files have no child index, so the hashes are found by a scan.
+  with nsrl_index.IndexWriter(index_file) as writer:
+    for subject, _, _ in data_store.DB.ScanAttribute(
+        filestore.NSRLFileStore.PATH,
+        filestore.NSRLFile.SchemaCls.NSRL.predicate,
+        relaxed_order=True):
+      writer.Add(rdfvalue.RDFURN(subject).Basename())
 
 
 def main(argv):
@@ -83,18 +239,35 @@ def main(argv):
   server_startup.Init()
 
   filename = flags.FLAGS.filename
-  if not os.path.exists(filename):
+  if filename and not os.path.exists(filename):
     print "File %s does not exist" % filename
     return
 
+  if not filename and not flags.FLAGS.index_file:
+    print "Either --filename or --index_file has to be given"
+    return
+
   with aff4.FACTORY.Create(
       filestore.NSRLFileStore.PATH,
       filestore.NSRLFileStore,
       mode="rw",
       token=aff4.FACTORY.root_token) as store:
-    imported = ImportFile(store, filename, flags.FLAGS.start)
-    data_store.DB.Flush()
-    print "Imported %d hashes" % imported
+    if filename:
+      imported = ImportFile(
+          store,
+          filename,
+          batch_size=flags.FLAGS.batch_size,
+          threads=flags.FLAGS.threads,
+          checkpoint_file=flags.FLAGS.checkpoint_file)
+      data_store.DB.Flush()
+      print "Imported %d hashes" % imported
+
+    if flags.FLAGS.index_file:
+      if filename:
+        BuildIndex(filename, flags.FLAGS.index_file)
+      else:
+        BuildIndexFromDataStore(flags.FLAGS.index_file)
+      print "Wrote index %s" % flags.FLAGS.index_file
 
 
 if __name__ == "__main__":
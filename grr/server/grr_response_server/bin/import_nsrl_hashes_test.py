@@ -0,0 +1,156 @@
+#!/usr/bin/env python
+"""Tests for the NSRL import script."""
+
+import hashlib
+import os
+
+from grr.lib import flags
+from grr.server.grr_response_server import aff4
+from grr.server.grr_response_server import nsrl_index
+from grr.server.grr_response_server.aff4_objects import filestore
+from grr.server.grr_response_server.bin import import_nsrl_hashes
+from grr.test_lib import test_lib
+
+_HEADER = ('"SHA-1","MD5","CRC32","FileName","FileSize","ProductCode",'
+           '"OpSystemCode","SpecialCode"\r\n')
+
+
+def _Row(i, product_code=1, op_system_code="358"):
+  sha1 = hashlib.sha1(str(i)).hexdigest().upper()
+  md5 = hashlib.md5(str(i)).hexdigest().upper()
+  return '"%s","%s","%08X","file%d.exe",%d,%d,"%s",""\r\n' % (
+      sha1, md5, i, i, i * 10, product_code, op_system_code)
+
+
+class ImportNSRLHashesTest(test_lib.GRRBaseTest):
+
+  def setUp(self):
+    super(ImportNSRLHashesTest, self).setUp()
+    self.filename = os.path.join(self.temp_dir, "NSRLFile.txt")
+    with open(self.filename, "wb") as fd:
+      fd.write(_HEADER)
+      for i in range(100):
+        fd.write(_Row(i))
+        if i % 10 == 0:
+          # The same file as part of another product.
+          fd.write(_Row(i, product_code=2, op_system_code="359"))
+
+    self.store = aff4.FACTORY.Create(
+        filestore.NSRLFileStore.PATH,
+        filestore.NSRLFileStore,
+        mode="rw",
+        token=self.token)
+
+  def _Sha1(self, i):
+    return hashlib.sha1(str(i)).hexdigest()
+
+  def _ImportedHashes(self):
+    sha1s = [self._Sha1(i) for i in range(100)]
+    return self.store.NSRLInfoForSHA1s(sha1s)
+
+  def testReadHashesMergesProducts(self):
+    with open(self.filename, "rb") as fp:
+      hashes = list(import_nsrl_hashes.ReadHashes(fp))
+
+    self.assertEqual(len(hashes), 100)
+    (sha1, md5, crc, file_name, file_size, product_code_list,
+     op_system_code_list, special_code), _ = hashes[10]
+    self.assertEqual(sha1, self._Sha1(10))
+    self.assertEqual(md5, hashlib.md5("10").hexdigest())
+    self.assertEqual(crc, 10)
+    self.assertEqual(file_name, "file10.exe")
+    self.assertEqual(file_size, 100)
+    self.assertEqual(product_code_list, [1, 2])
+    self.assertEqual(op_system_code_list, ["358", "359"])
+    self.assertEqual(special_code, "")
+
+  def testReadHashesResumesAtOffset(self):
+    with open(self.filename, "rb") as fp:
+      hashes = list(import_nsrl_hashes.ReadHashes(fp))
+      _, offset = hashes[41]
+      resumed = list(import_nsrl_hashes.ReadHashes(fp, offset=offset))
+
+    self.assertEqual(resumed, hashes[42:])
+
+  def testReadHashesHandlesMultiLineAndMalformedRows(self):
+    filename = os.path.join(self.temp_dir, "NSRLFileMultiLine.txt")
+    with open(filename, "wb") as fd:
+      fd.write(_HEADER)
+      fd.write(_Row(0))
+      fd.write(_Row(1).replace("file1.exe", "file\r\n1.exe"))
+      fd.write(_Row(2).replace(",1,", ",foo,"))
+      fd.write(_Row(3))
+
+    with open(filename, "rb") as fp:
+      hashes = list(import_nsrl_hashes.ReadHashes(fp))
+      _, offset = hashes[0]
+      resumed = list(import_nsrl_hashes.ReadHashes(fp, offset=offset))
+
+    self.assertEqual([hash_args[0] for hash_args, _ in hashes],
+                     [self._Sha1(0), self._Sha1(1), self._Sha1(3)])
+    self.assertEqual(hashes[1][0][3], "file\r\n1.exe")
+    self.assertEqual(resumed, hashes[1:])
+
+  def testImportFile(self):
+    imported = import_nsrl_hashes.ImportFile(
+        self.store, self.filename, batch_size=7, threads=3)
+
+    self.assertEqual(imported, 100)
+    infos = self._ImportedHashes()
+    self.assertEqual(len(infos), 100)
+    fd = infos[self._Sha1(20)]
+    nsrl = fd.Get(fd.Schema.NSRL)
+    self.assertEqual(nsrl.file_name, "file20.exe")
+    self.assertEqual(list(nsrl.product_code), [1, 2])
+
+  def testImportFileResumesFromCheckpoint(self):
+    checkpoint_file = os.path.join(self.temp_dir, "checkpoint")
+    with open(self.filename, "rb") as fp:
+      hashes = list(import_nsrl_hashes.ReadHashes(fp))
+    _, offset = hashes[59]
+    with open(checkpoint_file, "wb") as fd:
+      fd.write("%d\n" % offset)
+
+    imported = import_nsrl_hashes.ImportFile(
+        self.store,
+        self.filename,
+        batch_size=7,
+        threads=3,
+        checkpoint_file=checkpoint_file)
+
+    self.assertEqual(imported, 40)
+    self.assertItemsEqual(self._ImportedHashes(),
+                          [self._Sha1(i) for i in range(60, 100)])
+    with open(checkpoint_file, "rb") as fd:
+      self.assertEqual(int(fd.read()), os.path.getsize(self.filename))
+
+  def _CheckIndex(self, index_file, sha1s):
+    index = nsrl_index.HashIndex(index_file)
+    try:
+      self.assertEqual(len(index), len(sha1s))
+      for sha1 in sha1s:
+        self.assertTrue(index.ContainsSHA1(sha1))
+      self.assertFalse(index.ContainsSHA1(self._Sha1(100)))
+    finally:
+      index.Close()
+
+  def testBuildIndex(self):
+    index_file = os.path.join(self.temp_dir, "nsrl.idx")
+    import_nsrl_hashes.BuildIndex(self.filename, index_file)
+
+    self._CheckIndex(index_file, [self._Sha1(i) for i in range(100)])
+
+  def testBuildIndexFromDataStore(self):
+    import_nsrl_hashes.ImportFile(self.store, self.filename)
+    index_file = os.path.join(self.temp_dir, "nsrl.idx")
+    import_nsrl_hashes.BuildIndexFromDataStore(index_file)
+
+    self._CheckIndex(index_file, [self._Sha1(i) for i in range(100)])
+
+
+def main(argv):
+  test_lib.main(argv)
+
+
+if __name__ == "__main__":
+  flags.StartMain(main)
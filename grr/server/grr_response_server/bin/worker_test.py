@@ -10,6 +10,7 @@ from grr import config
 from grr.lib import flags
 from grr.lib import queues
 from grr.lib import rdfvalue
+from grr.lib import stats
 from grr.lib import utils
 from grr.lib.rdfvalues import client as rdf_client
 from grr.lib.rdfvalues import flows as rdf_flows
@@ -20,6 +21,7 @@ from grr.server.grr_response_server import flow
 from grr.server.grr_response_server import flow_runner
 from grr.server.grr_response_server import frontend_lib
 from grr.server.grr_response_server import queue_manager
+from grr.server.grr_response_server import threadpool
 from grr.server.grr_response_server import worker_lib
 from grr.server.grr_response_server.flows.general import administrative
 from grr.server.grr_response_server.hunts import implementation
@@ -604,6 +606,21 @@ class GrrWorkerTest(flow_test_lib.FlowTestsBaseclass):
   def testProcessMessagesWellKnown(self):
     self._testProcessMessagesWellKnown()
 
+  def testWorkerIsWokenUpByNewNotifications(self):
+    with test_lib.ConfigOverrider({
+        "Worker.wakeup_channel": "LocalWakeupChannel"
+    }):
+      worker_obj = worker_lib.GRRWorker(token=self.token)
+      self.assertFalse(worker_obj.WaitForNotifications(0))
+
+      # Send a message to the worker.
+      with queue_manager.QueueManager(token=self.token) as manager:
+        manager.QueueNotification(
+            session_id=rdfvalue.SessionID(flow_name="123456"))
+
+      self.assertTrue(worker_obj.WaitForNotifications(10))
+      self.assertFalse(worker_obj.WaitForNotifications(0))
+
   def testMessageHandlers(self):
     with test_lib.ConfigOverrider({
         "Database.useForReads": True,
@@ -1092,6 +1109,435 @@ class GrrWorkerTest(flow_test_lib.FlowTestsBaseclass):
     # Server side out of cpu.
     self.assertIn("Out of CPU quota", errors[1].backtrace)
 
+  def testProcessMessagesWithShardLeasing(self):
+    # Without the ShardedQueueManager, a worker only sees all notifications
+    # if it holds leases on all shards.
+    self.patch_get_notifications.stop()
+    try:
+      with test_lib.ConfigOverrider({"Worker.shard_leasing": True}):
+        # Notifications of different flows go to different shards.
+        for i in range(5):
+          flow_obj = self.FlowSetup("WorkerSendingTestFlow")
+          flow_obj.Close()
+          self.SendResponse(flow_obj.session_id, "Hello%d" % i)
+
+        worker_obj = worker_lib.GRRWorker(token=self.token)
+        worker_obj.RunOnce()
+        worker_obj.thread_pool.Join()
+        worker_obj.shard_leases.ReleaseAll()
+
+        self.assertEqual(sorted(RESULTS), ["Hello%d" % i for i in range(5)])
+    finally:
+      self.patch_get_notifications.start()
+
+  def testFlowBatchingProcessesNewResponsesUnderOneLock(self):
+    flow_obj = self.FlowSetup("WorkerSendingTestFlow")
+    session_id = flow_obj.session_id
+    flow_obj.Close()
+    self.SendResponse(session_id, "Hello1", request_id=1)
+
+    process_flow_messages = worker_lib.GRRWorker._ProcessRegularFlowMessages
+
+    def ProcessAndRespond(worker, flow_obj, notification):
+      process_flow_messages(worker, flow_obj, notification)
+      # More responses come in while the flow is being processed.
+      if len(RESULTS) < 3:
+        request_id = len(RESULTS) + 1
+        self.SendResponse(
+            session_id, "Hello%d" % request_id, request_id=request_id)
+
+    open_with_lock = mock.patch.object(
+        aff4.FACTORY, "OpenWithLock", wraps=aff4.FACTORY.OpenWithLock)
+    with test_lib.ConfigOverrider({"Worker.flow_batch_time": "60s"}):
+      with mock.patch.object(worker_lib.GRRWorker,
+                             "_ProcessRegularFlowMessages", ProcessAndRespond):
+        with open_with_lock as open_mock:
+          worker_obj = worker_lib.GRRWorker(token=self.token)
+          worker_obj.RunOnce()
+          worker_obj.thread_pool.Join()
+
+    self.assertEqual(RESULTS, ["Hello1", "Hello2", "Hello3"])
+    self.assertEqual(open_mock.call_count, 1)
+
+    flow_obj = aff4.FACTORY.Open(session_id, token=self.token)
+    self.assertEqual(flow_obj.context.next_processed_request, 4)
+    self.assertEqual(flow_obj.context.outstanding_requests, 7)
+
+    manager = queue_manager.QueueManager(token=self.token)
+    self.assertFalse(manager.GetNotificationsForSession(session_id))
+
+  def testProcessMessagesWithFairScheduling(self):
+    with test_lib.ConfigOverrider({"Worker.fair_scheduling": True}):
+      for i in range(3):
+        flow_obj = self.FlowSetup("WorkerSendingTestFlow")
+        flow_obj.Close()
+        self.SendResponse(flow_obj.session_id, "Hello%d" % i)
+
+      worker_obj = worker_lib.GRRWorker(token=self.token)
+      worker_obj.RunOnce()
+      worker_obj.scheduler.Join()
+      worker_obj.thread_pool.Join()
+
+    self.assertEqual(sorted(RESULTS), ["Hello0", "Hello1", "Hello2"])
+
+  def testFullHuntsLaneDoesNotHoldBackOtherFlows(self):
+    flow_obj = self.FlowSetup("WorkerSendingTestFlow")
+    flow_obj.Close()
+    self.SendResponse(flow_obj.session_id, "Hello")
+
+    hunt_id = rdfvalue.SessionID(base="aff4:/hunts", queue=queues.HUNTS)
+    manager = queue_manager.QueueManager(token=self.token)
+    with data_store.DB.GetMutationPool() as pool:
+      manager.NotifyQueue(
+          rdf_flows.GrrNotification(session_id=hunt_id), mutation_pool=pool)
+
+    with test_lib.ConfigOverrider({
+        "Worker.fair_scheduling": True,
+        "Worker.lane_queue_size": 1
+    }):
+      worker_obj = worker_lib.GRRWorker(token=self.token)
+
+    pool = FakeThreadPool(1)
+    worker_obj.scheduler.thread_pool = pool
+    worker_obj.scheduler.max_running = 1
+    # One hunt task runs, the next one fills the hunts lane.
+    for _ in range(2):
+      worker_obj.scheduler.AddTask(worker_obj.LANE_HUNTS, lambda: None, ())
+
+    hunt_notifications = manager.GetNotifications(queues.HUNTS)
+    self.assertEqual(len(hunt_notifications), 1)
+    flow_notifications = [
+        n for n in manager.GetNotifications(queues.FLOWS)
+        if n.session_id == flow_obj.session_id
+    ]
+    processed = worker_obj.ProcessMessages(
+        hunt_notifications + flow_notifications, manager)
+    self.assertEqual(processed, 1)
+    self.assertNotIn(hunt_id, worker_obj.queued_flows)
+    self.assertIn(flow_obj.session_id, worker_obj.queued_flows)
+
+    pool.RunAll()
+    self.assertEqual(RESULTS, ["Hello"])
+
+    # The hunt notification is left for the next poll.
+    notifications = manager.GetNotifications(queues.HUNTS)
+    self.assertEqual([n.session_id for n in notifications], [hunt_id])
+
+  def testGetLane(self):
+    worker_obj = worker_lib.GRRWorker(token=self.token)
+
+    self.assertEqual(
+        worker_obj.GetLane(
+            rdfvalue.SessionID(base="aff4:/hunts", queue=queues.HUNTS)),
+        worker_obj.LANE_HUNTS)
+    self.assertEqual(
+        worker_obj.GetLane(
+            rdfvalue.SessionID(base="aff4:/hunts/H:123456/C.1000000000000000")),
+        worker_obj.LANE_HUNTS)
+    self.assertEqual(
+        worker_obj.GetLane(rdfvalue.SessionID(base="aff4:/cron/OSBreakDown")),
+        worker_obj.LANE_SYSTEM)
+    self.assertEqual(
+        worker_obj.GetLane(rdfvalue.SessionID(flow_name="Stats")),
+        worker_obj.LANE_SYSTEM)
+    self.assertEqual(
+        worker_obj.GetLane(
+            rdfvalue.SessionID(base=self.client_id.Add("flows"))),
+        worker_obj.LANE_INTERACTIVE)
+
+  def testHeartbeatKeepsShortFlowLeases(self):
+    flow_obj = self.FlowSetup("WorkerSendingTestFlow")
+    session_id = flow_obj.session_id
+    flow_obj.Close()
+    self.SendResponse(session_id, "Hello1")
+
+    process_flow_messages = worker_lib.GRRWorker._ProcessRegularFlowMessages
+    leases = []
+
+    def HeartBeatAndProcess(worker, flow_obj, notification):
+      self.assertIn(flow_obj.session_id, worker.heartbeat.flows)
+      worker.heartbeat.HeartBeat()
+      leases.append(flow_obj.CheckLease())
+      process_flow_messages(worker, flow_obj, notification)
+
+    with test_lib.ConfigOverrider({"Worker.heartbeat_interval": "10s"}):
+      with mock.patch.object(worker_lib.GRRWorker,
+                             "_ProcessRegularFlowMessages",
+                             HeartBeatAndProcess):
+        worker_obj = worker_lib.GRRWorker(token=self.token)
+        worker_obj.RunOnce()
+        worker_obj.thread_pool.Join()
+
+    self.assertEqual(RESULTS, ["Hello1"])
+    self.assertEqual(len(leases), 1)
+    self.assertGreater(leases[0], 20)
+    self.assertLessEqual(leases[0], 30)
+    self.assertEqual(worker_obj.heartbeat.flows, {})
+
+    workers_subject = worker_lib.WorkerHeartbeat.WORKERS_URN.Add(
+        worker_obj.worker_id)
+    self.assertFalse(
+        list(data_store.DB.ResolvePrefix(workers_subject, "flow:")))
+
+  def testProfilingRecordsLockTime(self):
+    flow_obj = self.FlowSetup("WorkerSendingTestFlow")
+    flow_obj.Close()
+    self.SendResponse(flow_obj.session_id, "Hello1")
+
+    lock_times = stats.STATS.GetMetricValue("worker_flow_lock_time").count
+    with test_lib.ConfigOverrider({"Worker.profiling": True}):
+      worker_obj = worker_lib.GRRWorker(token=self.token)
+      worker_obj.RunOnce()
+      worker_obj.thread_pool.Join()
+
+    self.assertEqual(RESULTS, ["Hello1"])
+    self.assertEqual(
+        stats.STATS.GetMetricValue("worker_flow_lock_time").count,
+        lock_times + 1)
+
+  def testReaperNotifiesFlowsOfDeadWorkers(self):
+    flow_obj = self.FlowSetup("WorkerSendingTestFlow")
+    session_id = flow_obj.session_id
+
+    dead_workers = stats.STATS.GetMetricValue("worker_dead_workers")
+    reclaimed_flows = stats.STATS.GetMetricValue("worker_reclaimed_flows")
+
+    dead = worker_lib.WorkerHeartbeat("dead", interval=10, token=self.token)
+    alive = worker_lib.WorkerHeartbeat("alive", interval=10, token=self.token)
+    with test_lib.FakeTime(1000):
+      dead.HeartBeat()
+      dead.Register(flow_obj)
+      alive.HeartBeat()
+    flow_obj.Close()
+
+    manager = queue_manager.QueueManager(token=self.token)
+    manager.DeleteNotification(session_id)
+
+    # The dead worker's heartbeat is still valid.
+    with test_lib.FakeTime(1020):
+      self.assertEqual(alive.ReapDeadWorkers(), 0)
+
+    with test_lib.FakeTime(1031):
+      alive.HeartBeat()
+      self.assertEqual(alive.ReapDeadWorkers(), 1)
+
+    self.assertEqual([
+        n.session_id for n in manager.GetNotificationsForSession(session_id)
+    ], [session_id])
+    self.assertEqual(
+        stats.STATS.GetMetricValue("worker_dead_workers"), dead_workers + 1)
+    self.assertEqual(
+        stats.STATS.GetMetricValue("worker_reclaimed_flows"),
+        reclaimed_flows + 1)
+
+    # The dead worker is gone, the live one isn't reaped.
+    heartbeats = [
+        attribute for attribute, _, _ in data_store.DB.ResolvePrefix(
+            worker_lib.WorkerHeartbeat.WORKERS_URN, "heartbeat:")
+    ]
+    self.assertEqual(heartbeats, ["heartbeat:alive"])
+    with test_lib.FakeTime(1040):
+      self.assertEqual(alive.ReapDeadWorkers(), 0)
+
+
+class FakeThreadPool(object):
+  """A thread pool that only runs tasks when told to."""
+
+  def __init__(self, max_threads):
+    self.max_threads = max_threads
+    self.tasks = []
+    self.full = False
+
+  def AddTask(self, target, args, name, blocking=True, inline=True):
+    del name, blocking, inline  # Unused.
+    if self.full:
+      raise threadpool.Full()
+    self.tasks.append((target, args))
+
+  def RunAll(self):
+    while self.tasks:
+      target, args = self.tasks.pop(0)
+      target(*args)
+
+
+class FairSchedulerTest(test_lib.GRRBaseTest):
+  """Tests for the worker's fair scheduler."""
+
+  def setUp(self):
+    super(FairSchedulerTest, self).setUp()
+    self.pool = FakeThreadPool(1)
+    self.scheduler = worker_lib.FairScheduler(self.pool, {
+        "interactive": 10,
+        "hunts": 1
+    })
+    self.executed = []
+
+  def _AddTasks(self, lane, count):
+    for i in range(count):
+      self.scheduler.AddTask(
+          lane, self.executed.append, ("%s%d" % (lane, i),), name="test")
+
+  def testTasksAreLimitedToPoolSize(self):
+    self._AddTasks("hunts", 5)
+    self.assertEqual(len(self.pool.tasks), 1)
+    self.assertEqual(
+        stats.STATS.GetMetricValue(
+            "worker_lane_queue_depth", fields=["hunts"]), 4)
+
+    self.pool.RunAll()
+    self.assertEqual(self.executed, ["hunts%d" % i for i in range(5)])
+    self.assertEqual(
+        stats.STATS.GetMetricValue(
+            "worker_lane_queue_depth", fields=["hunts"]), 0)
+
+  def testLanesShareThePoolByWeight(self):
+    self._AddTasks("hunts", 20)
+    self._AddTasks("interactive", 20)
+    self.pool.RunAll()
+
+    self.assertEqual(len(self.executed), 40)
+    # One hunt task was running already when the interactive tasks came in,
+    # then the interactive lane gets ten tasks for every hunt task.
+    self.assertEqual(self.executed[0], "hunts0")
+    self.assertEqual(self.executed[1:11],
+                     ["interactive%d" % i for i in range(10)])
+    self.assertEqual(
+        len([t for t in self.executed[:22] if t.startswith("hunts")]), 2)
+
+  def testIdleLanesDoNotAccumulateCredit(self):
+    self._AddTasks("hunts", 10)
+    self.pool.RunAll()
+    self._AddTasks("interactive", 10)
+    self._AddTasks("hunts", 10)
+    self.pool.RunAll()
+
+    # The hunts lane didn't get to run more because the interactive lane was
+    # idle before.
+    self.assertEqual(self.executed[10:20],
+                     ["interactive%d" % i for i in range(10)])
+
+  def testFullPoolIsRetried(self):
+    self.pool.full = True
+    self._AddTasks("interactive", 2)
+    self.assertEqual(self.pool.tasks, [])
+
+    self.pool.full = False
+    self.scheduler.Dispatch()
+    self.pool.RunAll()
+    self.assertEqual(self.executed, ["interactive0", "interactive1"])
+
+  def testQueuedDuplicatesAreDropped(self):
+
+    def add():
+      return self.scheduler.AddTask(
+          "hunts", self.executed.append, ("hunt",), key="session")
+
+    # The first task is running already, so the second one is queued.
+    self.assertTrue(add())
+    self.assertTrue(add())
+    self.assertFalse(add())
+
+    self.pool.RunAll()
+    self.assertEqual(self.executed, ["hunt", "hunt"])
+    self.assertTrue(add())
+
+  def testFullLaneBlocksOrRaises(self):
+    scheduler = worker_lib.FairScheduler(
+        self.pool, {"hunts": 1}, max_queued=2)
+    for i in range(3):
+      scheduler.AddTask("hunts", self.executed.append, (i,))
+
+    with self.assertRaises(threadpool.Full):
+      scheduler.AddTask("hunts", self.executed.append, (3,), blocking=False)
+
+    thread = threading.Thread(
+        target=scheduler.AddTask, args=("hunts", self.executed.append, (3,)))
+    thread.start()
+    thread.join(0.2)
+    self.assertTrue(thread.is_alive())
+
+    # Running a task makes space in the lane.
+    target, args = self.pool.tasks.pop(0)
+    target(*args)
+    thread.join()
+
+    self.pool.RunAll()
+    self.assertEqual(self.executed, [0, 1, 2, 3])
+
+
+class ShardLeasesTest(test_lib.GRRBaseTest):
+  """Tests the division of notification shards among workers."""
+
+  def setUp(self):
+    super(ShardLeasesTest, self).setUp()
+    self.config_overrider = test_lib.ConfigOverrider({
+        "Worker.queue_shards": 5
+    })
+    self.config_overrider.Start()
+
+  def tearDown(self):
+    self.config_overrider.Stop()
+    super(ShardLeasesTest, self).tearDown()
+
+  def _CreateLeases(self, worker_id):
+    return worker_lib.ShardLeases(
+        [queues.FLOWS], worker_id=worker_id, lease_time=60, token=self.token)
+
+  def _Shards(self, *leases):
+    return [lease.GetShards(queues.FLOWS) for lease in leases]
+
+  def _UpdateAll(self, *leases):
+    # Workers only release shards once they know about new workers and only
+    # get shards others released, so this takes two rounds.
+    for _ in range(2):
+      for lease in leases:
+        lease.Update(force=True)
+
+  def testSingleWorkerLeasesAllShards(self):
+    leases = self._CreateLeases("worker1")
+    leases.Update()
+
+    all_shards = queue_manager.QueueManager(
+        token=self.token).GetAllNotificationShards(queues.FLOWS)
+    self.assertEqual(leases.GetShards(queues.FLOWS), sorted(all_shards))
+
+  def testShardsAreRebalancedWhenWorkersJoinAndLeave(self):
+    with test_lib.FakeTime(1000):
+      leases1 = self._CreateLeases("worker1")
+      leases2 = self._CreateLeases("worker2")
+
+      self._UpdateAll(leases1, leases2)
+      shards1, shards2 = self._Shards(leases1, leases2)
+      self.assertEqual(len(shards1) + len(shards2), 5)
+      self.assertFalse(set(shards1) & set(shards2))
+
+      leases3 = self._CreateLeases("worker3")
+      self._UpdateAll(leases1, leases2, leases3)
+      shards = self._Shards(leases1, leases2, leases3)
+      self.assertEqual(sorted(len(s) for s in shards), [1, 2, 2])
+      self.assertEqual(len(set(sum(shards, []))), 5)
+
+      leases3.ReleaseAll()
+      self._UpdateAll(leases1, leases2)
+      shards1, shards2 = self._Shards(leases1, leases2)
+      self.assertEqual(len(set(shards1) | set(shards2)), 5)
+
+  def testShardsOfVanishedWorkersArePickedUp(self):
+    with test_lib.FakeTime(1000):
+      leases1 = self._CreateLeases("worker1")
+      leases2 = self._CreateLeases("worker2")
+      self._UpdateAll(leases1, leases2)
+      self.assertLess(len(leases1.GetShards(queues.FLOWS)), 5)
+
+    # worker2 is gone without releasing its leases.
+    with test_lib.FakeTime(1030):
+      leases1.Update(force=True)
+      self.assertLess(len(leases1.GetShards(queues.FLOWS)), 5)
+
+    with test_lib.FakeTime(1061):
+      leases1.Update(force=True)
+      self.assertEqual(len(leases1.GetShards(queues.FLOWS)), 5)
+
 
 def main(argv):
   test_lib.main(argv)
@@ -1,7 +1,134 @@
 #!/usr/bin/env python
 """The blob store abstraction."""
 
+import hashlib
+import zlib
+
+from grr import config
 from grr.lib import registry
+from grr.lib import stats
+
+# Encoded blobs start with this marker followed by a single codec byte. The
+# marker is never a valid zlib header, so the AFF4 memory stream layer passes
+# encoded blobs through unchanged.
+BLOB_MARKER = "GRRBLOB\x00"
+
+CODEC_RAW = "R"
+CODEC_ZLIB = "Z"
+CODEC_ZERO = "0"
+
+_CODEC_NAMES = {
+    CODEC_RAW: "raw",
+    CODEC_ZLIB: "zlib",
+    CODEC_ZERO: "zero",
+}
+
+# Size of the prefix that is trial compressed to decide whether compressing
+# the whole blob is worth it, and the ratio the trial has to beat.
+_TRIAL_SIZE = 16 * 1024
+_TRIAL_MAX_RATIO = 0.9
+
+
+class BlobStoreMetricsInit(registry.InitHook):
+  """Install blob store metrics."""
+
+  def RunOnce(self):
+    stats.STATS.RegisterCounterMetric(
+        "blob_store_raw_bytes", fields=[("codec", str)])
+    stats.STATS.RegisterCounterMetric(
+        "blob_store_encoded_bytes", fields=[("codec", str)])
+    stats.STATS.RegisterEventMetric(
+        "blob_store_compression_ratio",
+        bins=[1, 1.5, 2, 3, 5, 10, 100, 1000])
+
+
+def _IsZeroBlob(content):
+  return (content and content[0] == "\x00" and
+          content.count("\x00") == len(content))
+
+
+def _IsCompressible(content):
+  if not content:
+    return False
+
+  sample = content[:_TRIAL_SIZE]
+  return len(zlib.compress(sample, 1)) < len(sample) * _TRIAL_MAX_RATIO
+
+
+def EncodeBlob(content):
+  """Encodes blob content for storage.
+
+  All-zero blobs are stored as their length only. Other blobs are zlib
+  compressed if a trial compression of their beginning suggests this pays off
+  and stored as they are otherwise.
+
+  Args:
+    content: The blob content as a string.
+
+  Returns:
+    The encoded blob, to be decoded with DecodeBlob.
+  """
+  if _IsZeroBlob(content):
+    codec, payload = CODEC_ZERO, str(len(content))
+  elif config.CONFIG["Blobstore.compression"] and _IsCompressible(content):
+    codec, payload = CODEC_ZLIB, zlib.compress(content)
+    if len(payload) >= len(content):
+      codec, payload = CODEC_RAW, content
+  else:
+    codec, payload = CODEC_RAW, content
+
+  encoded = BLOB_MARKER + codec + payload
+
+  codec_name = _CODEC_NAMES[codec]
+  stats.STATS.IncrementCounter(
+      "blob_store_raw_bytes", len(content), fields=[codec_name])
+  stats.STATS.IncrementCounter(
+      "blob_store_encoded_bytes", len(encoded), fields=[codec_name])
+  if content:
+    stats.STATS.RecordEvent("blob_store_compression_ratio",
+                            float(len(content)) / len(encoded))
+
+  return encoded
+
+
+def DecodeBlob(digest, data, verify=False):
+  """Decodes a blob written by EncodeBlob.
+
+  Blobs stored before blob encoding was introduced carry no codec marker and
+  are returned unchanged. Such a legacy blob could itself start with the
+  marker, so with verify set decoded content is only accepted if it matches
+  the blob's digest. This costs hashing every blob that is read and is
+  therefore left to the Blobstore.verify_digests option.
+
+  Args:
+    digest: The hex SHA-256 digest identifying the blob.
+    data: The data as stored in the blob store.
+    verify: If True, check the decoded content against the digest.
+
+  Returns:
+    The blob content.
+  """
+  if not data.startswith(BLOB_MARKER):
+    return data
+
+  codec = data[len(BLOB_MARKER):len(BLOB_MARKER) + 1]
+  payload = data[len(BLOB_MARKER) + 1:]
+  try:
+    if codec == CODEC_RAW:
+      content = payload
+    elif codec == CODEC_ZLIB:
+      content = zlib.decompress(payload)
+    elif codec == CODEC_ZERO:
+      content = "\x00" * int(payload)
+    else:
+      return data
+  except (zlib.error, ValueError, MemoryError):
+    return data
+
+  if verify and hashlib.sha256(content).hexdigest() != digest.lower():
+    return data
+
+  return content
 
 
 class Blobstore(object):
@@ -9,6 +136,10 @@ class Blobstore(object):
 
   __metaclass__ = registry.MetaclassRegistry
 
+  def __init__(self):
+    super(Blobstore, self).__init__()
+    self.verify_digests = config.CONFIG["Blobstore.verify_digests"]
+
   def StoreBlob(self, content, token=None):
     return self.StoreBlobs([content], token=token)[0]
 
@@ -51,3 +182,23 @@ class Blobstore(object):
     Returns:
       A dict mapping each identifier to a boolean value indicating existence.
     """
+
+  def DeleteBlobs(self, identifiers, token=None):
+    """Deletes blobs.
+
+    Args:
+      identifiers: A list of identifiers for the blobs to delete.
+      token: Data store token.
+    """
+
+  def ListBlobs(self, after=None, token=None):
+    """Lists all stored blobs in identifier order.
+
+    Args:
+      after: If set, only blobs with identifiers sorting after this one are
+        listed.
+      token: Data store token.
+
+    Yields:
+      Tuples of blob identifier and the RDFDatetime the blob was stored at.
+    """
@@ -0,0 +1,107 @@
+#!/usr/bin/env python
+"""Tests for the blob store abstraction."""
+
+import hashlib
+import os
+import zlib
+
+from grr.lib import flags
+from grr.server.grr_response_server import aff4
+from grr.server.grr_response_server import blob_store
+from grr.server.grr_response_server import data_store
+from grr.test_lib import test_lib
+
+
+class BlobEncodingTest(test_lib.GRRBaseTest):
+
+  def _RoundTrip(self, content):
+    encoded = blob_store.EncodeBlob(content)
+    digest = hashlib.sha256(content).hexdigest()
+    self.assertEqual(blob_store.DecodeBlob(digest, encoded), content)
+    return encoded
+
+  def _Codec(self, encoded):
+    self.assertTrue(encoded.startswith(blob_store.BLOB_MARKER))
+    return encoded[len(blob_store.BLOB_MARKER)]
+
+  def testCompressibleBlobsAreCompressed(self):
+    content = "foobar" * 10000
+    encoded = self._RoundTrip(content)
+
+    self.assertEqual(self._Codec(encoded), blob_store.CODEC_ZLIB)
+    self.assertLess(len(encoded), len(content) // 10)
+
+  def testIncompressibleBlobsAreStoredRaw(self):
+    encoded = self._RoundTrip(os.urandom(64 * 1024))
+    self.assertEqual(self._Codec(encoded), blob_store.CODEC_RAW)
+
+  def testZeroBlobsAreStoredAsLength(self):
+    encoded = self._RoundTrip("\x00" * 512 * 1024)
+
+    self.assertEqual(self._Codec(encoded), blob_store.CODEC_ZERO)
+    self.assertLess(len(encoded), 32)
+
+  def testEmptyBlob(self):
+    self._RoundTrip("")
+
+  def testCompressionCanBeDisabled(self):
+    with test_lib.ConfigOverrider({"Blobstore.compression": False}):
+      encoded = self._RoundTrip("foobar" * 10000)
+
+    self.assertEqual(self._Codec(encoded), blob_store.CODEC_RAW)
+
+  def testUnencodedBlobsAreReturnedUnchanged(self):
+    content = "foobar"
+    self.assertEqual(
+        blob_store.DecodeBlob(hashlib.sha256(content).hexdigest(), content),
+        content)
+
+  def testUnencodedBlobsStartingWithTheMarkerAreReturnedUnchanged(self):
+    content = (
+        blob_store.BLOB_MARKER + blob_store.CODEC_ZLIB + zlib.compress("foo"))
+    digest = hashlib.sha256(content).hexdigest()
+    self.assertEqual(
+        blob_store.DecodeBlob(digest, content, verify=True), content)
+    # Without verification the marker alone decides.
+    self.assertEqual(blob_store.DecodeBlob(digest, content), "foo")
+
+
+class MemoryStreamBlobstoreTest(test_lib.GRRBaseTest):
+
+  def testStoreAndReadBlobs(self):
+    contents = ["foobar" * 10000, os.urandom(1024), "\x00" * 1024]
+    digests = data_store.DB.StoreBlobs(contents, token=self.token)
+
+    self.assertEqual(
+        data_store.DB.ReadBlobs(digests, token=self.token),
+        dict(zip(digests, contents)))
+
+  def testBlobSizeIsContentSize(self):
+    content = "\x00" * 1024
+    digest = data_store.DB.StoreBlobs([content], token=self.token)[0]
+
+    fd = aff4.FACTORY.Open("aff4:/blobs/%s" % digest, token=self.token)
+    self.assertEqual(fd.Get(fd.Schema.SIZE), len(content))
+
+  def testListBlobsAfter(self):
+    digests = sorted(
+        data_store.DB.StoreBlobs(["blob%d" % i for i in range(20)],
+                                 token=self.token))
+    blobstore = data_store.DB.blobstore
+
+    self.assertEqual(
+        [digest for digest, _ in blobstore.ListBlobs(token=self.token)],
+        digests)
+    for i in [0, 7, 19]:
+      self.assertEqual([
+          digest for digest, _ in blobstore.ListBlobs(
+              after=digests[i], token=self.token)
+      ], digests[i + 1:])
+
+
+def main(argv):
+  test_lib.main(argv)
+
+
+if __name__ == "__main__":
+  flags.StartMain(main)
@@ -0,0 +1,241 @@
+#!/usr/bin/env python
+"""A content-addressed blob store keeping blobs in a local directory."""
+
+import errno
+import hashlib
+import logging
+from multiprocessing import pool
+import os
+import re
+import struct
+import tempfile
+import threading
+
+from grr import config
+from grr.lib import rdfvalue
+from grr.server.grr_response_server import blob_store
+
+_DIGEST_RE = re.compile(r"^[0-9a-f]{64}$")
+
+
+class PresenceIndex(object):
+  """A bloom filter over the digests of stored blobs.
+
+  Blob identifiers are SHA-256 digests, so their bytes are already uniformly
+  distributed and the bit positions are simply taken from consecutive 32 bit
+  slices of the digest instead of being computed by additional hash functions.
+  """
+
+  # With 10 bits per expected element and 7 probes the false positive rate
+  # stays at about 1% up to the configured capacity.
+  BITS_PER_ELEMENT = 10
+  PROBES = 7
+
+  def __init__(self, capacity):
+    self.num_bits = max(capacity, 1) * self.BITS_PER_ELEMENT
+    self.bits = bytearray((self.num_bits + 7) // 8)
+    self.lock = threading.Lock()
+
+  def _Positions(self, digest):
+    raw = digest.decode("hex")
+    for i in xrange(self.PROBES):
+      yield struct.unpack_from(">I", raw, i * 4)[0] % self.num_bits
+
+  def Add(self, digest):
+    with self.lock:
+      for pos in self._Positions(digest):
+        self.bits[pos >> 3] |= 1 << (pos & 7)
+
+  def MayContain(self, digest):
+    for pos in self._Positions(digest):
+      if not self.bits[pos >> 3] & (1 << (pos & 7)):
+        return False
+    return True
+
+
+class FilesystemBlobstore(blob_store.Blobstore):
+  """A blob store keeping every blob in its own file.
+
+  Blobs are stored under their hex SHA-256 digest in a two level fan-out
+  directory layout (ab/cd/abcd...), so no directory grows beyond a few
+  thousand entries. Writes go to a temporary file in the target directory
+  that is renamed into place, so readers never see partially written blobs.
+  """
+
+  def __init__(self, location=None):
+    super(FilesystemBlobstore, self).__init__()
+    self.location = location or config.CONFIG["FilesystemBlobstore.location"]
+    self.threads = config.CONFIG["FilesystemBlobstore.threads"]
+    self._pool = None
+    self._pool_lock = threading.Lock()
+
+    self._index = None
+    self._index_ready = threading.Event()
+    if config.CONFIG["FilesystemBlobstore.use_presence_index"]:
+      self._index = PresenceIndex(
+          config.CONFIG["FilesystemBlobstore.presence_index_capacity"])
+      index_thread = threading.Thread(
+          name="FilesystemBlobstore index thread", target=self._BuildIndex)
+      index_thread.daemon = True
+      index_thread.start()
+
+  def _BuildIndex(self):
+    """Adds all blobs already on disk to the presence index."""
+    count = 0
+    for _, _, filenames in os.walk(self.location):
+      for filename in filenames:
+        if _DIGEST_RE.match(filename):
+          self._index.Add(filename)
+          count += 1
+
+    logging.info("Blob store presence index built (%d blobs).", count)
+    self._index_ready.set()
+
+  def _NormalizeDigest(self, digest):
+    normalized = digest.lower()
+    if not _DIGEST_RE.match(normalized):
+      raise ValueError("Invalid blob identifier: %r" % digest)
+
+    return normalized
+
+  def _BlobPath(self, digest):
+    digest = self._NormalizeDigest(digest)
+    return os.path.join(self.location, digest[0:2], digest[2:4], digest)
+
+  def _Map(self, func, items):
+    """Applies func to all items, using the thread pool for batches."""
+    if len(items) <= 1 or self.threads <= 1:
+      return map(func, items)
+
+    with self._pool_lock:
+      if self._pool is None:
+        self._pool = pool.ThreadPool(processes=self.threads)
+
+    return self._pool.map(func, items)
+
+  def _WriteBlob(self, digest_and_content):
+    digest, content = digest_and_content
+    path = self._BlobPath(digest)
+    if os.path.exists(path):
+      logging.debug("Blob %s already stored.", digest)
+      return
+
+    dirname = os.path.dirname(path)
+    try:
+      os.makedirs(dirname)
+    except OSError as e:
+      if e.errno != errno.EEXIST:
+        raise
+
+    fd, tmp_path = tempfile.mkstemp(prefix=".tmp-", dir=dirname)
+    try:
+      with os.fdopen(fd, "wb") as tmp_file:
+        tmp_file.write(blob_store.EncodeBlob(content))
+        tmp_file.flush()
+        os.fsync(tmp_file.fileno())
+      os.rename(tmp_path, path)
+    finally:
+      if os.path.exists(tmp_path):
+        os.remove(tmp_path)
+
+    logging.debug("Got blob %s (length %s)", digest, len(content))
+
+  def _ReadBlob(self, digest):
+    try:
+      with open(self._BlobPath(digest), "rb") as fd:
+        return blob_store.DecodeBlob(
+            digest, fd.read(), verify=self.verify_digests)
+    except IOError as e:
+      if e.errno == errno.ENOENT:
+        return None
+      raise
+
+  def _BlobExists(self, digest):
+    return os.path.exists(self._BlobPath(digest))
+
+  def StoreBlobs(self, contents, token=None):
+    """Creates or overwrites blobs."""
+    del token  # Unused.
+
+    digests = [hashlib.sha256(content).hexdigest() for content in contents]
+    self._Map(self._WriteBlob, dict(zip(digests, contents)).items())
+
+    if self._index is not None:
+      for digest in digests:
+        self._index.Add(digest)
+
+    return digests
+
+  def ReadBlobs(self, digests, token=None):
+    del token  # Unused.
+
+    digests = list(digests)
+    return dict(zip(digests, self._Map(self._ReadBlob, digests)))
+
+  def BlobsExist(self, digests, token=None):
+    """Check if blobs for the given digests already exist."""
+    del token  # Unused.
+
+    res = {digest: False for digest in digests}
+
+    # Digests the index has never seen are certainly missing, the rest may be
+    # false positives or deleted blobs and have to be checked on disk. Until
+    # the index has seen everything already on disk it can't rule blobs out.
+    to_check = list(res)
+    if self._index is not None and self._index_ready.is_set():
+      to_check = [
+          d for d in to_check
+          if self._index.MayContain(self._NormalizeDigest(d))
+      ]
+
+    for digest, exists in zip(to_check, self._Map(self._BlobExists, to_check)):
+      res[digest] = exists
+
+    return res
+
+  def DeleteBlobs(self, digests, token=None):
+    del token  # Unused.
+
+    for digest in digests:
+      try:
+        os.remove(self._BlobPath(digest))
+      except OSError as e:
+        if e.errno != errno.ENOENT:
+          raise
+
+  def _ListDirectory(self, path, minimum):
+    """Returns the sorted names in path not sorting before minimum."""
+    try:
+      names = os.listdir(path)
+    except OSError as e:
+      if e.errno in (errno.ENOENT, errno.ENOTDIR):
+        return []
+      raise
+
+    return sorted(name for name in names if name >= minimum)
+
+  def ListBlobs(self, after=None, token=None):
+    del token  # Unused.
+
+    after = self._NormalizeDigest(after) if after else ""
+
+    # The fan-out directories are named after the digest prefixes, so listing
+    # them in order lists the blobs in order.
+    for first in self._ListDirectory(self.location, after[0:2]):
+      first_dir = os.path.join(self.location, first)
+      second_minimum = after[2:4] if first == after[0:2] else ""
+      for second in self._ListDirectory(first_dir, second_minimum):
+        second_dir = os.path.join(first_dir, second)
+        for filename in self._ListDirectory(second_dir, after):
+          if filename == after or not _DIGEST_RE.match(filename):
+            continue
+
+          try:
+            mtime = os.stat(os.path.join(second_dir, filename)).st_mtime
+          except OSError as e:
+            # Deleted while we were listing.
+            if e.errno == errno.ENOENT:
+              continue
+            raise
+
+          yield filename, rdfvalue.RDFDatetime.FromSecondsSinceEpoch(mtime)
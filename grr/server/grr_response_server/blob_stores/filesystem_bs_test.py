@@ -0,0 +1,157 @@
+#!/usr/bin/env python
+"""Tests for the filesystem based blob store."""
+
+import hashlib
+import os
+
+from grr.lib import flags
+from grr.lib import rdfvalue
+from grr.server.grr_response_server import blob_store
+from grr.server.grr_response_server.blob_stores import filesystem_bs
+from grr.test_lib import test_lib
+
+
+class PresenceIndexTest(test_lib.GRRBaseTest):
+
+  def testAddedDigestsArePresent(self):
+    index = filesystem_bs.PresenceIndex(1000)
+    digests = [hashlib.sha256(str(i)).hexdigest() for i in range(1000)]
+    for digest in digests:
+      index.Add(digest)
+
+    for digest in digests:
+      self.assertTrue(index.MayContain(digest))
+
+  def testFalsePositiveRateIsLow(self):
+    index = filesystem_bs.PresenceIndex(1000)
+    for i in range(1000):
+      index.Add(hashlib.sha256(str(i)).hexdigest())
+
+    false_positives = sum(
+        index.MayContain(hashlib.sha256("other%d" % i).hexdigest())
+        for i in range(10000))
+    self.assertLess(false_positives, 300)
+
+
+class FilesystemBlobstoreTest(test_lib.GRRBaseTest):
+
+  def setUp(self):
+    super(FilesystemBlobstoreTest, self).setUp()
+    self.location = os.path.join(self.temp_dir, "blobs")
+    self.blobstore = self._CreateBlobstore()
+
+  def _CreateBlobstore(self, use_presence_index=True):
+    with test_lib.ConfigOverrider({
+        "FilesystemBlobstore.threads": 4,
+        "FilesystemBlobstore.use_presence_index": use_presence_index,
+        "FilesystemBlobstore.presence_index_capacity": 1000,
+    }):
+      blobstore = filesystem_bs.FilesystemBlobstore(location=self.location)
+    if use_presence_index:
+      blobstore._index_ready.wait()  # pylint: disable=protected-access
+    return blobstore
+
+  def testStoreAndReadBlobs(self):
+    contents = ["foo", "bar", "baz" * 1024]
+    digests = self.blobstore.StoreBlobs(contents)
+
+    self.assertEqual(digests,
+                     [hashlib.sha256(content).hexdigest()
+                      for content in contents])
+    self.assertEqual(
+        self.blobstore.ReadBlobs(digests), dict(zip(digests, contents)))
+    self.assertEqual(self.blobstore.ReadBlob(digests[0]), "foo")
+
+  def testStoreBlobsUsesFanOutLayout(self):
+    digest = self.blobstore.StoreBlob("foo")
+
+    path = os.path.join(self.location, digest[0:2], digest[2:4], digest)
+    with open(path, "rb") as fd:
+      self.assertEqual(blob_store.DecodeBlob(digest, fd.read()), "foo")
+    self.assertEqual(os.listdir(os.path.dirname(path)), [digest])
+
+  def testStoreBlobsIsIdempotent(self):
+    digests = self.blobstore.StoreBlobs(["foo", "foo"])
+    self.assertEqual(digests[0], digests[1])
+
+    self.blobstore.StoreBlobs(["foo"])
+    self.assertEqual(self.blobstore.ReadBlob(digests[0]), "foo")
+
+  def testReadMissingBlobs(self):
+    digest = self.blobstore.StoreBlob("foo")
+    missing = hashlib.sha256("bar").hexdigest()
+
+    self.assertEqual(
+        self.blobstore.ReadBlobs([digest, missing]), {
+            digest: "foo",
+            missing: None
+        })
+
+  def testBlobsExist(self):
+    digest = self.blobstore.StoreBlob("foo")
+    missing = hashlib.sha256("bar").hexdigest()
+
+    self.assertEqual(
+        self.blobstore.BlobsExist([digest, missing]), {
+            digest: True,
+            missing: False
+        })
+
+  def testBlobsExistAfterRestart(self):
+    digest = self.blobstore.StoreBlob("foo")
+
+    blobstore = self._CreateBlobstore()
+    self.assertTrue(blobstore.BlobExists(digest))
+    self.assertFalse(blobstore.BlobExists(hashlib.sha256("bar").hexdigest()))
+
+  def testBlobsExistWithoutPresenceIndex(self):
+    blobstore = self._CreateBlobstore(use_presence_index=False)
+    digest = self.blobstore.StoreBlob("foo")
+
+    self.assertTrue(blobstore.BlobExists(digest))
+    self.assertFalse(blobstore.BlobExists(hashlib.sha256("bar").hexdigest()))
+
+  def testDeleteBlobs(self):
+    digests = self.blobstore.StoreBlobs(["foo", "bar"])
+    missing = hashlib.sha256("baz").hexdigest()
+    self.blobstore.DeleteBlobs(digests[:1] + [missing])
+
+    self.assertEqual(
+        self.blobstore.BlobsExist(digests), {
+            digests[0]: False,
+            digests[1]: True
+        })
+
+  def testListBlobs(self):
+    digests = self.blobstore.StoreBlobs(["foo", "bar"])
+    for digest in digests:
+      os.utime(self.blobstore._BlobPath(digest), (100, 100))
+
+    self.assertEqual(
+        list(self.blobstore.ListBlobs()),
+        [(digest, rdfvalue.RDFDatetime.FromSecondsSinceEpoch(100))
+         for digest in sorted(digests)])
+
+  def testListBlobsAfter(self):
+    digests = sorted(
+        self.blobstore.StoreBlobs(["blob%d" % i for i in range(50)]))
+
+    for i in [0, 17, 49]:
+      self.assertEqual(
+          [digest for digest, _ in self.blobstore.ListBlobs(after=digests[i])],
+          digests[i + 1:])
+
+  def testInvalidIdentifiersAreRejected(self):
+    with self.assertRaises(ValueError):
+      self.blobstore.ReadBlob("../../etc/passwd")
+
+    with self.assertRaises(ValueError):
+      self.blobstore.BlobExists("foo")
+
+
+def main(argv):
+  test_lib.main(argv)
+
+
+if __name__ == "__main__":
+  flags.StartMain(main)
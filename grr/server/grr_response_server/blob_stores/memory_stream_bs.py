@@ -19,10 +19,8 @@ class MemoryStreamBlobstore(blob_store.Blobstore):
   def StoreBlobs(self, contents, token=None):
     """Creates or overwrites blobs."""
 
-    contents_by_digest = {
-        hashlib.sha256(content).hexdigest(): content
-        for content in contents
-    }
+    digests = [hashlib.sha256(content).hexdigest() for content in contents]
+    contents_by_digest = dict(zip(digests, contents))
 
     urns = {self._BlobUrn(digest): digest for digest in contents_by_digest}
 
@@ -43,14 +41,15 @@ class MemoryStreamBlobstore(blob_store.Blobstore):
           token=token,
           mutation_pool=mutation_pool)
       content = contents_by_digest[digest]
-      fd.Write(content)
-      fd.Close()
+      # The encoded blob is stored as is, the memory stream would otherwise
+      # compress it again. The size is the one of the blob content though.
+      fd.OverwriteAndClose(blob_store.EncodeBlob(content), len(content))
 
       logging.debug("Got blob %s (length %s)", digest, len(content))
 
     mutation_pool.Flush()
 
-    return contents_by_digest.keys()
+    return digests
 
   def ReadBlobs(self, digests, token=None):
     res = {digest: None for digest in digests}
@@ -59,7 +58,9 @@ class MemoryStreamBlobstore(blob_store.Blobstore):
     fds = aff4.FACTORY.MultiOpen(urns, mode="r", token=token)
 
     for fd in fds:
-      res[urns[fd.urn]] = fd.read()
+      digest = urns[fd.urn]
+      res[digest] = blob_store.DecodeBlob(
+          digest, fd.read(), verify=self.verify_digests)
 
     return res
 
@@ -80,3 +81,18 @@ class MemoryStreamBlobstore(blob_store.Blobstore):
   def DeleteBlobs(self, digests, token=None):
     aff4.FACTORY.MultiDelete(
         [self._BlobUrn(digest) for digest in digests], token=token)
+
+  def ListBlobs(self, after=None, token=None):
+    del token  # Unused.
+
+    after_urn = None
+    if after:
+      after_urn = self._BlobUrn(after.lower())
+
+    # Blob subjects may also hold other attributes, only those with an AFF4
+    # type are actually stored blobs.
+    for subject, timestamp, _ in data_store.DB.ScanAttribute(
+        "aff4:/blobs",
+        aff4.AFF4Object.SchemaCls.TYPE.predicate,
+        after_urn=after_urn):
+      yield rdfvalue.RDFURN(subject).Basename(), rdfvalue.RDFDatetime(timestamp)
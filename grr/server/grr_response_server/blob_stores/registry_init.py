@@ -5,3 +5,6 @@
 
 # The memory stream object based blob store.
 from grr.server.grr_response_server.blob_stores import memory_stream_bs
+
+# The local filesystem based blob store.
+from grr.server.grr_response_server.blob_stores import filesystem_bs
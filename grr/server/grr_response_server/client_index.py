@@ -322,6 +322,7 @@ class ClientIndex(object):
 
   START_TIME_PREFIX = "start_date:"
   START_TIME_PREFIX_LEN = len(START_TIME_PREFIX)
+  PREFIX_WILDCARD = "*"
 
   def _NormalizeKeyword(self, keyword):
     return keyword.lower()
@@ -346,14 +347,28 @@ class ClientIndex(object):
 
     return start_time, filtered_keywords
 
-  def LookupClients(self, keywords):
-    """Returns a list of client URNs associated with keywords.
+  def LookupClients(self,
+                    keywords,
+                    label_names=None,
+                    label_owners=None,
+                    after_client_id=None,
+                    limit=None):
+    """Returns a list of client ids associated with keywords.
+
+    A keyword ending with "*" (e.g. "host:web*") matches all keywords starting
+    with the part preceding the "*".
 
     Args:
       keywords: The list of keywords to search by.
+      label_names: If set, only clients with one of these labels are returned.
+      label_owners: If set, only labels owned by one of these users are
+        considered by the label_names filter.
+      after_client_id: If set, only clients with ids greater than this one are
+        returned.
+      limit: If set, the maximum number of client ids to return.
 
     Returns:
-      A list of client URNs.
+      A sorted list of client ids.
 
     Raises:
       ValueError: A string (single keyword) was passed instead of an iterable.
@@ -364,19 +379,22 @@ class ClientIndex(object):
 
     start_time, filtered_keywords = self._AnalyzeKeywords(keywords)
 
-    keyword_map = data_store.REL_DB.ListClientsForKeywords(
-        map(self._NormalizeKeyword, filtered_keywords), start_time=start_time)
-
-    results = keyword_map.values()
-    relevant_set = set(results[0])
-
-    for hits in results:
-      relevant_set &= set(hits)
-
-      if not relevant_set:
-        return []
-
-    return sorted(relevant_set)
+    exact_keywords = set()
+    keyword_prefixes = set()
+    for keyword in map(self._NormalizeKeyword, filtered_keywords):
+      if keyword.endswith(self.PREFIX_WILDCARD) and len(keyword) > 1:
+        keyword_prefixes.add(keyword[:-1])
+      else:
+        exact_keywords.add(keyword)
+
+    return data_store.REL_DB.SearchClients(
+        exact_keywords,
+        keyword_prefixes=keyword_prefixes,
+        start_time=start_time,
+        label_names=label_names,
+        label_owners=label_owners,
+        after_client_id=after_client_id,
+        limit=limit)
 
   def ReadClientPostingLists(self, keywords):
     """Looks up all clients associated with any of the given keywords.
@@ -382,6 +382,29 @@ class ClientIndexTest(aff4_test_lib.AFF4ObjectTest):
     # Universal keyword should find everything.
     self.assertItemsEqual(index.LookupClients(["."]), list(clients))
 
+  def testLookupClientsPrefixesAndPages(self):
+    index = client_index.ClientIndex()
+
+    clients = self._SetupClients(3)
+    for client_id, client in clients.items():
+      data_store.REL_DB.WriteClientMetadata(client_id, fleetspeak_enabled=False)
+      index.AddClient(client)
+    data_store.REL_DB.AddClientLabels("C.1000000000000002", "owner", ["prod"])
+
+    self.assertEqual(index.LookupClients(["host:HOST-*"]), sorted(clients))
+    self.assertEqual(
+        index.LookupClients(["windows", "ip:192.168.0.3*"]),
+        ["C.1000000000000003"])
+    self.assertEqual(
+        index.LookupClients(["host:host-*"], label_names=["prod"]),
+        ["C.1000000000000002"])
+    self.assertEqual(
+        index.LookupClients(["."], limit=2),
+        ["C.1000000000000001", "C.1000000000000002"])
+    self.assertEqual(
+        index.LookupClients(["."], after_client_id="C.1000000000000002"),
+        ["C.1000000000000003"])
+
   def testAddTimestamp(self):
     index = client_index.ClientIndex()
 
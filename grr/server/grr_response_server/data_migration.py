@@ -138,8 +138,13 @@ class ClientsMigrator(object):
       raise AssertionError(message)
 
   def _MigrateBatch(self, batch):
-    for client in aff4.FACTORY.MultiOpen(batch, mode="r", age=aff4.ALL_TIMES):
-      _WriteClient(client)
+    clients = list(
+        aff4.FACTORY.MultiOpen(batch, mode="r", age=aff4.ALL_TIMES))
+    _WriteClientsMetadata(clients)
+
+    for client in clients:
+      _WriteClientHistory(client)
+      _WriteClientLabels(client)
 
       with self._lock:
         self._migrated_count += 1
@@ -165,15 +170,17 @@ class ClientsMigrator(object):
     self._last_progress_time = rdfvalue.RDFDatetime.Now()
 
 
-def _WriteClient(client):
-  """Store the AFF4 client in the relational database."""
-  _WriteClientMetadata(client)
-  _WriteClientHistory(client)
-  _WriteClientLabels(client)
+def _WriteClientsMetadata(clients):
+  """Store the AFF4 clients metadata in the relational database."""
+  metadatas = {}
+  for client in clients:
+    metadatas[client.urn.Basename()] = _ConvertClientMetadata(client)
+
+  data_store.REL_DB.MultiWriteClientMetadata(metadatas)
 
 
-def _WriteClientMetadata(client):
-  """Store the AFF4 client metadata in the relational database."""
+def _ConvertClientMetadata(client):
+  """Converts the AFF4 client metadata to a ClientMetadata object."""
   client_ip = client.Get(client.Schema.CLIENT_IP)
   if client_ip:
     last_ip = rdf_client.NetworkAddress(
@@ -181,14 +188,13 @@ def _WriteClientMetadata(client):
   else:
     last_ip = None
 
-  data_store.REL_DB.WriteClientMetadata(
-      client.urn.Basename(),
+  return rdf_objects.ClientMetadata(
       certificate=client.Get(client.Schema.CERT),
       fleetspeak_enabled=client.Get(client.Schema.FLEETSPEAK_ENABLED) or False,
-      last_ping=client.Get(client.Schema.PING),
-      last_clock=client.Get(client.Schema.CLOCK),
-      last_ip=last_ip,
-      last_foreman=client.Get(client.Schema.LAST_FOREMAN_TIME),
+      ping=client.Get(client.Schema.PING),
+      clock=client.Get(client.Schema.CLOCK),
+      ip=last_ip,
+      last_foreman_time=client.Get(client.Schema.LAST_FOREMAN_TIME),
       first_seen=client.Get(client.Schema.FIRST_SEEN))
 
 
@@ -512,6 +512,17 @@ class MutationPool(object):
     predicate = (DataStore.FILE_HASH_TEMPLATE % file_path).lower()
     self.MultiSet(subject, {predicate: file_path})
 
+  def BlobReferenceIndexAddItems(self, file_path, blobs):
+    """Records that file_path references the given (digest, length) blobs."""
+    file_path = utils.SmartStr(file_path)
+    predicate = (DataStore.BLOB_REFERENCE_TEMPLATE % file_path).lower()
+    for digest, length in blobs:
+      self.MultiSet(
+          DataStore.BlobReferenceSubject(digest), {
+              predicate: [file_path],
+              DataStore.BLOB_SIZE_ATTRIBUTE: [length]
+          })
+
   def AFF4AddChild(self, subject, child, extra_attributes=None):
     attributes = {
         DataStore.AFF4_INDEX_DIR_TEMPLATE % utils.SmartStr(child): [
@@ -561,12 +572,25 @@ class DataStore(object):
   AFF4_INDEX_DIR_PREFIX = "index:dir/"
   AFF4_INDEX_DIR_TEMPLATE = "index:dir/%s"
 
+  # Files referencing a blob are recorded on the blob's subject, together with
+  # the blob size.
+  BLOB_REFERENCE_ROOT = "aff4:/blobs"
+  BLOB_REFERENCE_PREFIX = "index:blobref:"
+  BLOB_REFERENCE_TEMPLATE = "index:blobref:%s"
+  BLOB_SIZE_ATTRIBUTE = "index:blobsize"
+  # Blobs the blob garbage collection found unreferenced carry a tombstone
+  # until they are deleted or referenced again.
+  BLOB_TOMBSTONE_ATTRIBUTE = "index:blobtombstone"
+
   mutation_pool_cls = MutationPool
 
   flusher_thread = None
   enable_flusher_thread = True
   monitor_thread = None
 
+  # Number of blob identifiers known to exist that are kept in memory.
+  BLOB_EXISTENCE_CACHE_SIZE = 100000
+
   def __init__(self):
     if self.enable_flusher_thread:
       # Start the flusher thread.
@@ -583,6 +607,10 @@ class DataStore(object):
       raise ValueError("No blob store %s found." % blobstore_name)
 
     self.blobstore = cls()
+    self.blob_existence_cache = utils.FastStore(
+        max_size=self.BLOB_EXISTENCE_CACHE_SIZE)
+    self.blob_existence_cache_ttl = config.CONFIG[
+        "Datastore.blob_existence_cache_ttl"].seconds
 
   def InitializeMonitorThread(self):
     """Start the thread that registers the size of the DataStore."""
@@ -957,21 +985,79 @@ class DataStore(object):
     return self.blobstore.ReadBlobs(identifiers, token=token)
 
   def StoreBlob(self, content, token=None):
-    return self.blobstore.StoreBlob(content, token=token)
+    return self.StoreBlobs([content], token=token)[0]
 
   def StoreBlobs(self, contents, token=None):
-    return self.blobstore.StoreBlobs(contents, token=token)
+    identifiers = self.blobstore.StoreBlobs(contents, token=token)
+
+    # The blobs are in use again, so the garbage collection must not delete
+    # them anymore.
+    tombstoned = self.BlobTombstonesQueryMultiple(set(identifiers))
+    if tombstoned:
+      self.BlobTombstonesDelete(tombstoned)
+
+    now = time.time()
+    for identifier in identifiers:
+      self.blob_existence_cache.Put(identifier, now)
+    return identifiers
 
   def BlobExists(self, identifier, token=None):
     return self.BlobsExist([identifier], token=token).values()[0]
 
   def BlobsExist(self, identifiers, token=None):
-    return self.blobstore.BlobsExist(identifiers, token=token)
+    """Checks if blobs for the given identifiers already exist.
+
+    Blobs found to exist are remembered for Datastore.blob_existence_cache_ttl
+    and only the remaining identifiers are passed on to the blob store. Cached
+    blobs may have been deleted by another process in the meantime, the blob
+    garbage collection only deletes blobs this long after it has last seen
+    them referenced. Missing blobs are not cached since they may be written
+    by another process at any time. Blobs marked for deletion by the garbage
+    collection are reported as missing.
+
+    Args:
+      identifiers: A list of identifiers for the blobs to check.
+      token: Data store token.
+
+    Returns:
+      A dict mapping each identifier to a boolean value indicating existence.
+    """
+    result = {}
+    to_check = []
+    now = time.time()
+    for identifier in identifiers:
+      try:
+        checked = self.blob_existence_cache.Get(identifier)
+      except KeyError:
+        checked = None
+
+      if checked is not None and now - checked < self.blob_existence_cache_ttl:
+        result[identifier] = True
+      else:
+        to_check.append(identifier)
+
+    if to_check:
+      existing = self.blobstore.BlobsExist(to_check, token=token)
+      # Blobs the garbage collection is about to delete count as missing, so
+      # their content is transferred and stored again.
+      tombstoned = self.BlobTombstonesQueryMultiple(
+          [identifier for identifier, exists in existing.iteritems() if exists])
+      for identifier, exists in existing.iteritems():
+        exists = exists and identifier not in tombstoned
+        if exists:
+          self.blob_existence_cache.Put(identifier, now)
+        else:
+          self.blob_existence_cache.ExpireObject(identifier)
+        result[identifier] = exists
+
+    return result
 
   def DeleteBlob(self, identifier, token=None):
     return self.DeleteBlobs([identifier], token=token)
 
   def DeleteBlobs(self, identifiers, token=None):
+    for identifier in identifiers:
+      self.blob_existence_cache.ExpireObject(identifier)
     return self.blobstore.DeleteBlobs(identifiers, token=token)
 
   def GetMutationPool(self):
@@ -1113,6 +1199,21 @@ class DataStore(object):
     Yields:
       tuples (request, lists of fetched responses for the request)
     """
+    for request, responses, _ in self.ReadResponsesWithSizes(
+        request_list, timestamp=timestamp):
+      yield (request, responses)
+
+  def ReadResponsesWithSizes(self, request_list, timestamp=None):
+    """Like ReadResponses but also yields the stored size of the responses.
+
+    Args:
+      request_list: The list of requests the responses should be fetched for.
+      timestamp: A timestamp as used in the data store.
+
+    Yields:
+      tuples (request, lists of fetched responses for the request, total
+      number of bytes of the serialized responses)
+    """
 
     response_subjects = {}
     for request in request_list:
@@ -1126,12 +1227,15 @@ class DataStore(object):
 
     for response_urn, request in sorted(response_subjects.items()):
       responses = []
-      for _, serialized, timestamp in response_data.get(response_urn, []):
+      size = 0
+      # Responses handed out are dropped here so they can be freed early.
+      for _, serialized, timestamp in response_data.pop(response_urn, []):
         msg = rdf_flows.GrrMessage.FromSerializedString(serialized)
         msg.timestamp = timestamp
         responses.append(msg)
+        size += len(serialized)
 
-      yield (request, sorted(responses, key=lambda msg: msg.response_id))
+      yield (request, sorted(responses, key=lambda msg: msg.response_id), size)
 
   def StoreRequestsAndResponses(self,
                                 new_requests=None,
@@ -1556,6 +1660,87 @@ class DataStore(object):
     for hash_obj, matches in results:
       yield (hash_obj, [file_urn for _, file_urn, _ in matches])
 
+  @staticmethod
+  def BlobReferenceSubject(digest):
+    return "%s/%s" % (DataStore.BLOB_REFERENCE_ROOT, digest.lower())
+
+  def BlobReferenceIndexQueryMultiple(self, digests, timestamp=None):
+    """Yields (digest, file_urns) for all files referencing the given blobs.
+
+    Args:
+      digests: Hex SHA-256 digests of the blobs.
+      timestamp: Only return references recorded in this time range.
+
+    Yields:
+      Tuples of a digest and a list of RDFURNs of files referencing the blob.
+      Blobs without any references are omitted.
+    """
+    subjects = {self.BlobReferenceSubject(d): d for d in digests}
+    results = self.MultiResolvePrefix(
+        subjects, DataStore.BLOB_REFERENCE_PREFIX, timestamp=timestamp)
+    for subject, matches in results:
+      yield (subjects[utils.SmartStr(subject)],
+             [rdfvalue.RDFURN(file_urn) for _, file_urn, _ in matches])
+
+  def BlobTombstonesAdd(self, digests, timestamp):
+    """Marks the given blobs for deletion.
+
+    Args:
+      digests: Hex SHA-256 digests of the blobs.
+      timestamp: The RDFDatetime from which on the blobs were unreferenced.
+    """
+    with self.GetMutationPool() as mutation_pool:
+      for digest in digests:
+        mutation_pool.MultiSet(
+            self.BlobReferenceSubject(digest), {
+                DataStore.BLOB_TOMBSTONE_ATTRIBUTE:
+                    [timestamp.AsMicrosecondsSinceEpoch()]
+            })
+
+  def BlobTombstonesDelete(self, digests):
+    """Removes the tombstones of the given blobs."""
+    with self.GetMutationPool() as mutation_pool:
+      for digest in digests:
+        mutation_pool.DeleteAttributes(
+            self.BlobReferenceSubject(digest),
+            [DataStore.BLOB_TOMBSTONE_ATTRIBUTE])
+
+  def BlobTombstonesQueryMultiple(self, digests):
+    """Returns the tombstones of the given blobs.
+
+    Args:
+      digests: Hex SHA-256 digests of the blobs.
+
+    Returns:
+      A dict mapping the digests of blobs that carry a tombstone to the
+      RDFDatetime from which on they were unreferenced.
+    """
+    subjects = {self.BlobReferenceSubject(d): d for d in digests}
+    if not subjects:
+      return {}
+
+    result = {}
+    for subject, values in self.MultiResolvePrefix(
+        subjects, DataStore.BLOB_TOMBSTONE_ATTRIBUTE):
+      for _, value, _ in values:
+        result[subjects[utils.SmartStr(subject)]] = rdfvalue.RDFDatetime(
+            int(value))
+    return result
+
+  def ScanBlobReferences(self, after_digest=None, max_records=None):
+    """Yields (digest, size) for all blobs with recorded references."""
+    after_urn = None
+    if after_digest:
+      after_urn = self.BlobReferenceSubject(after_digest)
+
+    for subject, _, size in self.ScanAttribute(
+        DataStore.BLOB_REFERENCE_ROOT,
+        DataStore.BLOB_SIZE_ATTRIBUTE,
+        after_urn=after_urn,
+        max_records=max_records,
+        relaxed_order=True):
+      yield rdfvalue.RDFURN(subject).Basename(), size
+
   def AFF4FetchChildren(self, subject, timestamp=None, limit=None):
     results = self.ResolvePrefix(
         subject,
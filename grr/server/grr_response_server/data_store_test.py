@@ -1155,6 +1155,51 @@ class DataStoreTestMixin(object):
     self.assertFalse(data_store.DB.BlobExists(identifier))
     self.assertEqual(data_store.DB.ReadBlob(identifier), None)
 
+  def testBlobExistenceIsCached(self):
+    identifier = data_store.DB.StoreBlob("randomdata" * 50)
+    missing = hashlib.sha256().hexdigest()
+
+    with mock.patch.object(
+        data_store.DB.blobstore, "BlobsExist",
+        wraps=data_store.DB.blobstore.BlobsExist) as blobs_exist:
+      self.assertEqual(
+          data_store.DB.BlobsExist([identifier, missing]), {
+              identifier: True,
+              missing: False
+          })
+      self.assertFalse(data_store.DB.BlobExists(missing))
+
+      # Only the missing blob had to be looked up in the blob store.
+      self.assertEqual(blobs_exist.call_count, 2)
+      for call in blobs_exist.call_args_list:
+        self.assertEqual(call[0][0], [missing])
+
+  def testBlobExistenceCacheExpires(self):
+    with test_lib.FakeTime(1000):
+      identifier = data_store.DB.StoreBlob("randomdata" * 50)
+
+    with mock.patch.object(
+        data_store.DB.blobstore, "BlobsExist",
+        wraps=data_store.DB.blobstore.BlobsExist) as blobs_exist:
+      ttl = data_store.DB.blob_existence_cache_ttl
+      with test_lib.FakeTime(1000 + ttl - 1):
+        self.assertTrue(data_store.DB.BlobExists(identifier))
+      self.assertEqual(blobs_exist.call_count, 0)
+
+      # Blobs may be deleted by other processes, so they are looked up again
+      # once the cached answer is too old.
+      with test_lib.FakeTime(1000 + ttl + 1):
+        self.assertTrue(data_store.DB.BlobExists(identifier))
+      self.assertEqual(blobs_exist.call_count, 1)
+
+  @DeletionTest
+  def testBlobDeletionInvalidatesExistenceCache(self):
+    identifier = data_store.DB.StoreBlob("randomdata" * 50)
+    self.assertTrue(data_store.DB.BlobExists(identifier))
+
+    data_store.DB.DeleteBlobs([identifier], token=self.token)
+    self.assertFalse(data_store.DB.BlobExists(identifier))
+
   def testAFF4BlobImage(self):
     # 500k
     data = "randomdata" * 50 * 1024
@@ -10,6 +10,7 @@ from grr.lib import utils
 from grr.lib.rdfvalues import client as rdf_client
 from grr.lib.rdfvalues import objects
 from grr.server.grr_response_server import db
+from grr.server.grr_response_server import db_utils
 
 
 class _PathRecord(object):
@@ -196,6 +197,12 @@ class InMemoryDB(db.Database):
 
     self.metadatas.setdefault(client_id, {}).update(md)
 
+  @utils.Synchronized
+  def MultiWriteClientMetadata(self, metadatas):
+    for client_id, metadata in metadatas.iteritems():
+      self.WriteClientMetadata(
+          client_id, **db_utils.ClientMetadataToWriteArgs(metadata))
+
   @utils.Synchronized
   def MultiReadClientMetadata(self, client_ids):
     """Reads ClientMetadata records for a list of clients."""
@@ -235,6 +242,26 @@ class InMemoryDB(db.Database):
 
     client.startup_info = startup_info
 
+  @utils.Synchronized
+  def MultiWriteClientSnapshot(self, clients):
+    """Writes new snapshots for multiple clients."""
+    for client in clients:
+      if client.client_id not in self.metadatas:
+        raise db.UnknownClientError(client.client_id)
+
+    ts = rdfvalue.RDFDatetime.Now()
+    for client in clients:
+      startup_info = client.startup_info
+      client.startup_info = None
+
+      history = self.clients.setdefault(client.client_id, {})
+      history[ts] = client.SerializeToString()
+
+      history = self.startup_history.setdefault(client.client_id, {})
+      history[ts] = startup_info.SerializeToString()
+
+      client.startup_info = startup_info
+
   @utils.Synchronized
   def MultiReadClientSnapshot(self, client_ids):
     """Reads the latest client snapshots for a list of clients."""
@@ -271,6 +298,37 @@ class InMemoryDB(db.Database):
   def ReadAllClientIDs(self):
     return self.metadatas.keys()
 
+  @utils.Synchronized
+  def ReadClientFullInfoPage(self,
+                             after_client_id=None,
+                             limit=1000,
+                             min_last_ping=None,
+                             include_last_snapshot=True):
+    res = []
+    for client_id in sorted(self.metadatas):
+      if after_client_id is not None and client_id <= after_client_id:
+        continue
+
+      md = self.ReadClientMetadata(client_id)
+      if min_last_ping and md.ping < min_last_ping:
+        continue
+
+      if include_last_snapshot:
+        last_snapshot = self.ReadClientSnapshot(client_id)
+      else:
+        last_snapshot = objects.ClientSnapshot(client_id=client_id)
+
+      res.append((client_id,
+                  objects.ClientFullInfo(
+                      metadata=md,
+                      labels=self.ReadClientLabels(client_id),
+                      last_snapshot=last_snapshot,
+                      last_startup_info=self.ReadClientStartupInfo(client_id))))
+      if len(res) >= limit:
+        break
+
+    return res
+
   @utils.Synchronized
   def WriteClientSnapshotHistory(self, clients):
     if clients[0].client_id not in self.metadatas:
@@ -334,6 +392,60 @@ class InMemoryDB(db.Database):
         res[keyword_mapping[k]].append(client_id)
     return res
 
+  def _HasLabel(self, client_id, label_names, label_owners):
+    for owner, names in self.labels.get(client_id, {}).iteritems():
+      if label_owners and owner not in label_owners:
+        continue
+      if any(name in label_names for name in names):
+        return True
+    return False
+
+  @utils.Synchronized
+  def SearchClients(self,
+                    keywords,
+                    keyword_prefixes=None,
+                    start_time=None,
+                    label_names=None,
+                    label_owners=None,
+                    after_client_id=None,
+                    limit=None):
+
+    def _Matching(keyword_filter):
+      matching = set()
+      for keyword, clients in self.keywords.iteritems():
+        if not keyword_filter(keyword):
+          continue
+        for client_id, timestamp in clients.iteritems():
+          if start_time is None or timestamp >= start_time:
+            matching.add(client_id)
+      return matching
+
+    candidates = None
+    for kw in keywords:
+      kw = utils.SmartStr(kw)
+      matching = _Matching(lambda k, kw=kw: k == kw)
+      candidates = matching if candidates is None else candidates & matching
+
+    for prefix in keyword_prefixes or []:
+      prefix = utils.SmartStr(prefix)
+      matching = _Matching(lambda k, prefix=prefix: k.startswith(prefix))
+      candidates = matching if candidates is None else candidates & matching
+
+    res = []
+    for client_id in sorted(candidates or []):
+      if after_client_id is not None and client_id <= after_client_id:
+        continue
+
+      if label_names and not self._HasLabel(client_id, label_names,
+                                            label_owners):
+        continue
+
+      res.append(client_id)
+      if limit is not None and len(res) >= limit:
+        break
+
+    return res
+
   @utils.Synchronized
   def RemoveClientKeyword(self, client_id, keyword):
     if keyword in self.keywords and client_id in self.keywords[keyword]:
@@ -19,6 +19,7 @@ from grr.lib import rdfvalue
 from grr.lib import utils
 from grr.lib.rdfvalues import client as rdf_client
 from grr.lib.rdfvalues import cronjobs as rdf_cronjobs
+from grr.lib.rdfvalues import crypto as rdf_crypto
 from grr.lib.rdfvalues import events as rdf_events
 from grr.lib.rdfvalues import objects
 from grr.lib.rdfvalues import protodict as rdf_protodict
@@ -65,6 +66,111 @@ def _RDFDatetimeToMysqlString(rdf):
   return "%s.%06d" % (rdf, rdf.AsMicrosecondsSinceEpoch() % 1000000)
 
 
+def _ClientMetadataColumns(client_id,
+                           certificate=None,
+                           fleetspeak_enabled=None,
+                           first_seen=None,
+                           last_ping=None,
+                           last_clock=None,
+                           last_ip=None,
+                           last_foreman=None):
+  """Returns the clients table columns and values for a metadata write."""
+  columns = ["client_id"]
+  values = [_ClientIDToInt(client_id)]
+  if certificate:
+    columns.append("certificate")
+    values.append(certificate.SerializeToString())
+  if fleetspeak_enabled is not None:
+    columns.append("fleetspeak_enabled")
+    values.append(int(fleetspeak_enabled))
+  if first_seen:
+    columns.append("first_seen")
+    values.append(_RDFDatetimeToMysqlString(first_seen))
+  if last_ping:
+    columns.append("last_ping")
+    values.append(_RDFDatetimeToMysqlString(last_ping))
+  if last_clock:
+    columns.append("last_clock")
+    values.append(_RDFDatetimeToMysqlString(last_clock))
+  if last_ip:
+    columns.append("last_ip")
+    values.append(last_ip.SerializeToString())
+  if last_foreman:
+    columns.append("last_foreman")
+    values.append(_RDFDatetimeToMysqlString(last_foreman))
+  return columns, values
+
+
+def _ClientMetadataUpsertQuery(columns, row_count):
+  """Builds a (multi-row) upsert query for the clients table."""
+  row_template = "({})".format(", ".join(["%s"] * len(columns)))
+  return ("INSERT INTO clients ({cols}) VALUES {rows} "
+          "ON DUPLICATE KEY UPDATE {updates}").format(
+              cols=", ".join(columns),
+              rows=", ".join([row_template] * row_count),
+              updates=", ".join(
+                  ["{c} = VALUES ({c})".format(c=col) for col in columns[1:]]))
+
+
+# Maximum number of rows written by a single multi-row INSERT statement.
+_MULTI_ROW_INSERT_BATCH_SIZE = 1000
+
+
+def _ExecuteMultiRowInsert(cursor, query, rows):
+  """Inserts rows in batches using multi-row INSERT statements.
+
+  Args:
+    cursor: The cursor to execute the statements with.
+    query: A query template with a `{rows}` placeholder for the VALUES list.
+    rows: A list of tuples holding the values of every row.
+  """
+  if not rows:
+    return
+
+  row_template = "({})".format(", ".join(["%s"] * len(rows[0])))
+  for batch in utils.Grouper(rows, _MULTI_ROW_INSERT_BATCH_SIZE):
+    args = []
+    for row in batch:
+      args.extend(row)
+    cursor.execute(query.format(rows=", ".join([row_template] * len(batch))),
+                   args)
+
+
+def _EscapeLikePattern(value):
+  """Escapes characters having a special meaning in LIKE patterns."""
+  return value.replace("\\", "\\\\").replace("%", "\\%").replace(
+      "_", "\\_")
+
+
+def _ComponentsToPath(components):
+  """Joins path components into a path that can be split back losslessly.
+
+  Every component is preceded by a slash, slashes and percent signs within
+  components are percent-encoded. This keeps empty components and components
+  containing slashes apart, e.g. [] is "", [""] is "/" and ["a/b"] is "/a%2Fb".
+
+  Args:
+    components: A list of path components.
+
+  Returns:
+    The path as a string.
+  """
+  return "".join(
+      "/" + component.replace("%", "%25").replace("/", "%2F")
+      for component in components)
+
+
+def _PathToComponents(path):
+  """Splits a path created by _ComponentsToPath back into its components."""
+  if not path:
+    return []
+
+  return [
+      component.replace("%2F", "/").replace("%25", "%")
+      for component in path[1:].split("/")
+  ]
+
+
 def _ResponseToApprovalsWithGrants(response):
   """Converts a generator with approval rows into ApprovalRequest objects."""
   prev_triplet = None
@@ -97,6 +203,16 @@ def _ResponseToApprovalsWithGrants(response):
 # Maximum retry count:
 _MAX_RETRY_COUNT = 5
 
+# Connection pool sizing and health checking:
+_POOL_MAX_SIZE = 10
+_POOL_MIN_SIZE = 2
+# Idle connections above _POOL_MIN_SIZE are closed after this many seconds.
+_POOL_MAX_IDLE_TIME = 300
+# Connections idle for longer than this many seconds are pinged on checkout.
+_POOL_VALIDATE_AFTER = 30
+# Give up waiting for a free connection after this many seconds.
+_POOL_WAIT_TIMEOUT = 60
+
 # MySQL error codes:
 _RETRYABLE_ERRORS = {
     1205,  # ER_LOCK_WAIT_TIMEOUT
@@ -167,7 +283,7 @@ class WithTransaction(object):
           new_kw["connection"] = connection
           return func(self, *args, **new_kw)
 
-        return self._RunInTransaction(Closure, readonly)
+        return self._RunInTransaction(Closure, readonly, caller=func.__name__)
 
       return Decorated
 
@@ -184,7 +300,7 @@ class WithTransaction(object):
           new_kw["cursor"] = cursor
           return func(self, *args, **new_kw)
 
-      return self._RunInTransaction(Closure, readonly)
+      return self._RunInTransaction(Closure, readonly, caller=func.__name__)
 
     return db_utils.CallLoggedAndAccounted(Decorated)
 
@@ -220,8 +336,15 @@ class MysqlDB(db_module.Database):
           use_unicode=True,
           charset="utf8")
 
-    self.pool = mysql_pool.Pool(Connect)
-    with contextlib.closing(self.pool.get()) as connection:
+    self.pool = mysql_pool.Pool(
+        Connect,
+        max_size=_POOL_MAX_SIZE,
+        min_size=_POOL_MIN_SIZE,
+        max_idle_time=_POOL_MAX_IDLE_TIME,
+        validate_after=_POOL_VALIDATE_AFTER,
+        wait_timeout=_POOL_WAIT_TIMEOUT)
+    connection = self.pool.get(caller="InitializeSchema")
+    with contextlib.closing(connection):
       with contextlib.closing(connection.cursor()) as cursor:
         self._MariaDBCompatibility(cursor)
         self._SetBinlogFormat(cursor)
@@ -267,7 +390,7 @@ class MysqlDB(db_module.Database):
         logging.error("Failed to execute DDL: %s", command)
         raise
 
-  def _RunInTransaction(self, function, readonly=False):
+  def _RunInTransaction(self, function, readonly=False, caller="unknown"):
     """Runs function within a transaction.
 
     Allocates a connection, begins a transaction on it and passes the connection
@@ -283,6 +406,8 @@ class MysqlDB(db_module.Database):
         parameter.
       readonly: Indicates that only a readonly (snapshot) transaction is
         required.
+      caller: Name of the calling function, used to tag connection pool
+        metrics.
 
     Returns:
       The value returned by the last call to function.
@@ -294,7 +419,7 @@ class MysqlDB(db_module.Database):
       start_query = "START TRANSACTION WITH CONSISTENT SNAPSHOT, READ ONLY;"
 
     for retry_count in range(_MAX_RETRY_COUNT):
-      with contextlib.closing(self.pool.get()) as connection:
+      with contextlib.closing(self.pool.get(caller=caller)) as connection:
         try:
           with contextlib.closing(connection.cursor()) as cursor:
             cursor.execute(start_query)
@@ -330,39 +455,32 @@ class MysqlDB(db_module.Database):
                           last_foreman=None,
                           cursor=None):
     """Write metadata about the client."""
+    columns, values = _ClientMetadataColumns(
+        client_id,
+        certificate=certificate,
+        fleetspeak_enabled=fleetspeak_enabled,
+        first_seen=first_seen,
+        last_ping=last_ping,
+        last_clock=last_clock,
+        last_ip=last_ip,
+        last_foreman=last_foreman)
+    cursor.execute(_ClientMetadataUpsertQuery(columns, 1), values)
 
-    columns = ["client_id"]
-    values = [_ClientIDToInt(client_id)]
-    if certificate:
-      columns.append("certificate")
-      values.append(certificate.SerializeToString())
-    if fleetspeak_enabled is not None:
-      columns.append("fleetspeak_enabled")
-      values.append(int(fleetspeak_enabled))
-    if first_seen:
-      columns.append("first_seen")
-      values.append(_RDFDatetimeToMysqlString(first_seen))
-    if last_ping:
-      columns.append("last_ping")
-      values.append(_RDFDatetimeToMysqlString(last_ping))
-    if last_clock:
-      columns.append("last_clock")
-      values.append(_RDFDatetimeToMysqlString(last_clock))
-    if last_ip:
-      columns.append("last_ip")
-      values.append(last_ip.SerializeToString())
-    if last_foreman:
-      columns.append("last_foreman")
-      values.append(_RDFDatetimeToMysqlString(last_foreman))
-
-    query = ("INSERT INTO clients ({cols}) VALUES ({vals}) "
-             "ON DUPLICATE KEY UPDATE {updates}").format(
-                 cols=", ".join(columns),
-                 vals=", ".join(["%s"] * len(columns)),
-                 updates=", ".join([
-                     "{c} = VALUES ({c})".format(c=col) for col in columns[1:]
-                 ]))
-    cursor.execute(query, values)
+  @WithTransaction()
+  def MultiWriteClientMetadata(self, metadatas, cursor=None):
+    """Writes metadata about multiple clients."""
+    # Clients updating the same set of columns share a multi-row statement.
+    rows_by_columns = {}
+    for client_id, metadata in metadatas.iteritems():
+      columns, values = _ClientMetadataColumns(
+          client_id, **db_utils.ClientMetadataToWriteArgs(metadata))
+      rows_by_columns.setdefault(tuple(columns), []).append(values)
+
+    for columns, rows in rows_by_columns.iteritems():
+      args = []
+      for values in rows:
+        args.extend(values)
+      cursor.execute(_ClientMetadataUpsertQuery(columns, len(rows)), args)
 
   @WithTransaction(readonly=True)
   def MultiReadClientMetadata(self, client_ids, cursor=None):
@@ -422,6 +540,53 @@ class MysqlDB(db_module.Database):
     finally:
       client.startup_info = startup_info
 
+  @WithTransaction()
+  def MultiWriteClientSnapshot(self, clients, cursor=None):
+    """Writes new snapshots for multiple clients."""
+    if not clients:
+      return
+
+    int_ids = [_ClientIDToInt(client.client_id) for client in clients]
+    placeholders = ", ".join(["%s"] * len(int_ids))
+
+    cursor.execute(
+        "SELECT client_id FROM clients WHERE client_id IN ({})".format(
+            placeholders), int_ids)
+    known_ids = set(row[0] for row in cursor.fetchall())
+    for client, int_id in zip(clients, int_ids):
+      if int_id not in known_ids:
+        raise db_module.UnknownClientError(client.client_id)
+
+    timestamp = datetime.datetime.utcnow()
+    history_args = []
+    startup_args = []
+    for client, int_id in zip(clients, int_ids):
+      startup_info = client.startup_info
+      client.startup_info = None
+      try:
+        history_args.extend([int_id, timestamp, client.SerializeToString()])
+      finally:
+        client.startup_info = startup_info
+      startup_args.extend([int_id, timestamp, startup_info.SerializeToString()])
+
+    rows = ", ".join(["(%s, %s, %s)"] * len(clients))
+    try:
+      cursor.execute(
+          "INSERT INTO client_snapshot_history(client_id, timestamp, "
+          "client_snapshot) VALUES " + rows, history_args)
+      cursor.execute(
+          "INSERT INTO client_startup_history(client_id, timestamp, "
+          "startup_info) VALUES " + rows, startup_args)
+    except MySQLdb.IntegrityError as e:
+      # Clients deleted concurrently after the check above.
+      raise db_module.UnknownClientError(clients[0].client_id, cause=e)
+
+    cursor.execute(
+        "UPDATE clients SET last_client_timestamp=%s, "
+        "last_startup_timestamp=%s "
+        "WHERE client_id IN ({})".format(placeholders),
+        [timestamp, timestamp] + int_ids)
+
   @WithTransaction(readonly=True)
   def MultiReadClientSnapshot(self, client_ids, cursor=None):
     """Reads the latest client snapshots for a list of clients."""
@@ -647,26 +812,39 @@ class MysqlDB(db_module.Database):
     if c_full_info:
       yield _IntToClientID(prev_cid), c_full_info
 
-  @WithTransaction(readonly=True)
-  def MultiReadClientFullInfo(self, client_ids, min_last_ping=None,
-                              cursor=None):
-    query = (
+  def _ClientFullInfoQuery(self, clients_table, include_last_snapshot=True):
+    """Builds a query reading full client info for rows of clients_table."""
+    if include_last_snapshot:
+      snapshot_columns = "h.client_snapshot, s.startup_info, "
+      snapshot_joins = (
+          "LEFT JOIN client_snapshot_history as h ON ( "
+          "c.client_id = h.client_id "
+          "AND h.timestamp = c.last_client_timestamp) "
+          "LEFT JOIN client_startup_history as s ON ( "
+          "c.client_id = s.client_id "
+          "AND s.timestamp = c.last_client_timestamp) ")
+    else:
+      snapshot_columns = "NULL, NULL, "
+      snapshot_joins = ""
+
+    return (
         "SELECT "
         "c.client_id, c.fleetspeak_enabled, c.certificate, c.last_ping, "
         "c.last_clock, c.last_ip, c.last_foreman, c.first_seen, "
         "c.last_client_timestamp, c.last_crash_timestamp, "
-        "c.last_startup_timestamp, h.client_snapshot, s.startup_info, "
+        "c.last_startup_timestamp, " + snapshot_columns +
         "s_last.startup_info, l.owner, l.label "
-        "FROM clients as c "
-        "LEFT JOIN client_snapshot_history as h ON ( "
-        "c.client_id = h.client_id AND h.timestamp = c.last_client_timestamp) "
-        "LEFT JOIN client_startup_history as s ON ( "
-        "c.client_id = s.client_id AND s.timestamp = c.last_client_timestamp) "
+        "FROM " + clients_table + " as c " + snapshot_joins +
         "LEFT JOIN client_startup_history as s_last ON ( "
         "c.client_id = s_last.client_id "
         "AND s_last.timestamp = c.last_startup_timestamp) "
         "LEFT JOIN client_labels AS l ON (c.client_id = l.client_id) ")
 
+  @WithTransaction(readonly=True)
+  def MultiReadClientFullInfo(self, client_ids, min_last_ping=None,
+                              cursor=None):
+    query = self._ClientFullInfoQuery("clients")
+
     query += "WHERE c.client_id IN (%s) " % ", ".join(["%s"] * len(client_ids))
 
     values = [_ClientIDToInt(cid) for cid in client_ids]
@@ -687,6 +865,38 @@ class MysqlDB(db_module.Database):
     cursor.execute("SELECT client_id FROM clients")
     return [_IntToClientID(res[0]) for res in cursor.fetchall()]
 
+  @WithTransaction(readonly=True)
+  def ReadClientFullInfoPage(self,
+                             after_client_id=None,
+                             limit=1000,
+                             min_last_ping=None,
+                             include_last_snapshot=True,
+                             cursor=None):
+    """Reads full client information for a page of clients."""
+    conditions = []
+    values = []
+    if after_client_id is not None:
+      conditions.append("client_id > %s")
+      values.append(_ClientIDToInt(after_client_id))
+    if min_last_ping is not None:
+      conditions.append("last_ping >= %s")
+      values.append(_RDFDatetimeToMysqlString(min_last_ping))
+
+    # The page is selected in a subquery, so the limit applies to clients and
+    # not to the client/label rows produced by the joins.
+    page = "SELECT * FROM clients "
+    if conditions:
+      page += "WHERE " + " AND ".join(conditions) + " "
+    page += "ORDER BY client_id LIMIT %s"
+    values.append(limit)
+
+    query = self._ClientFullInfoQuery(
+        "(" + page + ")", include_last_snapshot=include_last_snapshot)
+    query += "ORDER BY c.client_id"
+
+    cursor.execute(query, values)
+    return list(self._ResponseToClientsFullInfo(cursor.fetchall()))
+
   @WithTransaction()
   def AddClientKeywords(self, client_id, keywords, cursor=None):
     """Associates the provided keywords with the client."""
@@ -732,6 +942,72 @@ class MysqlDB(db_module.Database):
       result[keyword_mapping[kw]].append(_IntToClientID(cid))
     return result
 
+  @WithTransaction(readonly=True)
+  def SearchClients(self,
+                    keywords,
+                    keyword_prefixes=None,
+                    start_time=None,
+                    label_names=None,
+                    label_owners=None,
+                    after_client_id=None,
+                    limit=None,
+                    cursor=None):
+    """Finds clients associated with all of the given keywords."""
+    conditions = [("keyword = %s", utils.SmartUnicode(kw)) for kw in keywords]
+    for prefix in keyword_prefixes or []:
+      conditions.append(("keyword LIKE %s",
+                         _EscapeLikePattern(utils.SmartUnicode(prefix)) + "%"))
+
+    # The first condition drives the query through the keyword index, all the
+    # other ones are checked for every candidate client with primary key
+    # lookups. Exact and long keywords are likely to match fewer clients than
+    # prefixes and short keywords (like the universal keyword "."), so they
+    # go first.
+    conditions.sort(key=lambda c: (c[0] != "keyword = %s", -len(c[1])))
+
+    timestamp_condition = ""
+    timestamp_args = []
+    if start_time is not None:
+      timestamp_condition = " AND {alias}.timestamp >= %s"
+      timestamp_args = [_RDFDatetimeToMysqlString(start_time)]
+
+    driver_condition, driver_arg = conditions[0]
+    query = ("SELECT DISTINCT k.client_id FROM client_keywords AS k "
+             "WHERE k." + driver_condition +
+             timestamp_condition.format(alias="k"))
+    args = [driver_arg] + timestamp_args
+
+    for condition, arg in conditions[1:]:
+      query += (" AND EXISTS (SELECT 1 FROM client_keywords AS k2 "
+                "WHERE k2.client_id = k.client_id AND k2." + condition +
+                timestamp_condition.format(alias="k2") + ")")
+      args.append(arg)
+      args.extend(timestamp_args)
+
+    if label_names:
+      label_names = [utils.SmartUnicode(name) for name in label_names]
+      query += (" AND EXISTS (SELECT 1 FROM client_labels AS l "
+                "WHERE l.client_id = k.client_id AND l.label IN ({})").format(
+                    ", ".join(["%s"] * len(label_names)))
+      args.extend(label_names)
+      if label_owners:
+        query += " AND l.owner IN ({})".format(", ".join(["%s"] *
+                                                          len(label_owners)))
+        args.extend(label_owners)
+      query += ")"
+
+    if after_client_id is not None:
+      query += " AND k.client_id > %s"
+      args.append(_ClientIDToInt(after_client_id))
+
+    query += " ORDER BY k.client_id"
+    if limit is not None:
+      query += " LIMIT %s"
+      args.append(limit)
+
+    cursor.execute(query, args)
+    return [_IntToClientID(row[0]) for row in cursor.fetchall()]
+
   @WithTransaction()
   def AddClientLabels(self, client_id, owner, labels, cursor=None):
     """Attaches a list of user labels to a client."""
@@ -1029,21 +1305,239 @@ class MysqlDB(db_module.Database):
         ret.append(approval_request)
     return ret
 
-  def FindPathInfoByPathID(self, client_id, path_type, path_ids,
-                           timestamp=None):
-    raise NotImplementedError()
+  def _ReadPathInfos(self, client_id, path_type, path_ids, cursor):
+    """Reads the latest path info records for given paths of a client."""
+    query = (
+        "SELECT p.path_id, p.path, p.directory, p.timestamp, "
+        "p.last_stat_entry_timestamp, s.stat_entry, "
+        "p.last_hash_entry_timestamp, h.hash_entry "
+        "FROM client_paths AS p "
+        "LEFT JOIN client_path_stat_entries AS s ON ( "
+        "p.client_id = s.client_id AND p.path_type = s.path_type "
+        "AND p.path_id = s.path_id "
+        "AND p.last_stat_entry_timestamp = s.timestamp) "
+        "LEFT JOIN client_path_hash_entries AS h ON ( "
+        "p.client_id = h.client_id AND p.path_type = h.path_type "
+        "AND p.path_id = h.path_id "
+        "AND p.last_hash_entry_timestamp = h.timestamp) "
+        "WHERE p.client_id = %s AND p.path_type = %s ")
+    query += "AND p.path_id IN (%s)" % ", ".join(["%s"] * len(path_ids))
+
+    values = [_ClientIDToInt(client_id), int(path_type)]
+    values.extend(path_id.AsBytes() for path_id in path_ids)
+    cursor.execute(query, values)
+
+    result = {}
+    for (path_id, path, directory, timestamp, stat_entry_timestamp, stat_entry,
+         hash_entry_timestamp, hash_entry) in cursor.fetchall():
+      path_info = objects.PathInfo(
+          path_type=path_type,
+          components=_PathToComponents(path),
+          directory=bool(directory),
+          timestamp=_MysqlToRDFDatetime(timestamp))
+      if stat_entry is not None:
+        path_info.last_stat_entry_timestamp = _MysqlToRDFDatetime(
+            stat_entry_timestamp)
+        path_info.stat_entry = rdf_client.StatEntry.FromSerializedString(
+            stat_entry)
+      if hash_entry is not None:
+        path_info.last_hash_entry_timestamp = _MysqlToRDFDatetime(
+            hash_entry_timestamp)
+        path_info.hash_entry = rdf_crypto.Hash.FromSerializedString(hash_entry)
+
+      result[objects.PathID.FromBytes(path_id)] = path_info
+
+    return result
 
-  def FindPathInfosByPathIDs(self, client_id, path_type, path_ids):
+  def _ReadLastPathEntry(self, table, column, client_id, path_type, path_id,
+                         timestamp, cursor):
+    """Reads the last stat or hash entry not newer than given timestamp."""
+    query = ("SELECT timestamp, {column} FROM {table} "
+             "WHERE client_id = %s AND path_type = %s AND path_id = %s "
+             "AND timestamp <= %s "
+             "ORDER BY timestamp DESC LIMIT 1").format(
+                 table=table, column=column)
+    cursor.execute(query, [
+        _ClientIDToInt(client_id),
+        int(path_type),
+        path_id.AsBytes(),
+        _RDFDatetimeToMysqlString(timestamp)
+    ])
+    row = cursor.fetchone()
+    if row is None:
+      return None, None
+    return _MysqlToRDFDatetime(row[0]), row[1]
+
+  @WithTransaction(readonly=True)
+  def FindPathInfoByPathID(self,
+                           client_id,
+                           path_type,
+                           path_id,
+                           timestamp=None,
+                           cursor=None):
+    """Returns path info record for a particular path on a particular client."""
+    path_info = self._ReadPathInfos(
+        client_id, path_type, [path_id], cursor=cursor).get(path_id)
+    if path_info is None:
+      raise db_module.UnknownPathError(
+          client_id=client_id, path_type=path_type, path_id=path_id)
+
+    if timestamp is None:
+      return path_info
+
+    path_info.last_stat_entry_timestamp = None
+    path_info.stat_entry = None
+    stat_entry_timestamp, stat_entry = self._ReadLastPathEntry(
+        "client_path_stat_entries",
+        "stat_entry",
+        client_id,
+        path_type,
+        path_id,
+        timestamp,
+        cursor=cursor)
+    if stat_entry is not None:
+      path_info.last_stat_entry_timestamp = stat_entry_timestamp
+      path_info.stat_entry = rdf_client.StatEntry.FromSerializedString(
+          stat_entry)
+
+    path_info.last_hash_entry_timestamp = None
+    path_info.hash_entry = None
+    hash_entry_timestamp, hash_entry = self._ReadLastPathEntry(
+        "client_path_hash_entries",
+        "hash_entry",
+        client_id,
+        path_type,
+        path_id,
+        timestamp,
+        cursor=cursor)
+    if hash_entry is not None:
+      path_info.last_hash_entry_timestamp = hash_entry_timestamp
+      path_info.hash_entry = rdf_crypto.Hash.FromSerializedString(hash_entry)
+
+    return path_info
+
+  @WithTransaction(readonly=True)
+  def FindPathInfosByPathIDs(self, client_id, path_type, path_ids,
+                             cursor=None):
     """Returns path info records for a client."""
-    raise NotImplementedError()
+    result = dict.fromkeys(path_ids)
+    if path_ids:
+      result.update(
+          self._ReadPathInfos(client_id, path_type, path_ids, cursor=cursor))
+    return result
 
-  def WritePathInfos(self, client_id, path_infos):
+  @WithTransaction()
+  def WritePathInfos(self, client_id, path_infos, cursor=None):
     """Writes a collection of path_info records for a client."""
-    raise NotImplementedError()
+    cid = _ClientIDToInt(client_id)
+    now = _RDFDatetimeToMysqlString(rdfvalue.RDFDatetime.Now())
+
+    # Maps (path type, path components) to client_paths rows. Every written
+    # path brings all of its ancestors along, so a path shared by many written
+    # paths (like a common parent directory) is only hashed and written once.
+    path_rows = {}
+    stat_entry_rows = []
+    hash_entry_rows = []
+
+    def _AddPath(path_type, components, directory):
+      key = (path_type, tuple(components))
+      row = path_rows.get(key)
+      if row is None:
+        path_id = objects.PathID(components).AsBytes()
+        row = [cid, path_type, path_id, _ComponentsToPath(components),
+               directory, now, None, None]
+        path_rows[key] = row
+      else:
+        row[4] |= directory
+      return row
+
+    for path_info in path_infos:
+      path_type = int(path_info.path_type)
+      row = _AddPath(path_type, path_info.components,
+                     bool(path_info.directory))
+
+      if path_info.HasField("stat_entry"):
+        row[6] = now
+        stat_entry_rows.append((cid, path_type, row[2], now,
+                                path_info.stat_entry.SerializeToString()))
+      if path_info.HasField("hash_entry"):
+        row[7] = now
+        hash_entry_rows.append((cid, path_type, row[2], now,
+                                path_info.hash_entry.SerializeToString()))
+
+      for i in range(len(path_info.components)):
+        _AddPath(path_type, path_info.components[:i], True)
+
+    # Every path is linked to all of its ancestors in the closure table, so
+    # that finding descendants up to a given depth is a single range scan.
+    ancestor_rows = []
+    for (path_type, components), row in path_rows.iteritems():
+      for depth in range(1, len(components) + 1):
+        ancestor_row = path_rows[(path_type, components[:-depth])]
+        ancestor_rows.append((cid, path_type, ancestor_row[2], depth, row[2]))
+
+    try:
+      _ExecuteMultiRowInsert(
+          cursor, "INSERT INTO client_paths (client_id, path_type, path_id, "
+          "path, directory, timestamp, last_stat_entry_timestamp, "
+          "last_hash_entry_timestamp) VALUES {rows} "
+          "ON DUPLICATE KEY UPDATE "
+          "directory = directory OR VALUES(directory), "
+          "timestamp = VALUES(timestamp), "
+          "last_stat_entry_timestamp = IFNULL("
+          "VALUES(last_stat_entry_timestamp), last_stat_entry_timestamp), "
+          "last_hash_entry_timestamp = IFNULL("
+          "VALUES(last_hash_entry_timestamp), last_hash_entry_timestamp)",
+          [tuple(row) for row in path_rows.itervalues()])
+    except MySQLdb.IntegrityError as e:
+      raise db_module.UnknownClientError(client_id, cause=e)
+
+    _ExecuteMultiRowInsert(
+        cursor, "INSERT INTO client_path_stat_entries (client_id, path_type, "
+        "path_id, timestamp, stat_entry) VALUES {rows} "
+        "ON DUPLICATE KEY UPDATE stat_entry = VALUES(stat_entry)",
+        stat_entry_rows)
+    _ExecuteMultiRowInsert(
+        cursor, "INSERT INTO client_path_hash_entries (client_id, path_type, "
+        "path_id, timestamp, hash_entry) VALUES {rows} "
+        "ON DUPLICATE KEY UPDATE hash_entry = VALUES(hash_entry)",
+        hash_entry_rows)
+    _ExecuteMultiRowInsert(
+        cursor, "INSERT IGNORE INTO client_path_ancestors (client_id, "
+        "path_type, ancestor_path_id, depth, path_id) VALUES {rows}",
+        ancestor_rows)
 
-  def FindDescendentPathIDs(self, client_id, path_id, max_depth=None):
+  @WithTransaction(readonly=True)
+  def FindDescendentPathIDs(self,
+                            client_id,
+                            path_type,
+                            path_id,
+                            max_depth=None,
+                            cursor=None):
     """Finds all path_ids seen on a client descent from path_id."""
-    raise NotImplementedError()
+    if max_depth == 0:
+      return set()
+
+    query = ("SELECT path_id FROM client_path_ancestors "
+             "WHERE client_id = %s AND path_type = %s "
+             "AND ancestor_path_id = %s")
+    values = [_ClientIDToInt(client_id), int(path_type), path_id.AsBytes()]
+    if max_depth is not None:
+      query += " AND depth <= %s"
+      values.append(max_depth)
+
+    cursor.execute(query, values)
+    result = set(objects.PathID.FromBytes(row[0]) for row in cursor.fetchall())
+
+    # Like the in-memory database, fail for paths that were never written.
+    if not result:
+      cursor.execute(
+          "SELECT 1 FROM client_paths WHERE client_id = %s "
+          "AND path_type = %s AND path_id = %s", values[:3])
+      if cursor.fetchone() is None:
+        raise KeyError(path_id)
+
+    return result
 
   @WithTransaction()
   def WriteUserNotification(self, notification, cursor=None):
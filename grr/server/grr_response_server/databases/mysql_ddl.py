@@ -126,5 +126,47 @@ CREATE TABLE IF NOT EXISTS cron_jobs(
     leased_until DATETIME(6),
     leased_by VARCHAR(128),
     PRIMARY KEY (job_id)
+)""", """
+CREATE TABLE IF NOT EXISTS client_paths(
+    client_id BIGINT UNSIGNED,
+    path_type INT UNSIGNED,
+    path_id BINARY(32),
+    path TEXT CHARACTER SET utf8,
+    directory BOOL,
+    timestamp DATETIME(6),
+    last_stat_entry_timestamp DATETIME(6),
+    last_hash_entry_timestamp DATETIME(6),
+    PRIMARY KEY (client_id, path_type, path_id),
+    FOREIGN KEY (client_id) REFERENCES clients(client_id)
+)""", """
+CREATE TABLE IF NOT EXISTS client_path_stat_entries(
+    client_id BIGINT UNSIGNED,
+    path_type INT UNSIGNED,
+    path_id BINARY(32),
+    timestamp DATETIME(6),
+    stat_entry MEDIUMBLOB,
+    PRIMARY KEY (client_id, path_type, path_id, timestamp),
+    FOREIGN KEY (client_id, path_type, path_id)
+        REFERENCES client_paths(client_id, path_type, path_id)
+)""", """
+CREATE TABLE IF NOT EXISTS client_path_hash_entries(
+    client_id BIGINT UNSIGNED,
+    path_type INT UNSIGNED,
+    path_id BINARY(32),
+    timestamp DATETIME(6),
+    hash_entry MEDIUMBLOB,
+    PRIMARY KEY (client_id, path_type, path_id, timestamp),
+    FOREIGN KEY (client_id, path_type, path_id)
+        REFERENCES client_paths(client_id, path_type, path_id)
+)""", """
+CREATE TABLE IF NOT EXISTS client_path_ancestors(
+    client_id BIGINT UNSIGNED,
+    path_type INT UNSIGNED,
+    ancestor_path_id BINARY(32),
+    depth INT UNSIGNED,
+    path_id BINARY(32),
+    PRIMARY KEY (client_id, path_type, ancestor_path_id, depth, path_id),
+    FOREIGN KEY (client_id, path_type, path_id)
+        REFERENCES client_paths(client_id, path_type, path_id)
 )"""
 ]
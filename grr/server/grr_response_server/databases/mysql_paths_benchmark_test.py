@@ -0,0 +1,113 @@
+#!/usr/bin/env python
+"""Benchmarks for the path info subsystem of the MySQL database."""
+
+import itertools
+import time
+
+import pytest
+
+from grr.lib import flags
+from grr.lib import utils
+from grr.lib.rdfvalues import objects
+from grr.server.grr_response_server import db
+from grr.server.grr_response_server.databases import mysql_test
+from grr.test_lib import benchmark_test_lib
+from grr.test_lib import test_lib
+
+
+@pytest.mark.benchmark
+class MysqlPathsBenchmarks(mysql_test.MysqlTestMixin,
+                           benchmark_test_lib.MicroBenchmarks):
+  """Benchmarks path info writes and lookups on a large, deep tree.
+
+  These tests are only run with --benchmark and need the same
+  MYSQL_TEST_* environment variables as the MySQL database tests.
+  """
+
+  units = "s"
+
+  # A tree with this fan-out and depth has 1,111,111 paths (including the
+  # root), 1,000,000 of which are files.
+  FANOUT = 10
+  DEPTH = 6
+
+  # Number of files written with a single WritePathInfos call.
+  WRITE_BATCH_SIZE = 10000
+
+  # Number of files read with a single FindPathInfosByPathIDs call.
+  READ_BATCH_SIZE = 1000
+
+  def setUp(self):
+    db_obj, self.cleanup = self.CreateDatabase()
+    super(MysqlPathsBenchmarks, self).setUp()
+
+    self.db = db.DatabaseValidationWrapper(db_obj)
+    self.client_id = "C.0000000000000001"
+    self.db.WriteClientMetadata(self.client_id, fleetspeak_enabled=False)
+
+  def tearDown(self):
+    super(MysqlPathsBenchmarks, self).tearDown()
+    self.cleanup()
+
+  def _FileComponents(self):
+    """Yields components of all files in the benchmark tree."""
+    for indices in itertools.product(range(self.FANOUT), repeat=self.DEPTH):
+      components = ["dir%d" % i for i in indices[:-1]]
+      components.append("file%d" % indices[-1])
+      yield components
+
+  def _WriteTree(self):
+    path_infos = (
+        objects.PathInfo.OS(components=components)
+        for components in self._FileComponents())
+
+    start = time.time()
+    count = 0
+    for batch in utils.Grouper(path_infos, self.WRITE_BATCH_SIZE):
+      self.db.WritePathInfos(self.client_id, batch)
+      count += len(batch)
+    self.AddResult("WritePathInfos (%d files)" % count, time.time() - start,
+                   count // self.WRITE_BATCH_SIZE)
+
+  def _TimeFindDescendentPathIDs(self, components, max_depth=None):
+    path_id = objects.PathID(components)
+
+    start = time.time()
+    result = self.db.FindDescendentPathIDs(
+        self.client_id,
+        objects.PathInfo.PathType.OS,
+        path_id,
+        max_depth=max_depth)
+    self.AddResult("FindDescendentPathIDs (depth %d, max_depth %s, %d ids)" %
+                   (len(components), max_depth, len(result)),
+                   time.time() - start, 1)
+
+  def testDeepTree(self):
+    """Writes a tree of over a million paths and queries it."""
+    self._WriteTree()
+
+    self._TimeFindDescendentPathIDs([], max_depth=1)
+    self._TimeFindDescendentPathIDs([], max_depth=2)
+    self._TimeFindDescendentPathIDs([], max_depth=3)
+    self._TimeFindDescendentPathIDs(["dir0", "dir0"])
+    self._TimeFindDescendentPathIDs(["dir0", "dir0", "dir0", "dir0"])
+    self._TimeFindDescendentPathIDs(["dir0"], max_depth=2)
+
+    path_ids = [
+        objects.PathID(components)
+        for components in itertools.islice(self._FileComponents(),
+                                           self.READ_BATCH_SIZE)
+    ]
+    start = time.time()
+    self.db.FindPathInfosByPathIDs(self.client_id,
+                                   objects.PathInfo.PathType.OS, path_ids)
+    self.AddResult("FindPathInfosByPathIDs (%d ids)" % len(path_ids),
+                   time.time() - start, 1)
+
+
+def main(args):
+  test_lib.main(args)
+
+
+if __name__ == "__main__":
+  flags.StartMain(main)
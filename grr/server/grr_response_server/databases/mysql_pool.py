@@ -3,9 +3,21 @@
 
 import logging
 import threading
+import time
 
 import MySQLdb
 
+from grr.lib import registry
+from grr.lib import stats
+
+
+class Error(Exception):
+  """Base class for connection pool errors."""
+
+
+class PoolTimeoutError(Error):
+  """Raised when no connection becomes available within the wait timeout."""
+
 
 class Pool(object):
   """A Pool of database connections.
@@ -17,9 +29,20 @@ class Pool(object):
   Intends to be thread safe in that multiple connections can be requested and
   used by multiple threads without synchronization, but operations on each
   connection (and its associated cursors) are assumed to be serial.
+
+  Idle connections are kept in LIFO order so that the least recently used ones
+  can be reaped once they have been idle for longer than max_idle_time, while
+  keeping at least min_size connections open. Connections which have been idle
+  for longer than validate_after are pinged before being handed out.
   """
 
-  def __init__(self, connect_func, max_size=10):
+  def __init__(self,
+               connect_func,
+               max_size=10,
+               min_size=0,
+               max_idle_time=None,
+               validate_after=None,
+               wait_timeout=None):
     """Creates a ConnectionPool.
 
     Args:
@@ -27,39 +50,146 @@ class Pool(object):
        database, i.e. a MySQLdb.Connection. Should raise or block if the
        database is unavailable.
      max_size: The maximum number of simultaneous connections.
+     min_size: The number of open connections that are never reaped, even when
+       idle.
+     max_idle_time: Number of seconds after which an idle connection is closed.
+       None means idle connections are kept forever.
+     validate_after: Number of seconds a connection may stay idle before it
+       is pinged on checkout. None disables validation.
+     wait_timeout: Default number of seconds get() waits for a connection
+       before raising PoolTimeoutError. None means wait forever.
     """
-    self.connect_func = connect_func
-    self.limiter = threading.BoundedSemaphore(max_size)
-    self.idle_conns = []  # Atomic access only!!
+    if min_size > max_size:
+      raise ValueError("min_size (%d) must not exceed max_size (%d)." %
+                       (min_size, max_size))
 
-  def get(self, blocking=True):
+    self.connect_func = connect_func
+    self.max_size = max_size
+    self.min_size = min_size
+    self.max_idle_time = max_idle_time
+    self.validate_after = validate_after
+    self.wait_timeout = wait_timeout
+
+    self.lock = threading.Condition()
+    # Number of connections currently checked out or being established.
+    self.active_count = 0  # Guarded by lock.
+    # List of (connection, idle_since) tuples, most recently used last.
+    self.idle_conns = []  # Guarded by lock.
+
+  def get(self, blocking=True, timeout=None, caller="unknown"):
     """Gets a connection.
 
     Args:
       blocking: Whether to block when max_size connections are already in
         use. If false, may return None.
+      timeout: Number of seconds to wait for a free connection, overrides the
+        pool's wait_timeout.
+      caller: A tag identifying the caller, used as a field in the pool's
+        wait-time and checkout-duration metrics.
 
     Returns:
       A connection to the database.
+
+    Raises:
+      PoolTimeoutError: No connection became available in time.
     """
-    # NOTE: Once we acquire capacity from the semaphore, it is essential that we
-    # return it eventually. On success, this responsibility is delegated to
-    # _ConnectionProxy.
-    if not self.limiter.acquire(blocking=blocking):
-      return None
+    if timeout is None:
+      timeout = self.wait_timeout
+
+    start_time = time.time()
+    with self.lock:
+      while self.active_count >= self.max_size:
+        if not blocking:
+          return None
+
+        if timeout is None:
+          self.lock.wait()
+          continue
+
+        remaining = start_time + timeout - time.time()
+        if remaining <= 0:
+          stats.STATS.IncrementCounter("db_pool_timeouts", fields=[caller])
+          raise PoolTimeoutError(
+              "No database connection available after %.2fs (%d/%d in use)." %
+              (timeout, self.active_count, self.max_size))
+        self.lock.wait(remaining)
+
+      # NOTE: Once we acquire capacity, it is essential that we return it
+      # eventually. On success, this responsibility is delegated to
+      # _ConnectionProxy.
+      self.active_count += 1
+      idle = self.idle_conns.pop() if self.idle_conns else None
+      reaped = self._PopExpiredIdle()
+
+    stats.STATS.RecordEvent(
+        "db_pool_wait_time", time.time() - start_time, fields=[caller])
+    self._CloseAll(reaped)
+
     c = None
-    # pop is atomic, but if we did a check first, it would not be atomic with
-    # the pop.
-    try:
-      c = self.idle_conns.pop()
-    except IndexError:
+    if idle is not None:
+      c = self._Validate(*idle)
+
+    if c is None:
       # Create a connection, release the pool allocation if it fails.
       try:
         c = self.connect_func()
       except Exception:
-        self.limiter.release()
+        self._Release()
         raise
-    return _ConnectionProxy(self, c)
+    return _ConnectionProxy(self, c, caller=caller)
+
+  def _Validate(self, con, idle_since):
+    """Returns con if it is still usable, None otherwise."""
+    if (self.validate_after is None or
+        time.time() - idle_since < self.validate_after):
+      return con
+
+    try:
+      con.ping()
+      return con
+    except Exception as e:  # pylint: disable=broad-except
+      logging.info("Discarding stale database connection: %s", e)
+      stats.STATS.IncrementCounter("db_pool_validation_failures")
+      self._CloseAll([con])
+      return None
+
+  def _PopExpiredIdle(self):
+    """Removes connections idle for too long. Must be called with lock held."""
+    if self.max_idle_time is None:
+      return []
+
+    deadline = time.time() - self.max_idle_time
+    expired = []
+    while (self.idle_conns and
+           self.active_count + len(self.idle_conns) > self.min_size and
+           self.idle_conns[0][1] < deadline):
+      expired.append(self.idle_conns.pop(0)[0])
+    return expired
+
+  def _CloseAll(self, connections):
+    for con in connections:
+      try:
+        con.close()
+      except Exception:  # pylint: disable=broad-except
+        pass
+
+  def _PutIdle(self, con):
+    with self.lock:
+      self.idle_conns.append((con, time.time()))
+
+  def _Release(self):
+    with self.lock:
+      self.active_count -= 1
+      reaped = self._PopExpiredIdle()
+      self.lock.notify()
+    self._CloseAll(reaped)
+
+  def Reap(self):
+    """Closes connections which have been idle for longer than max_idle_time."""
+    with self.lock:
+      reaped = self._PopExpiredIdle()
+    self._CloseAll(reaped)
+    return len(reaped)
 
 
 class _ConnectionProxy(object):
@@ -70,10 +200,12 @@ class _ConnectionProxy(object):
   connection when it may be in an errored state.
   """
 
-  def __init__(self, pool, con):
+  def __init__(self, pool, con, caller="unknown"):
     self.con = con
     self.pool = pool
+    self.caller = caller
     self.errored = False
+    self.checkout_time = time.time()
 
   def __del__(self):
     if self.con:
@@ -86,8 +218,7 @@ class _ConnectionProxy(object):
         if not self.errored:
           try:
             self.con.rollback()
-            # append is atomic.
-            self.pool.idle_conns.append(self.con)
+            self.pool._PutIdle(self.con)  # pylint: disable=protected-access
           except Exception:
             # rollback raised and the connection didn't make it into the idle
             # list, so close it.
@@ -97,7 +228,11 @@ class _ConnectionProxy(object):
           self.con.close()
       finally:
         self.con = None
-        self.pool.limiter.release()
+        self.pool._Release()  # pylint: disable=protected-access
+        stats.STATS.RecordEvent(
+            "db_pool_checkout_duration",
+            time.time() - self.checkout_time,
+            fields=[self.caller])
 
   def commit(self):
     self.con.commit()
@@ -169,3 +304,16 @@ class _CursorProxy(object):
 
   def setoutputsize(self, size):
     self.cursor.setoutputsize(size)
+
+
+class PoolMetricsInit(registry.InitHook):
+  """Install connection pool metrics."""
+
+  def RunOnce(self):
+    stats.STATS.RegisterEventMetric(
+        "db_pool_wait_time", fields=[("caller", str)])
+    stats.STATS.RegisterEventMetric(
+        "db_pool_checkout_duration", fields=[("caller", str)])
+    stats.STATS.RegisterCounterMetric(
+        "db_pool_timeouts", fields=[("caller", str)])
+    stats.STATS.RegisterCounterMetric("db_pool_validation_failures")
@@ -1,14 +1,21 @@
 #!/usr/bin/env python
 """Tests for mysql_pool.py."""
 
+import time
+
 import mock
 import MySQLdb
 
 import unittest
 from grr.server.grr_response_server.databases import mysql_pool
+from grr.test_lib import stats_test_lib
+
 
+class TestPool(stats_test_lib.StatsTestMixin, unittest.TestCase):
 
-class TestPool(unittest.TestCase):
+  def setUp(self):
+    super(TestPool, self).setUp()
+    mysql_pool.PoolMetricsInit().RunOnce()
 
   def testMaxSize(self):
     mocks = []
@@ -132,6 +139,66 @@ class TestPool(unittest.TestCase):
         # whitebox: make sure the connection did end up on the idle list
         self.assertEqual(1, len(pool.idle_conns))
 
+  def testWaitTimeout(self):
+    pool = mysql_pool.Pool(mock.MagicMock, max_size=1, wait_timeout=0.1)
+    con = pool.get()
+
+    with self.assertStatsCounterDelta(1, 'db_pool_timeouts', fields=['test']):
+      with self.assertRaises(mysql_pool.PoolTimeoutError):
+        pool.get(caller='test')
+
+    con.close()
+    # Capacity is available again, so this should not time out.
+    pool.get(caller='test').close()
+
+  def testIdleReaping(self):
+    mocks = []
+
+    def gen_mock():
+      c = mock.MagicMock()
+      mocks.append(c)
+      return c
+
+    pool = mysql_pool.Pool(gen_mock, max_size=5, min_size=1, max_idle_time=60)
+    proxies = [pool.get() for _ in range(3)]
+    for p in proxies:
+      p.close()
+    self.assertEqual(3, len(pool.idle_conns))
+
+    with mock.patch.object(time, 'time', return_value=time.time() + 120):
+      self.assertEqual(2, pool.Reap())
+
+    # min_size connections are kept open.
+    self.assertEqual(1, len(pool.idle_conns))
+    self.assertEqual(2, sum(m.close.call_count for m in mocks))
+
+  def testValidationOnCheckout(self):
+    stale = mock.MagicMock()
+    stale.ping.side_effect = MySQLdb.OperationalError('Gone away')
+    fresh = mock.MagicMock()
+    conns = [stale, fresh]
+
+    pool = mysql_pool.Pool(lambda: conns.pop(0), max_size=5, validate_after=10)
+    pool.get().close()
+
+    with mock.patch.object(time, 'time', return_value=time.time() + 20):
+      with self.assertStatsCounterDelta(1, 'db_pool_validation_failures'):
+        con = pool.get()
+
+    self.assertIs(con.con, fresh)
+    self.assertEqual(1, stale.close.call_count)
+    con.close()
+
+  def testCheckoutMetrics(self):
+    pool = mysql_pool.Pool(mock.MagicMock, max_size=5)
+
+    with self.assertStatsCounterDelta(
+        1, 'db_pool_wait_time', fields=['caller']):
+      con = pool.get(caller='caller')
+    with self.assertStatsCounterDelta(
+        1, 'db_pool_checkout_duration', fields=['caller']):
+      con.close()
+
 
 if __name__ == '__main__':
   unittest.main()
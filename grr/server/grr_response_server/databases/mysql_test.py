@@ -13,6 +13,7 @@ import unittest
 from grr.server.grr_response_server import db_test_mixin
 from grr.server.grr_response_server import db_utils
 from grr.server.grr_response_server.databases import mysql
+from grr.server.grr_response_server.databases import mysql_pool
 from grr.test_lib import stats_test_lib
 
 
@@ -23,13 +24,8 @@ def _GetEnvironOrSkip(key):
   return value
 
 
-class TestMysqlDB(stats_test_lib.StatsTestMixin,
-                  db_test_mixin.DatabaseTestMixin, unittest.TestCase):
-  """Test the mysql.MysqlDB class.
-
-  Most of the tests in this suite are general blackbox tests of the db.Database
-  interface brought in by the db_test.DatabaseTestMixin.
-  """
+class MysqlTestMixin(object):
+  """A mixin creating a fresh MySQL database for every test."""
 
   def CreateDatabase(self):
     # pylint: disable=unreachable
@@ -55,6 +51,15 @@ class TestMysqlDB(stats_test_lib.StatsTestMixin,
         host=host, port=port, user=user, passwd=passwd, db=dbname), Fin
     # pylint: enable=unreachable
 
+
+class TestMysqlDB(MysqlTestMixin, stats_test_lib.StatsTestMixin,
+                  db_test_mixin.DatabaseTestMixin, unittest.TestCase):
+  """Test the mysql.MysqlDB class.
+
+  Most of the tests in this suite are general blackbox tests of the db.Database
+  interface brought in by the db_test.DatabaseTestMixin.
+  """
+
   def testIsRetryable(self):
     self.assertFalse(mysql._IsRetryable(Exception("Some general error.")))
     self.assertFalse(
@@ -91,6 +96,7 @@ class TestMysqlDB(stats_test_lib.StatsTestMixin,
   def setUp(self):
     super(TestMysqlDB, self).setUp()
     db_utils.DBMetricsInit().RunOnce()
+    mysql_pool.PoolMetricsInit().RunOnce()
 
   def testRunInTransaction(self):
     self.db.delegate._RunInTransaction(
@@ -162,89 +168,6 @@ class TestMysqlDB(stats_test_lib.StatsTestMixin,
         1, "db_request_latency", fields=["ReadAllGRRUsers"]):
       self.db.ReadAllGRRUsers()
 
-  # Tests that we don't expect to pass yet.
-  # TODO(user): Finish implementation and enable these tests.
-  def testWritePathInfosRawValidates(self):
-    pass
-
-  def testWritePathInfosValidatesClient(self):
-    pass
-
-  def testWritePathInfosMetadata(self):
-    pass
-
-  def testWritePathInfosMetadataTimestampUpdate(self):
-    pass
-
-  def testWritePathInfosStatEntry(self):
-    pass
-
-  def testWritePathInfosExpansion(self):
-    pass
-
-  def testWritePathInfosTypeSeparated(self):
-    pass
-
-  def testWritePathInfosUpdates(self):
-    pass
-
-  def testWritePathInfosUpdatesAncestors(self):
-    pass
-
-  def testFindPathInfosByPathIDsNonExistent(self):
-    pass
-
-  def testFindPathInfoByPathIDNonExistent(self):
-    pass
-
-  def testFindPathInfoByPathIDTimestampStatEntry(self):
-    pass
-
-  def testFindPathInfosByPathIDsMany(self):
-    pass
-
-  def testWritePathInfosDuplicatedData(self):
-    pass
-
-  def testFindDescendentPathIDsEmptyResult(self):
-    pass
-
-  def testFindDescendentPathIDsSingleResult(self):
-    pass
-
-  def testFindDescendentPathIDsSingle(self):
-    pass
-
-  def testFindDescendentPathIDsBranching(self):
-    pass
-
-  def testFindDescendentPathIDsLimited(self):
-    pass
-
-  def testFindDescendentPathIDsTypeSeparated(self):
-    pass
-
-  def testFindDescendentPathIDsAll(self):
-    pass
-
-  # TODO(hanuszczak): Remove these once support for storing file hashes in
-  # the F1 backend is ready.
-
-  def testWritePathInfosHashEntry(self):
-    pass
-
-  def testWritePathInfosHashAndStatEntry(self):
-    pass
-
-  def testWritePathInfoHashAndStatEntrySeparateWrites(self):
-    pass
-
-  def testFindPathInfoByPathIDTimestampHashEntry(self):
-    pass
-
-  def testFindPathInfoByPathIDTimestampStatAndHashEntry(self):
-    pass
-
 
 if __name__ == "__main__":
   unittest.main()
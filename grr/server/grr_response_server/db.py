@@ -123,6 +123,21 @@ class Database(object):
         client sent a foreman message to the server.
     """
 
+  @abc.abstractmethod
+  def MultiWriteClientMetadata(self, metadatas):
+    """Writes metadata about multiple clients at once.
+
+    This is the batched counterpart of WriteClientMetadata, intended for
+    callers that update many clients at the same time (e.g. the frontend
+    recording client pings).
+
+    Args:
+      metadatas: A dict mapping GRR client id strings to
+        rdfvalues.objects.ClientMetadata instances. Only the certificate,
+        fleetspeak_enabled, first_seen, ping, clock, ip and last_foreman_time
+        fields are written, fields which are not set are left unchanged.
+    """
+
   @abc.abstractmethod
   def MultiReadClientMetadata(self, client_ids):
     """Reads ClientMetadata records for a list of clients.
@@ -161,6 +176,21 @@ class Database(object):
       UnknownClientError: The client_id is not known yet.
     """
 
+  @abc.abstractmethod
+  def MultiWriteClientSnapshot(self, clients):
+    """Writes new snapshots for multiple clients at once.
+
+    All snapshots are saved at the same "current" timestamp.
+
+    Args:
+      clients: A list of rdfvalues.objects.ClientSnapshot objects, at most one
+        per client.
+
+    Raises:
+      UnknownClientError: One of the clients is not known yet. In this case
+        no snapshot is written.
+    """
+
   @abc.abstractmethod
   def MultiReadClientSnapshot(self, client_ids):
     """Reads the latest client snapshots for a list of clients.
@@ -217,6 +247,32 @@ class Database(object):
       A string representing client id.
     """
 
+  @abc.abstractmethod
+  def ReadClientFullInfoPage(self,
+                             after_client_id=None,
+                             limit=1000,
+                             min_last_ping=None,
+                             include_last_snapshot=True):
+    """Reads full client information for a page of clients.
+
+    Clients are returned ordered by client id, so passing the id of the last
+    client of a page as after_client_id reads the next page without having to
+    enumerate all client ids up front.
+
+    Args:
+      after_client_id: If not None, only clients with ids strictly greater than
+                       after_client_id will be returned.
+      limit: Maximum number of clients to return.
+      min_last_ping: If not None, only the clients with last ping time bigger
+                     than min_last_ping will be returned.
+      include_last_snapshot: If False, the (potentially large) last client
+                             snapshot is not read and `last_snapshot` of the
+                             returned objects will be empty.
+
+    Returns:
+      A list of (client_id, `ClientFullInfo`) tuples ordered by client id.
+    """
+
   @abc.abstractmethod
   def WriteClientSnapshotHistory(self, clients):
     """Writes the full history for a particular client.
@@ -354,6 +410,36 @@ class Database(object):
         ids.
     """
 
+  @abc.abstractmethod
+  def SearchClients(self,
+                    keywords,
+                    keyword_prefixes=None,
+                    start_time=None,
+                    label_names=None,
+                    label_owners=None,
+                    after_client_id=None,
+                    limit=None):
+    """Finds clients associated with all of the given keywords.
+
+    Args:
+      keywords: An iterable container of keyword strings. Matching clients are
+        associated with every one of them.
+      keyword_prefixes: An iterable container of keyword prefix strings.
+        Matching clients are associated with at least one keyword starting with
+        each of the prefixes.
+      start_time: If set, should be an rdfvalue.RDFDatime and only keyword
+        associations made after this time are considered.
+      label_names: If set, only clients with a label with one of these names
+        are returned.
+      label_owners: If set, only labels owned by one of these users are
+        considered by the label_names filter.
+      after_client_id: If set, only clients with ids strictly greater than
+        after_client_id will be returned.
+      limit: If set, the maximum number of client ids to return.
+    Returns:
+      A sorted list of client ids.
+    """
+
   @abc.abstractmethod
   def RemoveClientKeyword(self, client_id, keyword):
     """Removes the association of a particular client to a keyword.
@@ -545,23 +631,34 @@ class Database(object):
       grantor_username: String with a username of a user granting the approval.
     """
 
-  def IterateAllClientsFullInfo(self, batch_size=50000, min_last_ping=None):
+  def IterateAllClientsFullInfo(self,
+                                batch_size=50000,
+                                min_last_ping=None,
+                                include_last_snapshot=True):
     """Iterates over all available clients and yields full info protobufs.
 
     Args:
       batch_size: Always reads <batch_size> client full infos at a time.
       min_last_ping: If not None, only the clients with last ping time bigger
                      than min_last_ping will be returned.
+      include_last_snapshot: If False, last client snapshots are not read.
     Yields:
       An rdfvalues.objects.ClientFullInfo object for each client in the db.
     """
-    all_client_ids = self.ReadAllClientIDs()
-
-    for batch in utils.Grouper(all_client_ids, batch_size):
-      res = self.MultiReadClientFullInfo(batch, min_last_ping=min_last_ping)
-      for full_info in res.values():
+    after_client_id = None
+    while True:
+      page = self.ReadClientFullInfoPage(
+          after_client_id=after_client_id,
+          limit=batch_size,
+          min_last_ping=min_last_ping,
+          include_last_snapshot=include_last_snapshot)
+      for _, full_info in page:
         yield full_info
 
+      if len(page) < batch_size:
+        break
+      after_client_id = page[-1][0]
+
   def IterateAllClientSnapshots(self, batch_size=50000):
     """Iterates over all available clients and yields client snapshot objects.
 
@@ -961,6 +1058,13 @@ class DatabaseValidationWrapper(Database):
         last_ip=last_ip,
         last_foreman=last_foreman)
 
+  def MultiWriteClientMetadata(self, metadatas):
+    for client_id, metadata in metadatas.iteritems():
+      self._ValidateClientId(client_id)
+      self._ValidateType(metadata, rdf_objects.ClientMetadata)
+
+    return self.delegate.MultiWriteClientMetadata(metadatas)
+
   def MultiReadClientMetadata(self, client_ids):
     for client_id in client_ids:
       self._ValidateClientId(client_id)
@@ -974,6 +1078,20 @@ class DatabaseValidationWrapper(Database):
 
     return self.delegate.WriteClientSnapshot(client)
 
+  def MultiWriteClientSnapshot(self, clients):
+    client_ids = set()
+    for client in clients:
+      if not isinstance(client, rdf_objects.ClientSnapshot):
+        raise TypeError("Expected `rdfvalues.objects.ClientSnapshot`, got: %s" %
+                        type(client))
+
+      self._ValidateClientId(client.client_id)
+      if client.client_id in client_ids:
+        raise ValueError("Duplicate client id '%s'" % client.client_id)
+      client_ids.add(client.client_id)
+
+    return self.delegate.MultiWriteClientSnapshot(clients)
+
   def MultiReadClientSnapshot(self, client_ids):
     for client_id in client_ids:
       self._ValidateClientId(client_id)
@@ -990,6 +1108,25 @@ class DatabaseValidationWrapper(Database):
   def ReadAllClientIDs(self):
     return self.delegate.ReadAllClientIDs()
 
+  def ReadClientFullInfoPage(self,
+                             after_client_id=None,
+                             limit=1000,
+                             min_last_ping=None,
+                             include_last_snapshot=True):
+    if after_client_id is not None:
+      self._ValidateClientId(after_client_id)
+    self._ValidateType(limit, (int, long))
+    if limit <= 0:
+      raise ValueError("Expected limit to be positive, got %d" % limit)
+    if min_last_ping is not None:
+      self._ValidateTimestamp(min_last_ping)
+
+    return self.delegate.ReadClientFullInfoPage(
+        after_client_id=after_client_id,
+        limit=limit,
+        min_last_ping=min_last_ping,
+        include_last_snapshot=include_last_snapshot)
+
   def WriteClientSnapshotHistory(self, clients):
     if not clients:
       raise ValueError("Clients are empty")
@@ -1078,6 +1215,43 @@ class DatabaseValidationWrapper(Database):
 
     return self.delegate.ListClientsForKeywords(keywords, start_time=start_time)
 
+  def SearchClients(self,
+                    keywords,
+                    keyword_prefixes=None,
+                    start_time=None,
+                    label_names=None,
+                    label_owners=None,
+                    after_client_id=None,
+                    limit=None):
+    keywords = set(keywords)
+    keyword_prefixes = set(keyword_prefixes or [])
+    if not keywords and not keyword_prefixes:
+      raise ValueError("At least one keyword or keyword prefix is required.")
+
+    for keyword_prefix in keyword_prefixes:
+      if not keyword_prefix:
+        raise ValueError("Keyword prefixes can't be empty.")
+
+    if start_time is not None:
+      self._ValidateTimestamp(start_time)
+
+    if after_client_id is not None:
+      self._ValidateClientId(after_client_id)
+
+    if limit is not None:
+      self._ValidateType(limit, (int, long))
+      if limit <= 0:
+        raise ValueError("Expected limit to be positive, got %d" % limit)
+
+    return self.delegate.SearchClients(
+        keywords,
+        keyword_prefixes=keyword_prefixes,
+        start_time=start_time,
+        label_names=label_names,
+        label_owners=label_owners,
+        after_client_id=after_client_id,
+        limit=limit)
+
   def RemoveClientKeyword(self, client_id, keyword):
     self._ValidateClientId(client_id)
 
@@ -147,6 +147,44 @@ class DatabaseTestClientsMixin(object):
         m1.ip, rdf_client.NetworkAddress(human_readable_address="8.8.8.8"))
     self.assertEqual(m1.last_foreman_time, rdfvalue.RDFDatetime(220000000000))
 
+  def testMultiWriteClientMetadata(self):
+    client_id_1 = self.InitializeClient()
+    client_id_2 = self.InitializeClient()
+    client_id_3 = "C.00413187fefa1dcf"
+
+    self.db.MultiWriteClientMetadata({
+        client_id_1:
+            objects.ClientMetadata(
+                ping=rdfvalue.RDFDatetime(200000000000),
+                clock=rdfvalue.RDFDatetime(210000000000),
+                ip=rdf_client.NetworkAddress(human_readable_address="8.8.8.8")),
+        client_id_2:
+            objects.ClientMetadata(ping=rdfvalue.RDFDatetime(300000000000)),
+        client_id_3:
+            objects.ClientMetadata(certificate=CERT, fleetspeak_enabled=False),
+    })
+
+    res = self.db.MultiReadClientMetadata(
+        [client_id_1, client_id_2, client_id_3])
+
+    self.assertTrue(res[client_id_1].fleetspeak_enabled)
+    self.assertEqual(res[client_id_1].ping, rdfvalue.RDFDatetime(200000000000))
+    self.assertEqual(res[client_id_1].clock,
+                     rdfvalue.RDFDatetime(210000000000))
+    self.assertEqual(
+        res[client_id_1].ip,
+        rdf_client.NetworkAddress(human_readable_address="8.8.8.8"))
+
+    self.assertEqual(res[client_id_2].ping, rdfvalue.RDFDatetime(300000000000))
+    self.assertFalse(res[client_id_2].clock)
+
+    self.assertFalse(res[client_id_3].fleetspeak_enabled)
+    self.assertEqual(res[client_id_3].certificate, CERT)
+
+  def testMultiWriteClientMetadataValidatesType(self):
+    with self.assertRaises(TypeError):
+      self.db.MultiWriteClientMetadata({"C.fc413187fefa1dcf": "foo"})
+
   def testClientMetadataValidatesIP(self):
     d = self.db
     client_id = "C.fc413187fefa1dcf"
@@ -471,6 +509,54 @@ class DatabaseTestClientsMixin(object):
       self.db.WriteClientSnapshotHistory([client])
     self.assertEqual(context.exception.client_id, client_id)
 
+  def testMultiWriteClientSnapshot(self):
+    client_id_1 = self.InitializeClient()
+    client_id_2 = self.InitializeClient()
+
+    self.db.MultiWriteClientSnapshot([
+        objects.ClientSnapshot(
+            client_id=client_id_1,
+            kernel="12.3",
+            startup_info=rdf_client.StartupInfo(boot_time=123)),
+        objects.ClientSnapshot(
+            client_id=client_id_2,
+            kernel="12.4",
+            startup_info=rdf_client.StartupInfo(boot_time=124)),
+    ])
+
+    res = self.db.MultiReadClientSnapshot([client_id_1, client_id_2])
+    self.assertEqual(res[client_id_1].kernel, "12.3")
+    self.assertEqual(res[client_id_1].startup_info.boot_time, 123)
+    self.assertEqual(res[client_id_2].kernel, "12.4")
+    self.assertEqual(res[client_id_2].startup_info.boot_time, 124)
+    self.assertEqual(res[client_id_1].timestamp, res[client_id_2].timestamp)
+
+    startup_info = self.db.ReadClientStartupInfo(client_id_2)
+    self.assertEqual(startup_info.boot_time, 124)
+
+  def testMultiWriteClientSnapshotRaisesOnUnknownClient(self):
+    client_id = self.InitializeClient()
+    unknown_client_id = "C.0000000000000000"
+
+    with self.assertRaises(db.UnknownClientError) as context:
+      self.db.MultiWriteClientSnapshot([
+          objects.ClientSnapshot(client_id=client_id),
+          objects.ClientSnapshot(client_id=unknown_client_id)
+      ])
+    self.assertEqual(context.exception.client_id, unknown_client_id)
+
+    # Nothing should have been written for the known client either.
+    self.assertIsNone(self.db.ReadClientSnapshot(client_id))
+
+  def testMultiWriteClientSnapshotRaisesOnDuplicateClient(self):
+    client_id = self.InitializeClient()
+
+    with self.assertRaises(ValueError):
+      self.db.MultiWriteClientSnapshot([
+          objects.ClientSnapshot(client_id=client_id),
+          objects.ClientSnapshot(client_id=client_id)
+      ])
+
   def testClientStartupInfo(self):
     """StartupInfo is written to a separate table, make sure the merge works."""
     d = self.db
@@ -596,6 +682,104 @@ class DatabaseTestClientsMixin(object):
     self.assertEqual(res["hostname1"], [])
     self.assertEqual(res["hostname2"], [client_id])
 
+  def _SetupSearchClients(self):
+    client_ids = []
+    for i in range(4):
+      client_id = "C.100000000000000%d" % i
+      self.InitializeClient(client_id)
+      client_ids.append(client_id)
+
+    self.db.AddClientKeywords(client_ids[0],
+                              [".", "os:linux", "host:web-1", "host:web"])
+    self.db.AddClientKeywords(client_ids[1],
+                              [".", "os:linux", "host:web-2", "host:web"])
+    self.db.AddClientKeywords(client_ids[2], [".", "os:linux", "host:db-1"])
+    self.db.AddClientKeywords(client_ids[3],
+                              [".", "os:windows", "host:web_3", "host:web"])
+    return client_ids
+
+  def testSearchClientsIntersectsKeywords(self):
+    client_ids = self._SetupSearchClients()
+
+    self.assertEqual(self.db.SearchClients(["."]), client_ids)
+    self.assertEqual(
+        self.db.SearchClients(["os:linux", "host:web"]), client_ids[:2])
+    self.assertEqual(
+        self.db.SearchClients([".", "os:windows"]), client_ids[3:])
+    self.assertEqual(self.db.SearchClients(["os:linux", "host:missing"]), [])
+
+  def testSearchClientsKeywordPrefixes(self):
+    client_ids = self._SetupSearchClients()
+
+    self.assertEqual(
+        self.db.SearchClients([], keyword_prefixes=["host:web-"]),
+        client_ids[:2])
+    self.assertEqual(
+        self.db.SearchClients(["os:linux"], keyword_prefixes=["host:"]),
+        client_ids[:3])
+    self.assertEqual(
+        self.db.SearchClients([], keyword_prefixes=["os:", "host:db"]),
+        client_ids[2:3])
+    # Prefixes are matched literally.
+    self.assertEqual(
+        self.db.SearchClients([], keyword_prefixes=["host:web_"]),
+        client_ids[3:])
+    self.assertEqual(
+        self.db.SearchClients([], keyword_prefixes=["host:w%"]), [])
+
+  def testSearchClientsStartTime(self):
+    client_ids = self._SetupSearchClients()
+
+    change_time = rdfvalue.RDFDatetime.Now()
+    self.db.AddClientKeywords(client_ids[1], ["os:linux"])
+
+    self.assertEqual(
+        self.db.SearchClients(["os:linux"], start_time=change_time),
+        client_ids[1:2])
+    self.assertEqual(
+        self.db.SearchClients(
+            ["."], keyword_prefixes=["os:"], start_time=change_time), [])
+
+  def testSearchClientsLabels(self):
+    client_ids = self._SetupSearchClients()
+    self.db.AddClientLabels(client_ids[0], "owner1", ["prod"])
+    self.db.AddClientLabels(client_ids[1], "owner2", ["prod"])
+    self.db.AddClientLabels(client_ids[2], "owner1", ["dev"])
+
+    self.assertEqual(
+        self.db.SearchClients(["os:linux"], label_names=["prod"]),
+        client_ids[:2])
+    self.assertEqual(
+        self.db.SearchClients(["os:linux"], label_names=["prod", "dev"]),
+        client_ids[:3])
+    self.assertEqual(
+        self.db.SearchClients(
+            ["os:linux"], label_names=["prod"], label_owners=["owner2"]),
+        client_ids[1:2])
+    self.assertEqual(
+        self.db.SearchClients(["os:windows"], label_names=["prod"]), [])
+
+  def testSearchClientsPages(self):
+    client_ids = self._SetupSearchClients()
+
+    self.assertEqual(self.db.SearchClients(["."], limit=2), client_ids[:2])
+    self.assertEqual(
+        self.db.SearchClients(["."], after_client_id=client_ids[1], limit=1),
+        client_ids[2:3])
+    self.assertEqual(
+        self.db.SearchClients(["."], after_client_id=client_ids[2]),
+        client_ids[3:])
+
+  def testSearchClientsValidatesArguments(self):
+    with self.assertRaises(ValueError):
+      self.db.SearchClients([])
+    with self.assertRaises(ValueError):
+      self.db.SearchClients([], keyword_prefixes=[""])
+    with self.assertRaises(ValueError):
+      self.db.SearchClients(["."], limit=0)
+    with self.assertRaises(TypeError):
+      self.db.SearchClients(["."], start_time=rdfvalue.Duration("1s"))
+
   def testRemoveClientKeyword(self):
     d = self.db
     client_id = self.InitializeClient()
@@ -975,6 +1159,64 @@ class DatabaseTestClientsMixin(object):
     self._SetupFullInfoClients()
     self._VerifyFullInfos(self.db.IterateAllClientsFullInfo(batch_size=2))
 
+  def testIterateAllClientsFullInfoWithoutSnapshots(self):
+    self._SetupFullInfoClients()
+    c_infos = list(
+        self.db.IterateAllClientsFullInfo(
+            batch_size=3, include_last_snapshot=False))
+    self.assertEqual(len(c_infos), 10)
+    for full_info in c_infos:
+      self.assertFalse(full_info.last_snapshot.HasField("timestamp"))
+      self.assertEqual(full_info.metadata.certificate, CERT)
+      self.assertEqual(len(full_info.labels), 2)
+
+  def testReadClientFullInfoPage(self):
+    self._SetupFullInfoClients()
+
+    page = self.db.ReadClientFullInfoPage(limit=4)
+    self.assertEqual([client_id for client_id, _ in page],
+                     ["C.000000005000000%d" % i for i in range(4)])
+
+    page = self.db.ReadClientFullInfoPage(
+        after_client_id="C.0000000050000003", limit=4)
+    self.assertEqual([client_id for client_id, _ in page],
+                     ["C.000000005000000%d" % i for i in range(4, 8)])
+    for i, (_, full_info) in enumerate(page):
+      self.assertEqual(full_info.last_snapshot.client_id,
+                       "C.000000005000000%d" % (i + 4))
+      self.assertEqual(full_info.last_startup_info.boot_time, i + 4)
+
+    page = self.db.ReadClientFullInfoPage(
+        after_client_id="C.0000000050000007", limit=4)
+    self.assertEqual([client_id for client_id, _ in page],
+                     ["C.0000000050000008", "C.0000000050000009"])
+
+    page = self.db.ReadClientFullInfoPage(
+        after_client_id="C.0000000050000009", limit=4)
+    self.assertEqual(page, [])
+
+  def testReadClientFullInfoPageFiltersClientsByLastPingTime(self):
+    base_time = rdfvalue.RDFDatetime.Now()
+    cutoff_time = base_time - rdfvalue.Duration("1s")
+    client_ids_to_ping = self._SetupLastPingClients(base_time)
+
+    expected_client_ids = sorted(
+        cid for cid, ping in client_ids_to_ping.items() if ping == base_time)
+
+    page = self.db.ReadClientFullInfoPage(
+        limit=2, min_last_ping=cutoff_time)
+    self.assertEqual([client_id for client_id, _ in page],
+                     expected_client_ids[:2])
+
+    page = self.db.ReadClientFullInfoPage(
+        after_client_id=page[-1][0], limit=10, min_last_ping=cutoff_time)
+    self.assertEqual([client_id for client_id, _ in page],
+                     expected_client_ids[2:])
+
+  def testReadClientFullInfoPageValidatesLimit(self):
+    with self.assertRaises(ValueError):
+      self.db.ReadClientFullInfoPage(limit=0)
+
   def testIterateAllClientSnapshots(self):
     self._SetupFullInfoClients()
     snapshots = self.db.IterateAllClientSnapshots()
@@ -389,6 +389,19 @@ class DatabaseTestPathsMixin(object):
     self.assertIsNone(results[objects.PathID(["foo", "baz"])])
     self.assertIsNone(results[objects.PathID(["quux", "norf"])])
 
+  def testFindPathInfoByPathIDSpecialComponents(self):
+    client_id = self.InitializeClient()
+
+    components = ["foo/bar", "100%", "%2F"]
+    self.db.WritePathInfos(client_id,
+                           [objects.PathInfo.OS(components=components)])
+
+    for i in range(len(components) + 1):
+      result_path_info = self.db.FindPathInfoByPathID(
+          client_id, objects.PathInfo.PathType.OS,
+          objects.PathID(components[:i]))
+      self.assertEqual(result_path_info.components, components[:i])
+
   def testFindPathInfoByPathIDValidatesTimestamp(self):
     client_id = self.InitializeClient()
     path_id = objects.PathID(["foo", "bar", "baz"])
@@ -580,6 +593,15 @@ class DatabaseTestPathsMixin(object):
                                             objects.PathID(["foo"]))
     self.assertItemsEqual(results, [])
 
+  def testFindDescendentPathIDsUnknownPath(self):
+    client_id = self.InitializeClient()
+
+    self.db.WritePathInfos(client_id, [objects.PathInfo.OS(components=["foo"])])
+
+    with self.assertRaises(KeyError):
+      self.db.FindDescendentPathIDs(client_id, objects.PathInfo.PathType.OS,
+                                    objects.PathID(["bar"]))
+
   def testFindDescendentPathIDsSingleResult(self):
     client_id = self.InitializeClient()
 
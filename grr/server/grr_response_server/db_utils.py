@@ -42,6 +42,35 @@ def CallLoggedAndAccounted(f):
   return Decorator
 
 
+# Maps ClientMetadata fields to the matching WriteClientMetadata arguments.
+_CLIENT_METADATA_WRITE_ARGS = {
+    "certificate": "certificate",
+    "fleetspeak_enabled": "fleetspeak_enabled",
+    "first_seen": "first_seen",
+    "ping": "last_ping",
+    "clock": "last_clock",
+    "ip": "last_ip",
+    "last_foreman_time": "last_foreman",
+}
+
+
+def ClientMetadataToWriteArgs(metadata):
+  """Converts a ClientMetadata object to WriteClientMetadata keyword args.
+
+  Args:
+    metadata: An rdfvalues.objects.ClientMetadata instance.
+
+  Returns:
+    A dict of keyword arguments for Database.WriteClientMetadata, containing
+    only the fields set in metadata.
+  """
+  return {
+      arg: getattr(metadata, field)
+      for field, arg in _CLIENT_METADATA_WRITE_ARGS.iteritems()
+      if metadata.HasField(field)
+  }
+
+
 class DBMetricsInit(registry.InitHook):
   """Install database metrics."""
 
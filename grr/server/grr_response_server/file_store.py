@@ -1,9 +1,13 @@
 #!/usr/bin/env python
 """A manager for storing files locally."""
 
+import fcntl
 import hashlib
 import os
+import re
 import shutil
+import threading
+import time
 
 from grr import config
 from grr.lib import rdfvalue
@@ -11,6 +15,24 @@ from grr.lib import registry
 from grr.server.grr_response_server import aff4
 from grr.server.grr_response_server.aff4_objects import standard
 
+_ID_RE = re.compile(r"^[0-9a-f]{64}$")
+
+
+class Error(Exception):
+  pass
+
+
+class UnknownUploadError(Error):
+  pass
+
+
+class UploadOffsetError(Error):
+  """Raised when data is written at an offset the upload is not at."""
+
+  def __init__(self, message, offset):
+    super(UploadOffsetError, self).__init__(message)
+    self.offset = offset
+
 
 class UploadFileStore(object):
   """A class to manage writing to a file location."""
@@ -20,6 +42,29 @@ class UploadFileStore(object):
   def CreateFileStoreFile(self):
     """Creates a new file for writing."""
 
+  def ResumeFileStoreFile(self, upload_id):
+    """Reopens an unfinished file for writing.
+
+    Args:
+      upload_id: The upload_id of a file returned by CreateFileStoreFile.
+
+    Returns:
+      A file handle positioned at the end of the data written so far.
+
+    Raises:
+      UnknownUploadError: If there is no unfinished file with this id.
+    """
+
+  def OpenForReading(self, file_id):
+    """Opens a finished file for reading.
+
+    Args:
+      file_id: The id returned when the file was finalized.
+
+    Returns:
+      A seekable file like object.
+    """
+
 
 class FileStoreAFF4Object(aff4.AFF4Stream):
   """An AFF4 object which allows to read the files in the filestore."""
@@ -58,23 +103,79 @@ class FileStoreAFF4Object(aff4.AFF4Stream):
 
 
 class FileStoreFDCreator(object):
-  """A handle to a file opened via the FileUploadFileStore."""
+  """A handle to a file opened via the FileUploadFileStore.
+
+  Files are written to a temporary location until they are finalized. The
+  temporary file is identified by upload_id, so an upload interrupted before
+  Finalize() can be continued with FileUploadFileStore.ResumeFileStoreFile.
+  Handles hold an exclusive lock on the file until they are closed, so
+  writes to the same upload are serialized.
+  """
+
+  def __init__(self, upload_id=None):
+    if upload_id is None:
+      self.upload_id = os.urandom(32).encode("hex")
+    else:
+      self.upload_id = FileUploadFileStore.ValidateId(upload_id)
+    self.tmp_path = FileUploadFileStore.PathForId(self.upload_id, prefix="tmp")
 
-  def __init__(self):
-    self.tmp_path = FileUploadFileStore.PathForId(
-        os.urandom(32).encode("hex"), prefix="tmp")
-    # Ensure the directory exists.
-    try:
-      os.makedirs(os.path.dirname(self.tmp_path))
-    except (IOError, OSError):
-      pass
+    if upload_id is None:
+      # Ensure the directory exists.
+      try:
+        os.makedirs(os.path.dirname(self.tmp_path))
+      except (IOError, OSError):
+        pass
 
-    self._fd = open(self.tmp_path, mode="wb")
-    self.hasher = hashlib.sha256()
+      self._fd = open(self.tmp_path, mode="wb")
+      self._Lock()
+      self.hasher = hashlib.sha256()
+    else:
+      try:
+        self._fd = open(self.tmp_path, mode="r+b")
+      except IOError:
+        raise UnknownUploadError("Unknown upload: %s" % upload_id)
+      self._Lock()
+      self._fd.seek(0, os.SEEK_END)
+      # The hash state of the previous writer is lost, the file is hashed as
+      # a whole once it is finalized.
+      self.hasher = None
+
+    self.offset = self._fd.tell()
+
+  def _Lock(self):
+    """Waits until no other handle has the upload open."""
+    fcntl.flock(self._fd, fcntl.LOCK_EX)
+
+    # The upload may have been finalized or expired while we waited.
+    try:
+      linked = os.stat(self.tmp_path).st_ino == os.fstat(
+          self._fd.fileno()).st_ino
+    except OSError:
+      linked = False
+    if not linked:
+      self._fd.close()
+      raise UnknownUploadError("Unknown upload: %s" % self.upload_id)
+
+  def Write(self, data, offset=None):
+    """Writes data at the end of the file.
+
+    Args:
+      data: The data to write.
+      offset: If given, the offset the data belongs at. Uploads are append
+        only, so this has to be the number of bytes written so far.
+
+    Raises:
+      UploadOffsetError: If offset is not the end of the file.
+    """
+    if offset is not None and offset != self.offset:
+      raise UploadOffsetError(
+          "Data at offset %d written to upload %s at offset %d." %
+          (offset, self.upload_id, self.offset), self.offset)
 
-  def Write(self, data):
     self._fd.write(data)
-    self.hasher.update(data)
+    self.offset += len(data)
+    if self.hasher is not None:
+      self.hasher.update(data)
 
   def Flush(self):
     self._fd.flush()
@@ -88,19 +189,29 @@ class FileStoreFDCreator(object):
 
   def Finalize(self):
     """Move the file to the hash based filename and return the file id."""
-    self._fd.close()
-    final_id = self.hasher.hexdigest()
-    final_filename = FileUploadFileStore.PathForId(final_id)
-
-    if not os.path.exists(final_filename):
-      # Ensure the directory exists.
-      try:
-        os.makedirs(os.path.dirname(final_filename))
-      except (IOError, OSError):
-        pass
-      shutil.move(self.tmp_path, final_filename)
-    else:
-      os.remove(self.tmp_path)
+    # The file is moved before the lock is released by closing it.
+    try:
+      self._fd.flush()
+      if self.hasher is None:
+        self.hasher = hashlib.sha256()
+        with open(self.tmp_path, "rb") as fd:
+          for data in iter(lambda: fd.read(1024 * 1024), ""):
+            self.hasher.update(data)
+
+      final_id = self.hasher.hexdigest()
+      final_filename = FileUploadFileStore.PathForId(final_id)
+
+      if not os.path.exists(final_filename):
+        # Ensure the directory exists.
+        try:
+          os.makedirs(os.path.dirname(final_filename))
+        except (IOError, OSError):
+          pass
+        shutil.move(self.tmp_path, final_filename)
+      else:
+        os.remove(self.tmp_path)
+    finally:
+      self._fd.close()
 
     return final_id
 
@@ -108,6 +219,21 @@ class FileStoreFDCreator(object):
 class FileUploadFileStore(UploadFileStore):
   """An implementation of upload server based on files."""
 
+  # Unfinished uploads are expired at most this often, in seconds.
+  EXPIRY_INTERVAL = 3600
+
+  _last_expiry = 0
+  _expiry_lock = threading.Lock()
+
+  @classmethod
+  def ValidateId(cls, file_id):
+    """Checks that an id given by a client can't point outside the store."""
+    file_id = str(file_id).lower()
+    if not _ID_RE.match(file_id):
+      raise ValueError("Invalid file id: %r" % file_id)
+
+    return file_id
+
   @classmethod
   def PathForId(cls, file_id, prefix=""):
     root_dir = config.CONFIG["FileUploadFileStore.root_dir"]
@@ -115,8 +241,56 @@ class FileUploadFileStore(UploadFileStore):
                         file_id[3:])
 
   def CreateFileStoreFile(self):
+    self._MaybeExpireUploads()
     return FileStoreFDCreator()
 
+  def _MaybeExpireUploads(self):
+    max_age = config.CONFIG["FileUploadFileStore.unfinished_upload_ttl"]
+    if not max_age:
+      return
+
+    if not FileUploadFileStore._expiry_lock.acquire(False):
+      return
+    try:
+      now = time.time()
+      if now - FileUploadFileStore._last_expiry < self.EXPIRY_INTERVAL:
+        return
+      FileUploadFileStore._last_expiry = now
+      self.ExpireUploads(max_age)
+    finally:
+      FileUploadFileStore._expiry_lock.release()
+
+  def ExpireUploads(self, max_age):
+    """Removes unfinished uploads that were not written to for max_age.
+
+    Args:
+      max_age: An rdfvalue.Duration.
+
+    Returns:
+      The number of removed uploads.
+    """
+    deadline = time.time() - max_age.seconds
+    tmp_root = os.path.join(config.CONFIG["FileUploadFileStore.root_dir"],
+                            "tmp")
+    removed = 0
+    for dirpath, _, filenames in os.walk(tmp_root):
+      for filename in filenames:
+        path = os.path.join(dirpath, filename)
+        try:
+          with open(path, "rb") as fd:
+            # Uploads that are being written to are skipped.
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            if os.fstat(fd.fileno()).st_mtime < deadline:
+              os.remove(path)
+              removed += 1
+        except (IOError, OSError):
+          continue
+
+    return removed
+
+  def ResumeFileStoreFile(self, upload_id):
+    return FileStoreFDCreator(upload_id=upload_id)
+
   def OpenForReading(self, file_id):
     path = self.PathForId(file_id)
     return open(path, "rb")
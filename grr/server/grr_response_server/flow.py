@@ -315,6 +315,209 @@ class AttributedDict(dict):
     self.__dict__ = self
 
 
+class IncrementalStateDict(dict):
+  """A dict in the flow state that is stored with one data store row per entry.
+
+  The dict keeps track of the entries changed since the state was last
+  written, so only their rows are written. Entries that are read are
+  considered changed as well since they are often modified in place, so
+  entries have to be accessed through the dict, copies of it are not
+  tracked.
+  """
+
+  def __init__(self, *args, **kwargs):
+    super(IncrementalStateDict, self).__init__(*args, **kwargs)
+    self.changed = set()
+    self.removed = set()
+
+  def _Change(self, key):
+    self.changed.add(key)
+    self.removed.discard(key)
+
+  def _Remove(self, key):
+    self.changed.discard(key)
+    self.removed.add(key)
+
+  def ChangeAll(self):
+    self.changed.update(self.iterkeys())
+
+  def GetChanges(self):
+    """Returns the changed (key, value) pairs and the removed keys."""
+    changed = [(key, dict.__getitem__(self, key))
+               for key in self.changed
+               if key in self]
+    return changed, list(self.removed)
+
+  def ClearChanges(self):
+    self.changed = set()
+    self.removed = set()
+
+  def __getitem__(self, key):
+    value = super(IncrementalStateDict, self).__getitem__(key)
+    self._Change(key)
+    return value
+
+  def __setitem__(self, key, value):
+    super(IncrementalStateDict, self).__setitem__(key, value)
+    self._Change(key)
+
+  def __delitem__(self, key):
+    super(IncrementalStateDict, self).__delitem__(key)
+    self._Remove(key)
+
+  def get(self, key, default=None):
+    if key in self:
+      return self[key]
+    return default
+
+  def setdefault(self, key, default=None):
+    if key not in self:
+      self[key] = default
+    return self[key]
+
+  def pop(self, key, *args):
+    had_key = key in self
+    value = super(IncrementalStateDict, self).pop(key, *args)
+    if had_key:
+      self._Remove(key)
+    return value
+
+  def popitem(self):
+    key, value = super(IncrementalStateDict, self).popitem()
+    self._Remove(key)
+    return key, value
+
+  def update(self, *args, **kwargs):
+    for key, value in dict(*args, **kwargs).iteritems():
+      self[key] = value
+
+  def clear(self):
+    self.removed.update(self.iterkeys())
+    self.changed = set()
+    super(IncrementalStateDict, self).clear()
+
+  def items(self):
+    self.ChangeAll()
+    return super(IncrementalStateDict, self).items()
+
+  def iteritems(self):
+    self.ChangeAll()
+    return super(IncrementalStateDict, self).iteritems()
+
+  def values(self):
+    self.ChangeAll()
+    return super(IncrementalStateDict, self).values()
+
+  def itervalues(self):
+    self.ChangeAll()
+    return super(IncrementalStateDict, self).itervalues()
+
+
+class IncrementalStateList(list):
+  """A list in the flow state that is stored with one data store row per item.
+
+  Like IncrementalStateDict, but keyed by index. Appending and replacing
+  items only writes their rows, operations moving items around rewrite the
+  whole list.
+  """
+
+  def __init__(self, *args, **kwargs):
+    super(IncrementalStateList, self).__init__(*args, **kwargs)
+    self.changed = set()
+    # The number of rows in the data store.
+    self.stored_length = len(self)
+
+  def ChangeAll(self):
+    self.changed.update(xrange(len(self)))
+
+  def GetChanges(self):
+    """Returns the changed (index, item) pairs and the removed indexes."""
+    changed = [(index, list.__getitem__(self, index))
+               for index in self.changed
+               if index < len(self)]
+    return changed, range(len(self), self.stored_length)
+
+  def ClearChanges(self):
+    self.changed = set()
+    self.stored_length = len(self)
+
+  def _Index(self, index):
+    if index < 0:
+      index += len(self)
+    return index
+
+  def __getitem__(self, index):
+    value = super(IncrementalStateList, self).__getitem__(index)
+    if isinstance(index, slice):
+      self.ChangeAll()
+    else:
+      self.changed.add(self._Index(index))
+    return value
+
+  def __getslice__(self, start, end):
+    self.ChangeAll()
+    return super(IncrementalStateList, self).__getslice__(start, end)
+
+  def __setitem__(self, index, value):
+    super(IncrementalStateList, self).__setitem__(index, value)
+    if isinstance(index, slice):
+      self.ChangeAll()
+    else:
+      self.changed.add(self._Index(index))
+
+  def __iter__(self):
+    self.ChangeAll()
+    return super(IncrementalStateList, self).__iter__()
+
+  def append(self, value):
+    super(IncrementalStateList, self).append(value)
+    self.changed.add(len(self) - 1)
+
+  def extend(self, values):
+    start = len(self)
+    super(IncrementalStateList, self).extend(values)
+    self.changed.update(xrange(start, len(self)))
+
+  # Operations moving items around change all of them.
+
+  def __delitem__(self, index):
+    super(IncrementalStateList, self).__delitem__(index)
+    self.ChangeAll()
+
+  def __delslice__(self, start, end):
+    super(IncrementalStateList, self).__delslice__(start, end)
+    self.ChangeAll()
+
+  def __setslice__(self, start, end, values):
+    super(IncrementalStateList, self).__setslice__(start, end, values)
+    self.ChangeAll()
+
+  def __iadd__(self, values):
+    self.extend(values)
+    return self
+
+  def insert(self, index, value):
+    super(IncrementalStateList, self).insert(index, value)
+    self.ChangeAll()
+
+  def pop(self, *args):
+    value = super(IncrementalStateList, self).pop(*args)
+    self.ChangeAll()
+    return value
+
+  def remove(self, value):
+    super(IncrementalStateList, self).remove(value)
+    self.ChangeAll()
+
+  def reverse(self):
+    super(IncrementalStateList, self).reverse()
+    self.ChangeAll()
+
+  def sort(self, *args, **kwargs):
+    super(IncrementalStateList, self).sort(*args, **kwargs)
+    self.ChangeAll()
+
+
 class PendingFlowTermination(rdf_structs.RDFProtoStruct):
   """Descriptor of a pending flow termination."""
   protobuf = jobs_pb2.PendingFlowTermination
@@ -681,6 +884,9 @@ class FlowBase(aff4.AFF4Volume):
         request_data=request_data,
         **kwargs)
 
+  def CallClientBatch(self, calls, **kwargs):
+    return self.runner.CallClientBatch(calls, **kwargs)
+
   def CallStateInline(self,
                       messages=None,
                       next_state="",
@@ -797,11 +1003,31 @@ class GRRFlow(FlowBase):
   # Behaviors set attributes of this flow. See FlowBehavior() above.
   behaviours = FlowBehaviour("ADVANCED")
 
+  # Names of state variables holding large dicts or lists. These are not
+  # stored as part of the flow state but with one row per entry, and only the
+  # changed entries are written when the flow is flushed.
+  incremental_state = []
+
+  INCREMENTAL_STATE_PREFIX = "flow_state:"
+
+  # Stored in the flow state in place of incremental dicts and lists.
+  _INCREMENTAL_TYPES = {
+      "__incremental_dict__": IncrementalStateDict,
+      "__incremental_list__": IncrementalStateList,
+  }
+
   def Initialize(self):
     """The initialization method."""
     super(GRRFlow, self).Initialize()
     self._client_version = None
     self._client_os = None
+    # The incremental state containers as last read or written.
+    self._incremental_state = {}
+    # Names of incremental state variables with stored rows not read yet.
+    self._unloaded_incremental_state = set()
+    # Rows written together with the flow attributes, see _WriteAttributes.
+    self._incremental_rows_to_set = {}
+    self._incremental_rows_to_delete = set()
 
     if "r" in self.mode:
       state = self.Get(self.Schema.FLOW_STATE_DICT)
@@ -816,6 +1042,9 @@ class GRRFlow(FlowBase):
       else:
         self.state = AttributedDict()
 
+      self._unloaded_incremental_state = set(
+          name for name in self.incremental_state
+          if self._IsIncrementalStateMarker(self.state.get(name)))
       self.Load()
 
     if self.state is None:
@@ -855,13 +1084,149 @@ class GRRFlow(FlowBase):
     if self.context is None:
       raise IOError("Trying to write a flow without context: %s." % self.urn)
 
+  def _IncrementalStateRow(self, name, key):
+    return "%s%s:%s" % (self.INCREMENTAL_STATE_PREFIX, name,
+                        utils.SmartStr(key))
+
+  def _IsIncrementalStateMarker(self, value):
+    return isinstance(value, basestring) and value in self._INCREMENTAL_TYPES
+
+  def LoadIncrementalState(self):
+    """Replaces the incremental state markers with the stored containers.
+
+    The containers are only read when a state method runs, opening the flow
+    doesn't read them.
+    """
+    names = [
+        name for name in self._unloaded_incremental_state
+        if self._IsIncrementalStateMarker(self.state.get(name))
+    ]
+    self._unloaded_incremental_state.clear()
+    if not names:
+      return
+
+    entries = dict((name, {}) for name in names)
+    for row, value, _ in data_store.DB.ResolvePrefix(
+        self.urn, self.INCREMENTAL_STATE_PREFIX):
+      name = row[len(self.INCREMENTAL_STATE_PREFIX):].split(":", 1)[0]
+      if name not in entries:
+        continue
+
+      key_value = rdf_protodict.KeyValue.FromSerializedString(value)
+      item = key_value.v.GetValue()
+      if isinstance(item, rdf_protodict.Dict):
+        item = item.ToDict()
+      entries[name][key_value.k.GetValue()] = item
+
+    for name in names:
+      container_cls = self._INCREMENTAL_TYPES[self.state[name]]
+      if container_cls is IncrementalStateList:
+        items = entries[name]
+        container = IncrementalStateList(items[i] for i in xrange(len(items)))
+      else:
+        container = IncrementalStateDict(entries[name])
+
+      self.state[name] = container
+      self._incremental_state[name] = container
+
+  def _WriteIncrementalState(self):
+    """Queues the changed entries of the incremental state containers.
+
+    The rows are written by _WriteAttributes.
+
+    Returns:
+      A copy of the flow state with the containers replaced by markers.
+    """
+    state = dict(self.state)
+    to_set = self._incremental_rows_to_set
+    to_delete = self._incremental_rows_to_delete
+    for name in self.incremental_state:
+      value = self.state.get(name)
+      if (name in self._unloaded_incremental_state and
+          self._IsIncrementalStateMarker(value)):
+        # Not read, so not changed either.
+        continue
+
+      if value is None or value is not self._incremental_state.get(name):
+        if (name in self._incremental_state or
+            name in self._unloaded_incremental_state):
+          # The container was replaced, its rows are stale now.
+          self._incremental_state.pop(name, None)
+          self._unloaded_incremental_state.discard(name)
+          to_delete.update(
+              row for row, _, _ in data_store.DB.ResolvePrefix(
+                  self.urn, "%s%s:" % (self.INCREMENTAL_STATE_PREFIX, name)))
+
+        if isinstance(value, dict):
+          value = IncrementalStateDict(value)
+        elif isinstance(value, list):
+          value = IncrementalStateList(value)
+        else:
+          continue
+
+        value.ChangeAll()
+        self.state[name] = value
+        self._incremental_state[name] = value
+
+      changed, removed = value.GetChanges()
+      for key, item in changed:
+        row = self._IncrementalStateRow(name, key)
+        to_set[row] = [
+            rdf_protodict.KeyValue(
+                k=rdf_protodict.DataBlob().SetValue(key),
+                v=rdf_protodict.DataBlob().SetValue(item)).SerializeToString()
+        ]
+        to_delete.discard(row)
+      for key in removed:
+        row = self._IncrementalStateRow(name, key)
+        to_set.pop(row, None)
+        to_delete.add(row)
+      value.ClearChanges()
+
+      for marker, container_cls in self._INCREMENTAL_TYPES.iteritems():
+        if isinstance(value, container_cls):
+          state[name] = marker
+
+    return state
+
+  @utils.Synchronized
+  def _WriteAttributes(self):
+    """Writes the flow attributes and the queued incremental state rows."""
+    to_set = self._incremental_rows_to_set
+    to_delete = self._incremental_rows_to_delete
+    if "w" not in self.mode or not (to_set or to_delete):
+      return super(GRRFlow, self)._WriteAttributes()
+
+    self._incremental_rows_to_set = {}
+    self._incremental_rows_to_delete = set()
+
+    # The rows go to the same pool as the flow attributes, so they are only
+    # written once the lease was checked, and together with the state that
+    # refers to them.
+    mutation_pool = self.mutation_pool
+    if mutation_pool is None:
+      self.mutation_pool = data_store.DB.GetMutationPool()
+    try:
+      if to_delete:
+        self.mutation_pool.DeleteAttributes(self.urn, sorted(to_delete))
+      if to_set:
+        self.mutation_pool.MultiSet(self.urn, to_set)
+      super(GRRFlow, self)._WriteAttributes()
+      if mutation_pool is None:
+        self.mutation_pool.Flush()
+    finally:
+      self.mutation_pool = mutation_pool
+
   def WriteState(self):
     if "w" in self.mode:
       self._ValidateState()
       self.Set(self.Schema.FLOW_ARGS(self.args))
       self.Set(self.Schema.FLOW_CONTEXT(self.context))
       self.Set(self.Schema.FLOW_RUNNER_ARGS(self.runner_args))
-      protodict = rdf_protodict.AttributedDict().FromDict(self.state)
+      state = self.state
+      if self.incremental_state:
+        state = self._WriteIncrementalState()
+      protodict = rdf_protodict.AttributedDict().FromDict(state)
       self.Set(self.Schema.FLOW_STATE_DICT(protodict))
 
   def Status(self, format_str, *args):
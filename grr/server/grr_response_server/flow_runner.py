@@ -73,6 +73,7 @@ from grr.server.grr_response_server import grr_collections
 from grr.server.grr_response_server import multi_type_collection
 from grr.server.grr_response_server import notification as notification_lib
 from grr.server.grr_response_server import output_plugin as output_plugin_lib
+from grr.server.grr_response_server import profiler
 from grr.server.grr_response_server import queue_manager
 from grr.server.grr_response_server import sequential_collection
 from grr.server.grr_response_server.aff4_objects import users as aff4_users
@@ -85,6 +86,48 @@ class FlowRunnerError(Exception):
 OUTPUT_PLUGIN_BASE_SUFFIX = "PluginOutput"
 
 
+class ClientCall(object):
+  """A client action call, as passed to FlowRunner.CallClientBatch().
+
+  The arguments are the same as for FlowRunner.CallClient().
+  """
+
+  def __init__(self,
+               action_cls,
+               request=None,
+               next_state=None,
+               request_data=None,
+               **kwargs):
+    self.action_cls = action_cls
+    self.request = request
+    self.next_state = next_state
+    self.request_data = request_data
+    self.kwargs = kwargs
+
+  def BuildRequest(self):
+    """Returns the request to send to the client.
+
+    Raises:
+       ValueError: The request does not have the correct type.
+    """
+    if self.action_cls.in_rdfvalue is None:
+      if self.request:
+        raise ValueError(
+            "Client action %s does not expect args." % self.action_cls.__name__)
+      return self.request
+
+    if self.request is None:
+      # Create a new rdf request.
+      return self.action_cls.in_rdfvalue(**self.kwargs)
+
+    # Verify that the request type matches the client action requirements.
+    if not isinstance(self.request, self.action_cls.in_rdfvalue):
+      raise ValueError("Client action expected %s but got %s" %
+                       (self.action_cls.in_rdfvalue, type(self.request)))
+
+    return self.request
+
+
 class FlowRunner(object):
   """The flow context class for hunts.
 
@@ -118,10 +161,12 @@ class FlowRunner(object):
     # If we have a parent runner, we use its queue manager.
     if parent_runner is not None:
       self.queue_manager = parent_runner.queue_manager
+      self.profiling = parent_runner.profiling
     else:
       # Otherwise we use a new queue manager.
       self.queue_manager = queue_manager.QueueManager(token=self.token)
       self.queue_manager.FreezeTimestamp()
+      self.profiling = profiler.Enabled()
 
     self.queued_replies = []
 
@@ -455,6 +500,13 @@ class FlowRunner(object):
           if request.id == 0:
             continue
 
+          # Not the request we are looking for - we have seen it before
+          # already. Its deletion might not be flushed yet if the worker
+          # processes several notifications under the same lock.
+          if request.id < self.context.next_processed_request:
+            self.queue_manager.DeleteRequest(request)
+            continue
+
           if not responses:
             break
 
@@ -463,12 +515,6 @@ class FlowRunner(object):
             stats.STATS.IncrementCounter("grr_response_out_of_order")
             break
 
-          # Not the request we are looking for - we have seen it before
-          # already.
-          if request.id < self.context.next_processed_request:
-            self.queue_manager.DeleteRequest(request)
-            continue
-
           if not responses:
             continue
 
@@ -576,14 +622,22 @@ class FlowRunner(object):
 
       # Extend our lease if needed.
       self.flow_obj.HeartBeat()
+      self.flow_obj.LoadIncrementalState()
       try:
         method = getattr(self.flow_obj, method)
       except AttributeError:
         raise FlowRunnerError("Flow %s has no state method %s" %
                               (self.flow_obj.__class__.__name__, method))
 
-      method(
-          direct_response=direct_response, request=request, responses=responses)
+      with profiler.StateTimer(
+          self.flow_obj.__class__.__name__,
+          method.__name__,
+          len(responses or []),
+          enabled=self.profiling):
+        method(
+            direct_response=direct_response,
+            request=request,
+            responses=responses)
 
       if self.sent_replies:
         self.ProcessRepliesWithOutputPlugins(self.sent_replies)
@@ -612,6 +666,13 @@ class FlowRunner(object):
       self.context.next_outbound_id += 1
     return my_id
 
+  def GetNextOutboundIds(self, count):
+    """Allocates count consecutive outbound ids at once."""
+    with self.outbound_lock:
+      first_id = self.context.next_outbound_id
+      self.context.next_outbound_id += count
+    return range(first_id, first_id + count)
+
   def CallClient(self,
                  action_cls,
                  request=None,
@@ -656,6 +717,41 @@ class FlowRunner(object):
        ValueError: The request passed to the client does not have the correct
                      type.
     """
+    self.CallClientBatch(
+        [
+            ClientCall(
+                action_cls,
+                request=request,
+                next_state=next_state,
+                request_data=request_data,
+                **kwargs)
+        ],
+        client_id=client_id,
+        start_time=start_time)
+
+  def CallClientBatch(self, calls, client_id=None, start_time=None):
+    """Calls the client asynchronously with a number of requests at once.
+
+    This works like calling CallClient() for each of the calls, but the
+    client, the resource limits and the outbound ids are only dealt with once
+    for all of them. The requests are queued in the order of the calls.
+
+    Args:
+       calls: A list of ClientCall objects.
+
+       client_id: rdf_client.ClientURN to send the requests to.
+
+       start_time: Call the client at this time. This Delays the client
+         requests for into the future.
+
+    Raises:
+       FlowRunnerError: If called on a flow that doesn't run on a single client.
+       ValueError: A request passed to the client does not have the correct
+                     type.
+    """
+    if not calls:
+      return
+
     if client_id is None:
       client_id = self.runner_args.client_id
 
@@ -667,61 +763,60 @@ class FlowRunner(object):
       # Try turning it into a ClientURN
       client_id = rdf_client.ClientURN(client_id)
 
-    if action_cls.in_rdfvalue is None:
-      if request:
-        raise ValueError(
-            "Client action %s does not expect args." % action_cls.__name__)
-    else:
-      if request is None:
-        # Create a new rdf request.
-        request = action_cls.in_rdfvalue(**kwargs)
-      else:
-        # Verify that the request type matches the client action requirements.
-        if not isinstance(request, action_cls.in_rdfvalue):
-          raise ValueError("Client action expected %s but got %s" %
-                           (action_cls.in_rdfvalue, type(request)))
-
-    outbound_id = self.GetNextOutboundId()
-
-    # Create a new request state
-    state = rdf_flows.RequestState(
-        id=outbound_id,
-        session_id=self.session_id,
-        next_state=next_state,
-        client_id=client_id)
+    # Build all requests first so nothing is queued if one of them is invalid.
+    requests = [call.BuildRequest() for call in calls]
 
-    if request_data is not None:
-      state.data = rdf_protodict.Dict(request_data)
-
-    # Send the message with the request state
-    msg = rdf_flows.GrrMessage(
-        session_id=utils.SmartUnicode(self.session_id),
-        name=action_cls.__name__,
-        request_id=outbound_id,
-        priority=self.runner_args.priority,
-        require_fastpoll=self.runner_args.require_fastpoll,
-        queue=client_id.Queue(),
-        payload=request,
-        generate_task_id=True)
-
-    cpu_usage = self.context.client_resources.cpu_usage
+    cpu_limit = None
     if self.runner_args.cpu_limit:
-      msg.cpu_limit = max(
+      cpu_usage = self.context.client_resources.cpu_usage
+      cpu_limit = max(
           self.runner_args.cpu_limit - cpu_usage.user_cpu_time -
           cpu_usage.system_cpu_time, 0)
 
-      if msg.cpu_limit == 0:
+      if cpu_limit == 0:
         raise FlowRunnerError("CPU limit exceeded.")
 
+    network_bytes_limit = None
     if self.runner_args.network_bytes_limit:
-      msg.network_bytes_limit = max(
+      network_bytes_limit = max(
           self.runner_args.network_bytes_limit -
           self.context.network_bytes_sent, 0)
-      if msg.network_bytes_limit == 0:
+      if network_bytes_limit == 0:
         raise FlowRunnerError("Network limit exceeded.")
 
-    state.request = msg
-    self.QueueRequest(state, timestamp=start_time)
+    session_id = utils.SmartUnicode(self.session_id)
+    queue = client_id.Queue()
+    outbound_ids = self.GetNextOutboundIds(len(calls))
+    for outbound_id, call, request in zip(outbound_ids, calls, requests):
+      # Create a new request state
+      state = rdf_flows.RequestState(
+          id=outbound_id,
+          session_id=self.session_id,
+          next_state=call.next_state,
+          client_id=client_id)
+
+      if call.request_data is not None:
+        state.data = rdf_protodict.Dict(call.request_data)
+
+      # Send the message with the request state
+      msg = rdf_flows.GrrMessage(
+          session_id=session_id,
+          name=call.action_cls.__name__,
+          request_id=outbound_id,
+          priority=self.runner_args.priority,
+          require_fastpoll=self.runner_args.require_fastpoll,
+          queue=queue,
+          payload=request,
+          generate_task_id=True)
+
+      if cpu_limit is not None:
+        msg.cpu_limit = cpu_limit
+
+      if network_bytes_limit is not None:
+        msg.network_bytes_limit = network_bytes_limit
+
+      state.request = msg
+      self.QueueRequest(state, timestamp=start_time)
 
   def CallFlow(self,
                flow_name=None,
@@ -21,12 +21,14 @@ from grr.server.grr_response_server import access_control
 from grr.server.grr_response_server import aff4
 from grr.server.grr_response_server import data_store
 from grr.server.grr_response_server import flow
+from grr.server.grr_response_server import flow_runner
 from grr.server.grr_response_server import output_plugin
 from grr.server.grr_response_server import queue_manager
 from grr.server.grr_response_server import server_stubs
 from grr.server.grr_response_server.flows.general import filesystem
 from grr.server.grr_response_server.flows.general import transfer
 from grr.test_lib import action_mocks
+from grr.test_lib import client_test_lib
 from grr.test_lib import db_test_lib
 from grr.test_lib import flow_test_lib
 from grr.test_lib import hunt_test_lib
@@ -140,6 +142,18 @@ class MultiEndedFlow(flow.GRRFlow):
       self.CallState(next_state="End")
 
 
+class IncrementalStateFlow(flow.GRRFlow):
+  """A flow keeping large collections in incremental state."""
+
+  incremental_state = ["items", "trackers"]
+
+  @flow.StateHandler()
+  def Start(self):
+    self.state.items = ["a", "b"]
+    self.state.trackers = {1: {"index": 1}, 2: {"index": 2}}
+    self.state.count = 2
+
+
 class FlowCreationTest(BasicFlowTest):
   """Test flow creation."""
 
@@ -223,6 +237,116 @@ class FlowCreationTest(BasicFlowTest):
         token=self.token,
         client_id=self.client_id)
 
+  def _IncrementalStateRows(self, session_id):
+    return dict((row, ts) for row, _, ts in data_store.DB.ResolvePrefix(
+        session_id, flow.GRRFlow.INCREMENTAL_STATE_PREFIX))
+
+  def testIncrementalStateIsStoredPerEntry(self):
+    with test_lib.FakeTime(1000):
+      session_id = flow.GRRFlow.StartFlow(
+          client_id=self.client_id,
+          flow_name=IncrementalStateFlow.__name__,
+          token=self.token)
+
+    rows = self._IncrementalStateRows(session_id)
+    self.assertEqual(
+        sorted(rows), [
+            "flow_state:items:0", "flow_state:items:1",
+            "flow_state:trackers:1", "flow_state:trackers:2"
+        ])
+
+    flow_obj = aff4.FACTORY.Open(session_id, mode="rw", token=self.token)
+    # The entries are only read when a state method runs.
+    self.assertEqual(flow_obj.state.items, "__incremental_list__")
+    flow_obj.LoadIncrementalState()
+    self.assertEqual(flow_obj.state.items, ["a", "b"])
+    self.assertEqual(flow_obj.state.trackers, {
+        1: {
+            "index": 1
+        },
+        2: {
+            "index": 2
+        }
+    })
+    self.assertEqual(flow_obj.state.count, 2)
+
+    with test_lib.FakeTime(2000):
+      flow_obj.state.items.append("c")
+      flow_obj.state.trackers[2]["hash"] = "abc"
+      flow_obj.state.trackers.pop(1)
+      flow_obj.Close()
+
+    new_rows = self._IncrementalStateRows(session_id)
+    self.assertEqual(
+        sorted(new_rows), [
+            "flow_state:items:0", "flow_state:items:1", "flow_state:items:2",
+            "flow_state:trackers:2"
+        ])
+    # Unchanged entries are not written again.
+    self.assertEqual(new_rows["flow_state:items:0"],
+                     rows["flow_state:items:0"])
+    self.assertEqual(new_rows["flow_state:items:1"],
+                     rows["flow_state:items:1"])
+    self.assertGreater(new_rows["flow_state:trackers:2"],
+                       rows["flow_state:trackers:2"])
+
+    flow_obj = aff4.FACTORY.Open(session_id, token=self.token)
+    flow_obj.LoadIncrementalState()
+    self.assertEqual(flow_obj.state.items, ["a", "b", "c"])
+    self.assertEqual(flow_obj.state.trackers, {2: {"index": 2, "hash": "abc"}})
+
+  def testReplacedIncrementalStateRemovesOldEntries(self):
+    session_id = flow.GRRFlow.StartFlow(
+        client_id=self.client_id,
+        flow_name=IncrementalStateFlow.__name__,
+        token=self.token)
+
+    with aff4.FACTORY.Open(session_id, mode="rw", token=self.token) as flow_obj:
+      flow_obj.state.items = ["x"]
+      flow_obj.state.trackers = None
+
+    self.assertEqual(
+        sorted(self._IncrementalStateRows(session_id)), ["flow_state:items:0"])
+
+    flow_obj = aff4.FACTORY.Open(session_id, token=self.token)
+    flow_obj.LoadIncrementalState()
+    self.assertEqual(flow_obj.state.items, ["x"])
+    self.assertIsNone(flow_obj.state.trackers)
+
+  def testUnreadIncrementalStateIsKept(self):
+    session_id = flow.GRRFlow.StartFlow(
+        client_id=self.client_id,
+        flow_name=IncrementalStateFlow.__name__,
+        token=self.token)
+    rows = self._IncrementalStateRows(session_id)
+
+    with aff4.FACTORY.Open(session_id, mode="rw", token=self.token) as flow_obj:
+      flow_obj.state.count = 3
+
+    self.assertEqual(self._IncrementalStateRows(session_id), rows)
+    flow_obj = aff4.FACTORY.Open(session_id, token=self.token)
+    flow_obj.LoadIncrementalState()
+    self.assertEqual(flow_obj.state.items, ["a", "b"])
+    self.assertEqual(flow_obj.state.count, 3)
+
+  def testIncrementalStateIsNotWrittenWithExpiredLease(self):
+    with test_lib.FakeTime(1000):
+      session_id = flow.GRRFlow.StartFlow(
+          client_id=self.client_id,
+          flow_name=IncrementalStateFlow.__name__,
+          token=self.token)
+      flow_obj = aff4.FACTORY.OpenWithLock(
+          session_id, lease_time=100, token=self.token)
+      flow_obj.LoadIncrementalState()
+      flow_obj.state.items.append("c")
+
+    with test_lib.FakeTime(2000):
+      with self.assertRaises(aff4.LockError):
+        flow_obj.Flush()
+
+    self.assertNotIn("flow_state:items:2",
+                     self._IncrementalStateRows(session_id))
+
   def testTerminate(self):
     session_id = flow.GRRFlow.StartFlow(
         client_id=self.client_id,
@@ -511,6 +635,47 @@ class FlowTest(BasicFlowTest):
     self.assertEqual(message.request_id, 1)
     self.assertEqual(message.name, "Test")
 
+  def testCallClientBatch(self):
+    flow_obj = self.FlowSetup(flow_test_lib.FlowOrderTest.__name__)
+    flow_obj.GetRunner().CallClientBatch([
+        flow_runner.ClientCall(
+            client_test_lib.Test,
+            data="test%d" % i,
+            next_state="Incoming",
+            request_data=dict(index=i)) for i in range(3)
+    ])
+    flow_obj.Close()
+
+    manager = queue_manager.QueueManager(token=self.token)
+    tasks = sorted(
+        manager.Query(self.client_id, limit=100), key=lambda t: t.request_id)
+    self.assertEqual([t.request_id for t in tasks], [1, 2, 3, 4])
+    self.assertEqual([t.payload.data for t in tasks[1:]],
+                     ["test0", "test1", "test2"])
+
+    requests = sorted(
+        (r for r, _ in manager.FetchRequestsAndResponses(flow_obj.session_id)),
+        key=lambda r: r.id)
+    self.assertEqual([r.data.ToDict() for r in requests[1:]],
+                     [dict(index=i) for i in range(3)])
+
+    flow_obj = aff4.FACTORY.Open(flow_obj.session_id, token=self.token)
+    self.assertEqual(flow_obj.context.next_outbound_id, 5)
+    self.assertEqual(flow_obj.context.outstanding_requests, 4)
+
+  def testCallClientBatchQueuesNothingOnInvalidRequest(self):
+    flow_obj = self.FlowSetup(flow_test_lib.FlowOrderTest.__name__)
+    with self.assertRaises(ValueError):
+      flow_obj.GetRunner().CallClientBatch([
+          flow_runner.ClientCall(client_test_lib.Test, data="test"),
+          flow_runner.ClientCall(
+              client_test_lib.Test, request=rdf_client.EchoRequest())
+      ])
+    flow_obj.Close()
+
+    manager = queue_manager.QueueManager(token=self.token)
+    self.assertEqual(len(manager.Query(self.client_id, limit=100)), 1)
+
   def testAuthentication1(self):
     """Test that flows refuse to processes unauthenticated messages."""
     flow_obj = self.FlowSetup(flow_test_lib.FlowOrderTest.__name__)
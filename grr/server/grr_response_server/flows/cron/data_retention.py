@@ -1,15 +1,24 @@
 #!/usr/bin/env python
 """These cron flows do the datastore cleanup."""
 
+import os
+import shutil
+import tempfile
+
 from grr import config
 from grr.lib import rdfvalue
+from grr.lib import registry
+from grr.lib import stats
 from grr.lib import utils
 from grr.server.grr_response_server import aff4
 from grr.server.grr_response_server import client_index
+from grr.server.grr_response_server import data_store
 from grr.server.grr_response_server import flow
+from grr.server.grr_response_server import nsrl_index
 
 from grr.server.grr_response_server.aff4_objects import aff4_grr
 from grr.server.grr_response_server.aff4_objects import cronjobs
+from grr.server.grr_response_server.aff4_objects import standard
 
 from grr.server.grr_response_server.hunts import implementation
 
@@ -137,3 +146,235 @@ class CleanInactiveClients(cronjobs.SystemCronFlow):
 
       aff4.FACTORY.MultiDelete(inactive_client_urns, token=self.token)
       self.HeartBeat()
+
+
+class DataRetentionInit(registry.InitHook):
+  """Install blob garbage collection metrics."""
+
+  def RunOnce(self):
+    stats.STATS.RegisterCounterMetric("blob_gc_reachable_blobs")
+    stats.STATS.RegisterCounterMetric("blob_gc_scanned_blobs")
+    stats.STATS.RegisterCounterMetric("blob_gc_unreferenced_blobs")
+    stats.STATS.RegisterCounterMetric("blob_gc_tombstoned_blobs")
+    stats.STATS.RegisterCounterMetric("blob_gc_deleted_blobs")
+
+
+class CleanBlobs(cronjobs.StatefulSystemCronFlow):
+  """Cleaner that deletes blobs no file references anymore.
+
+  This is a mark and sweep collection: all blob digests referenced by any
+  version of a blob image are collected first. Stored blobs that are old
+  enough and not among them get a tombstone, which makes BlobsExist report
+  them as missing, so no file starts using them without storing them again.
+
+  Blobs are only deleted by a later run, once their tombstone is older than
+  DataRetention.blobs_min_age and neither the mark nor the blob reference
+  index shows a file using them. Blobs found referenced again lose their
+  tombstone. A run stops after DataRetention.blobs_max_deletions_per_run
+  deletions, the next run continues the sweep where it stopped.
+  """
+
+  frequency = rdfvalue.Duration("1d")
+  lifetime = rdfvalue.Duration("20h")
+
+  BLOB_DIGEST_SIZE = 32
+  HEARTBEAT_INTERVAL = 10000
+  BLOB_IMAGES_BATCH_SIZE = 100
+  SPARSE_IMAGES_BATCH_SIZE = 100
+
+  @flow.StateHandler()
+  def Start(self):
+    min_age = config.CONFIG["DataRetention.blobs_min_age"]
+    if not min_age:
+      self.Log("TTL not set - nothing to do...")
+      return
+
+    # Other processes may believe blobs exist for this long after they got a
+    # tombstone.
+    if min_age <= config.CONFIG["Datastore.blob_existence_cache_ttl"]:
+      self.Log("DataRetention.blobs_min_age is not longer than "
+               "Datastore.blob_existence_cache_ttl - nothing to do...")
+      return
+
+    cron_state = self.ReadCronState()
+
+    mark_start = rdfvalue.RDFDatetime.Now()
+    if config.CONFIG["DataRetention.blobs_reachable_set_on_disk"]:
+      reachable = self._MarkOnDisk()
+    else:
+      reachable = set(self._ReachableDigests())
+    self.Log("Found %d referenced blobs.", len(reachable))
+
+    try:
+      cursor = self._Sweep(reachable, mark_start, min_age,
+                           cron_state.get("cursor"))
+    finally:
+      if isinstance(reachable, nsrl_index.HashIndex):
+        reachable.Close()
+
+    cron_state["cursor"] = cursor or ""
+    self.WriteCronState(cron_state)
+
+  def _MarkOnDisk(self):
+    tmp_dir = tempfile.mkdtemp(prefix="grr-blob-gc-")
+    try:
+      path = os.path.join(tmp_dir, "reachable")
+      with nsrl_index.IndexWriter(
+          path, digest_size=self.BLOB_DIGEST_SIZE) as writer:
+        for digest in self._ReachableDigests():
+          writer.AddDigest(digest)
+      # The mapping stays valid once the file is removed.
+      return nsrl_index.HashIndex(path, digest_size=self.BLOB_DIGEST_SIZE)
+    finally:
+      shutil.rmtree(tmp_dir)
+
+  def _ReachableDigests(self):
+    """Yields the binary digests of all blobs referenced by blob images."""
+    hashes_attribute = aff4_grr.VFSBlobImage.SchemaCls.HASHES.predicate
+    last_chunk_attribute = (
+        standard.AFF4SparseImage.SchemaCls.LAST_CHUNK.predicate)
+
+    blob_images = []
+    sparse_images = []
+    scanned = 0
+    for subject, values in data_store.DB.ScanAttributes(
+        "aff4:/", [hashes_attribute, last_chunk_attribute],
+        relaxed_order=True):
+      if hashes_attribute in values:
+        blob_images.append(subject)
+        if len(blob_images) >= self.BLOB_IMAGES_BATCH_SIZE:
+          for digest in self._BlobImageDigests(blob_images):
+            yield digest
+          blob_images = []
+
+      # Sparse images keep their chunk digests in separate objects.
+      if last_chunk_attribute in values:
+        sparse_images.append(subject)
+
+      scanned += 1
+      if scanned % self.HEARTBEAT_INTERVAL == 0:
+        self.HeartBeat()
+
+    for digest in self._BlobImageDigests(blob_images):
+      yield digest
+
+    for urns in utils.Grouper(sparse_images, self.SPARSE_IMAGES_BATCH_SIZE):
+      for fd in aff4.FACTORY.MultiOpen(
+          urns, aff4_type=standard.AFF4SparseImage, token=self.token):
+        # pylint: disable=protected-access
+        chunk_hashes = fd._ChunkNrsToHashes(range(fd.last_chunk + 1))
+        # pylint: enable=protected-access
+        for digest in chunk_hashes.itervalues():
+          stats.STATS.IncrementCounter("blob_gc_reachable_blobs")
+          yield digest.decode("hex")
+      self.HeartBeat()
+
+  def _BlobImageDigests(self, subjects):
+    """Yields the binary blob digests of all versions of the blob images."""
+    if not subjects:
+      return
+
+    # HASHES is versioned and older versions of a file still reference their
+    # blobs, so all of them are read instead of only the newest one.
+    hashes_attribute = aff4_grr.VFSBlobImage.SchemaCls.HASHES.predicate
+    for _, values in data_store.DB.MultiResolvePrefix(
+        subjects, hashes_attribute, timestamp=data_store.DB.ALL_TIMESTAMPS):
+      for attribute, hashes, _ in values:
+        if attribute != hashes_attribute:
+          continue
+
+        for offset in xrange(0, len(hashes), self.BLOB_DIGEST_SIZE):
+          stats.STATS.IncrementCounter("blob_gc_reachable_blobs")
+          yield hashes[offset:offset + self.BLOB_DIGEST_SIZE]
+
+  def _OldBlobs(self, deadline, cursor):
+    """Yields digests of stored blobs older than deadline, after cursor."""
+    for digest, stored in data_store.DB.blobstore.ListBlobs(
+        after=cursor or None, token=self.token):
+      stats.STATS.IncrementCounter("blob_gc_scanned_blobs")
+      # Young blobs may belong to files that are still being downloaded.
+      if stored < deadline:
+        yield digest
+
+  def _Sweep(self, reachable, mark_start, min_age, cursor):
+    """Tombstones unreferenced blobs and deletes those tombstoned long enough.
+
+    Args:
+      reachable: The binary digests of all referenced blobs.
+      mark_start: The RDFDatetime the mark started at. Files written after it
+        may be missing from reachable but are in the blob reference index.
+      min_age: The age blobs and tombstones need to reach to be tombstoned or
+        deleted respectively.
+      cursor: The digest to continue the sweep after, if any.
+
+    Returns:
+      The digest the next run continues after, or None if the sweep is done.
+    """
+    dry_run = config.CONFIG["DataRetention.blobs_dry_run"]
+    batch_size = config.CONFIG["DataRetention.blobs_deletion_batch_size"]
+    max_deletions = config.CONFIG["DataRetention.blobs_max_deletions_per_run"]
+    deadline = mark_start - min_age
+
+    unreferenced = 0
+    deleted = 0
+    for batch in utils.Grouper(self._OldBlobs(deadline, cursor), batch_size):
+      tombstones = data_store.DB.BlobTombstonesQueryMultiple(batch)
+
+      to_mark = []
+      to_clear = []
+      to_delete = []
+      for digest in batch:
+        tombstone = tombstones.get(digest)
+        if digest.decode("hex") in reachable:
+          if tombstone is not None:
+            to_clear.append(digest)
+        elif tombstone is None:
+          to_mark.append(digest)
+        elif tombstone < deadline:
+          to_delete.append(digest)
+
+      unreferenced += len(to_mark) + len(to_delete)
+      stats.STATS.IncrementCounter("blob_gc_unreferenced_blobs",
+                                   len(to_mark) + len(to_delete))
+      if dry_run:
+        self.HeartBeat()
+        continue
+
+      if to_delete:
+        # Files written since the blobs were tombstoned are in the blob
+        # reference index, even if the mark missed them.
+        since = min(tombstones[d] for d in to_delete)
+        timerange = (since.AsMicrosecondsSinceEpoch(),
+                     rdfvalue.RDFDatetime.Now().AsMicrosecondsSinceEpoch())
+        referenced = dict(
+            data_store.DB.BlobReferenceIndexQueryMultiple(
+                to_delete, timestamp=timerange))
+        to_clear.extend(d for d in to_delete if d in referenced)
+        to_delete = [d for d in to_delete if d not in referenced]
+
+      data_store.DB.BlobTombstonesAdd(to_mark, mark_start)
+      data_store.DB.BlobTombstonesDelete(to_clear)
+      stats.STATS.IncrementCounter("blob_gc_tombstoned_blobs", len(to_mark))
+
+      if to_delete:
+        # Blobs stored again since lost their tombstone and are kept.
+        current = data_store.DB.BlobTombstonesQueryMultiple(to_delete)
+        to_delete = [d for d in to_delete if current.get(d) == tombstones[d]]
+
+        data_store.DB.DeleteBlobs(to_delete, token=self.token)
+        data_store.DB.DeleteSubjects(
+            [data_store.DB.BlobReferenceSubject(d) for d in to_delete])
+        deleted += len(to_delete)
+        stats.STATS.IncrementCounter("blob_gc_deleted_blobs", len(to_delete))
+
+      self.HeartBeat()
+
+      if max_deletions and deleted >= max_deletions:
+        self.Log("Deleted %d unreferenced blobs, continuing after %s in the "
+                 "next run.", deleted, batch[-1])
+        return batch[-1]
+
+    if dry_run:
+      self.Log("Dry run: found %d unreferenced blobs.", unreferenced)
+    else:
+      self.Log("Deleted %d unreferenced blobs.", deleted)
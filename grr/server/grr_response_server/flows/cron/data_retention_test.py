@@ -11,6 +11,7 @@ from grr.lib.rdfvalues import cronjobs as rdf_cronjobs
 from grr.server.grr_response_server import aff4
 from grr.server.grr_response_server import data_store
 from grr.server.grr_response_server import flow
+from grr.server.grr_response_server.aff4_objects import aff4_grr
 from grr.server.grr_response_server.aff4_objects import cronjobs
 from grr.server.grr_response_server.aff4_objects import standard as aff4_standard
 from grr.server.grr_response_server.data_stores import fake_data_store
@@ -373,6 +374,161 @@ class CleanInactiveClientsTest(flow_test_lib.FlowTestsBaseclass):
       self.assertEqual(len(client_urns), 3)
 
 
+class CleanBlobsTest(flow_test_lib.FlowTestsBaseclass):
+  """Test the CleanBlobs flow."""
+
+  # The first run tombstones old unreferenced blobs, the second one deletes
+  # them once their tombstones are older than DataRetention.blobs_min_age.
+  FIRST_RUN = 8300
+  SECOND_RUN = FIRST_RUN + 7200 + 100
+
+  def setUp(self):
+    super(CleanBlobsTest, self).setUp()
+
+    cronjobs.ScheduleSystemCronFlows(
+        names=[data_retention.CleanBlobs.__name__], token=self.token)
+
+    with test_lib.FakeTime(100):
+      self.referenced, self.unreferenced = data_store.DB.StoreBlobs(
+          ["referenced", "unreferenced"], token=self.token)
+      with aff4.FACTORY.Create(
+          "aff4:/C.1000000000000000/fs/os/file",
+          aff4_grr.VFSBlobImage,
+          token=self.token) as fd:
+        fd.AddBlob(self.referenced.decode("hex"), len("referenced"))
+
+    with test_lib.FakeTime(8000):
+      self.recent = data_store.DB.StoreBlob("recent", token=self.token)
+
+    self.digests = [self.referenced, self.unreferenced, self.recent]
+
+  def _RunCleanBlobs(self, now, **overrides):
+    config_overrides = {"DataRetention.blobs_min_age": rdfvalue.Duration("2h")}
+    config_overrides.update(overrides)
+    with test_lib.ConfigOverrider(config_overrides):
+      with test_lib.FakeTime(now):
+        flow.GRRFlow.StartFlow(
+            flow_name=data_retention.CleanBlobs.__name__,
+            sync=True,
+            token=self.token)
+
+  def _RunCleanBlobsTwice(self, **overrides):
+    self._RunCleanBlobs(self.FIRST_RUN, **overrides)
+    self._RunCleanBlobs(self.SECOND_RUN, **overrides)
+
+  def _ExistingBlobs(self):
+    exist = data_store.DB.blobstore.BlobsExist(self.digests, token=self.token)
+    return sorted(digest for digest, exists in exist.iteritems() if exists)
+
+  def testDoesNothingIfAgeLimitNotSetInConfig(self):
+    flow.GRRFlow.StartFlow(
+        flow_name=data_retention.CleanBlobs.__name__,
+        sync=True,
+        token=self.token)
+
+    self.assertEqual(self._ExistingBlobs(), sorted(self.digests))
+
+  def testDoesNothingIfAgeLimitNotLongerThanExistenceCacheTTL(self):
+    self._RunCleanBlobsTwice(
+        **{"DataRetention.blobs_min_age": rdfvalue.Duration("1h")})
+
+    self.assertEqual(self._ExistingBlobs(), sorted(self.digests))
+
+  def testFirstRunOnlyTombstonesOldUnreferencedBlobs(self):
+    self._RunCleanBlobs(self.FIRST_RUN)
+
+    self.assertEqual(self._ExistingBlobs(), sorted(self.digests))
+    self.assertEqual(
+        data_store.DB.BlobTombstonesQueryMultiple(self.digests).keys(),
+        [self.unreferenced])
+    with test_lib.FakeTime(self.FIRST_RUN):
+      exist = data_store.DB.BlobsExist(self.digests, token=self.token)
+    self.assertFalse(exist[self.unreferenced])
+    self.assertTrue(exist[self.referenced])
+
+  def testDeletesOldUnreferencedBlobs(self):
+    self._RunCleanBlobsTwice()
+
+    self.assertEqual(self._ExistingBlobs(),
+                     sorted([self.referenced, self.recent]))
+
+  def testDeletesOldUnreferencedBlobsWithReachableSetOnDisk(self):
+    self._RunCleanBlobsTwice(
+        **{"DataRetention.blobs_reachable_set_on_disk": True})
+
+    self.assertEqual(self._ExistingBlobs(),
+                     sorted([self.referenced, self.recent]))
+
+  def testDryRunKeepsBlobs(self):
+    self._RunCleanBlobsTwice(**{"DataRetention.blobs_dry_run": True})
+
+    self.assertEqual(self._ExistingBlobs(), sorted(self.digests))
+    self.assertFalse(data_store.DB.BlobTombstonesQueryMultiple(self.digests))
+
+  def testKeepsBlobsReferencedByOlderFileVersions(self):
+    with test_lib.FakeTime(200):
+      with aff4.FACTORY.Create(
+          "aff4:/C.1000000000000000/fs/os/other",
+          aff4_grr.VFSBlobImage,
+          token=self.token) as fd:
+        fd.AddBlob(self.unreferenced.decode("hex"), len("unreferenced"))
+    with test_lib.FakeTime(300):
+      with aff4.FACTORY.Create(
+          "aff4:/C.1000000000000000/fs/os/other",
+          aff4_grr.VFSBlobImage,
+          token=self.token) as fd:
+        fd.AddBlob(self.referenced.decode("hex"), len("referenced"))
+
+    self._RunCleanBlobsTwice()
+
+    self.assertEqual(self._ExistingBlobs(), sorted(self.digests))
+
+  def testKeepsBlobsReferencedAfterTheyWereTombstoned(self):
+    self._RunCleanBlobs(self.FIRST_RUN)
+
+    # The blob reference index is written when the file is, the data store
+    # reference scan of the next run does not need to see the file.
+    with test_lib.FakeTime(self.FIRST_RUN + 100):
+      with data_store.DB.GetMutationPool() as pool:
+        pool.BlobReferenceIndexAddItems(
+            "aff4:/C.1000000000000000/fs/os/other",
+            [(self.unreferenced, len("unreferenced"))])
+    self._RunCleanBlobs(self.SECOND_RUN)
+
+    self.assertEqual(self._ExistingBlobs(), sorted(self.digests))
+    self.assertFalse(
+        data_store.DB.BlobTombstonesQueryMultiple([self.unreferenced]))
+
+  def testStoringBlobAgainClearsTombstone(self):
+    self._RunCleanBlobs(self.FIRST_RUN)
+
+    with test_lib.FakeTime(self.FIRST_RUN + 100):
+      data_store.DB.StoreBlobs(["unreferenced"], token=self.token)
+    self.assertFalse(
+        data_store.DB.BlobTombstonesQueryMultiple([self.unreferenced]))
+
+  def testContinuesSweepInNextRun(self):
+    with test_lib.FakeTime(100):
+      other = data_store.DB.StoreBlob("other", token=self.token)
+    self.digests.append(other)
+
+    overrides = {
+        "DataRetention.blobs_deletion_batch_size": 1,
+        "DataRetention.blobs_max_deletions_per_run": 1
+    }
+    self._RunCleanBlobs(self.FIRST_RUN, **overrides)
+    self._RunCleanBlobs(self.SECOND_RUN, **overrides)
+
+    first, second = sorted([self.unreferenced, other])
+    self.assertNotIn(first, self._ExistingBlobs())
+    self.assertIn(second, self._ExistingBlobs())
+
+    self._RunCleanBlobs(self.SECOND_RUN, **overrides)
+
+    self.assertEqual(self._ExistingBlobs(),
+                     sorted([self.referenced, self.recent]))
+
+
 def main(argv):
   # Run the full test suite
   test_lib.main(argv)
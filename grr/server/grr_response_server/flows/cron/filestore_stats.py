@@ -5,6 +5,7 @@ from grr.lib import rdfvalue
 from grr.lib import stats as stats_lib
 from grr.lib import utils
 from grr.server.grr_response_server import aff4
+from grr.server.grr_response_server import data_store
 from grr.server.grr_response_server import flow
 
 from grr.server.grr_response_server.aff4_objects import cronjobs
@@ -78,6 +79,44 @@ class FileSizeHistogram(GraphDistribution):
     self.Record(fd.Get(fd.Schema.SIZE))
 
 
+class BlobDeduplicationCounter(object):
+  """Counts stored blobs against the file data referencing them.
+
+  The ratio between referenced and stored data is the space saved by
+  deduplicating blobs.
+  """
+
+  GB = 1024 * 1024 * 1024
+
+  def __init__(self, count_attribute, size_attribute):
+    self.count_attribute = count_attribute
+    self.size_attribute = size_attribute
+    self.stored_count = 0
+    self.stored_size = 0
+    self.referenced_count = 0
+    self.referenced_size = 0
+
+  def ProcessBlob(self, size, references):
+    self.stored_count += 1
+    self.stored_size += size
+    self.referenced_count += references
+    self.referenced_size += size * references
+
+  def Save(self, fd):
+    count_graph = self.count_attribute(
+        title="Number of stored and referenced blobs")
+    count_graph.Append(label="Stored", y_value=self.stored_count)
+    count_graph.Append(label="Referenced", y_value=self.referenced_count)
+    fd.Set(self.count_attribute, count_graph)
+
+    size_graph = self.size_attribute(
+        title="Size (GB) of stored and referenced blobs")
+    size_graph.Append(label="Stored", y_value=self.stored_size / float(self.GB))
+    size_graph.Append(
+        label="Referenced", y_value=self.referenced_size / float(self.GB))
+    fd.Set(self.size_attribute, size_graph)
+
+
 class FilestoreStatsCronFlow(cronjobs.SystemCronFlow):
   """Build statistics about the filestore."""
   frequency = rdfvalue.Duration("1w")
@@ -85,6 +124,7 @@ class FilestoreStatsCronFlow(cronjobs.SystemCronFlow):
   HASH_PATH = "aff4:/files/hash/generic/sha256"
   FILESTORE_STATS_URN = rdfvalue.RDFURN("aff4:/stats/FileStoreStats")
   OPEN_FILES_LIMIT = 5000
+  BLOB_BATCH_SIZE = 5000
 
   def _CreateConsumers(self):
     self.consumers = [
@@ -119,7 +159,24 @@ class FilestoreStatsCronFlow(cronjobs.SystemCronFlow):
             consumer.ProcessFile(fd)
         self.HeartBeat()
 
+      self._CountBlobs()
+
     finally:
       for consumer in self.consumers:
         consumer.Save(self.stats)
       self.stats.Close()
+
+  def _CountBlobs(self):
+    """Feeds the blob reference index to the deduplication counter."""
+    counter = BlobDeduplicationCounter(self.stats.Schema.FILESTORE_BLOB_COUNT,
+                                       self.stats.Schema.FILESTORE_BLOB_SIZE)
+    self.consumers.append(counter)
+
+    blobs = data_store.DB.ScanBlobReferences()
+    for batch in utils.Grouper(blobs, self.BLOB_BATCH_SIZE):
+      sizes = dict(batch)
+      references = dict(
+          data_store.DB.BlobReferenceIndexQueryMultiple(list(sizes)))
+      for digest, size in sizes.iteritems():
+        counter.ProcessBlob(int(size), len(references.get(digest, [])))
+      self.HeartBeat()
@@ -1,8 +1,11 @@
 #!/usr/bin/env python
 """Tests for the filestore stats."""
 
+import hashlib
+
 from grr.lib import flags
 from grr.server.grr_response_server import aff4
+from grr.server.grr_response_server.aff4_objects import aff4_grr
 from grr.server.grr_response_server.aff4_objects import filestore as aff4_filestore
 from grr.server.grr_response_server.flows.cron import filestore_stats
 from grr.test_lib import flow_test_lib
@@ -74,6 +77,33 @@ class FilestoreStatsCronFlowTest(flow_test_lib.FlowTestsBaseclass):
     self.assertEqual(filesizes.data[9].y_value, 5)
     self.assertEqual(filesizes.data[-1].y_value, 1)
 
+  def testBlobDeduplication(self):
+    shared = hashlib.sha256("shared").digest()
+    unique = hashlib.sha256("unique").digest()
+    for i, blobs in enumerate([[shared, unique], [shared]]):
+      with aff4.FACTORY.Create(
+          "aff4:/C.000000000000000%d/fs/os/file" % i,
+          aff4_grr.VFSBlobImage,
+          token=self.token) as fd:
+        fd.SetChunksize(1024)
+        for blob in blobs:
+          fd.AddBlob(blob, 1024)
+
+    flow_test_lib.TestFlowHelper(
+        filestore_stats.FilestoreStatsCronFlow.__name__, token=self.token)
+
+    fd = aff4.FACTORY.Open(
+        filestore_stats.FilestoreStatsCronFlow.FILESTORE_STATS_URN,
+        token=self.token)
+    counts = fd.Get(fd.Schema.FILESTORE_BLOB_COUNT)
+    self.assertEqual([(x.label, x.y_value) for x in counts.data],
+                     [("Stored", 2), ("Referenced", 3)])
+
+    sizes = fd.Get(fd.Schema.FILESTORE_BLOB_SIZE)
+    gb = float(1024 * 1024 * 1024)
+    self.assertEqual([(x.label, x.y_value) for x in sizes],
+                     [("Stored", 2048 / gb), ("Referenced", 3072 / gb)])
+
 
 def main(argv):
   # Run the full test suite
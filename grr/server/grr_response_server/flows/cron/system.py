@@ -92,6 +92,13 @@ class AbstractClientStatsCronFlow(cronjobs.SystemCronFlow):
 
   CLIENT_STATS_URN = rdfvalue.RDFURN("aff4:/stats/ClientFleetStats")
 
+  # Number of clients read from the relational database at a time.
+  CLIENT_READ_BATCH_SIZE = 1000
+
+  # Whether ProcessClientFullInfo needs the last client snapshot. Reading
+  # snapshots is by far the most expensive part of iterating clients.
+  READ_LAST_SNAPSHOT = True
+
   def BeginProcessing(self):
     pass
 
@@ -128,7 +135,9 @@ class AbstractClientStatsCronFlow(cronjobs.SystemCronFlow):
         yield child
 
   def _IterateClients(self):
-    for c in data_store.REL_DB.IterateAllClientsFullInfo():
+    for c in data_store.REL_DB.IterateAllClientsFullInfo(
+        batch_size=self.CLIENT_READ_BATCH_SIZE,
+        include_last_snapshot=self.READ_LAST_SNAPSHOT):
       yield c
 
   @flow.StateHandler()
@@ -172,6 +181,8 @@ class GRRVersionBreakDown(AbstractClientStatsCronFlow):
 
   frequency = rdfvalue.Duration("4h")
 
+  READ_LAST_SNAPSHOT = False
+
   def BeginProcessing(self):
     self.counter = _ActiveCounter(
         aff4_stats.ClientFleetStats.SchemaCls.GRRVERSION_HISTOGRAM)
@@ -256,6 +267,8 @@ class LastAccessStats(AbstractClientStatsCronFlow):
   # The number of clients fall into these bins (number of hours ago)
   _bins = [1, 2, 3, 7, 14, 30, 60]
 
+  READ_LAST_SNAPSHOT = False
+
   def _ValuesForLabel(self, label):
     if label not in self.values:
       self.values[label] = [0] * len(self._bins)
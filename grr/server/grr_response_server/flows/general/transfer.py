@@ -2,6 +2,8 @@
 """These flows are designed for high performance transfers."""
 
 import logging
+from multiprocessing import pool
+import threading
 import zlib
 
 from grr.lib import constants
@@ -18,6 +20,7 @@ from grr.server.grr_response_server import aff4
 from grr.server.grr_response_server import data_store
 from grr.server.grr_response_server import events
 from grr.server.grr_response_server import flow
+from grr.server.grr_response_server import flow_runner
 from grr.server.grr_response_server import message_handlers
 from grr.server.grr_response_server import notification
 from grr.server.grr_response_server import server_stubs
@@ -238,6 +241,13 @@ class MultiGetFileMixin(object):
   # allows us to amortize file store round trips and increases throughput.
   MIN_CALL_TO_FILE_STORE = 200
 
+  # These grow with the number of files, only their changed entries are
+  # written when the flow is flushed.
+  incremental_state = [
+      "indexed_pathspecs", "request_data_list", "pending_hashes",
+      "pending_files"
+  ]
+
   def Start(self,
             file_size=0,
             maximum_pending_files=1000,
@@ -322,7 +332,7 @@ class MultiGetFileMixin(object):
       stub = server_stubs.StatFile
       request = rdf_client.ListDirRequest(pathspec=pathspec)
 
-    self.CallClient(
+    stat_call = flow_runner.ClientCall(
         stub, request, next_state="StoreStat", request_data=dict(index=index))
 
     request = rdf_client.FingerprintRequest(
@@ -335,12 +345,14 @@ class MultiGetFileMixin(object):
             rdf_client.FingerprintTuple.HashType.SHA256
         ])
 
-    self.CallClient(
+    hash_call = flow_runner.ClientCall(
         server_stubs.HashFile,
         request,
         next_state="ReceiveFileHash",
         request_data=dict(index=index))
 
+    self.CallClientBatch([stat_call, hash_call])
+
   def _RemoveCompletedPathspec(self, index):
     """Removes a pathspec from the list of pathspecs."""
     pathspec = self.state.indexed_pathspecs[index]
@@ -559,6 +571,7 @@ class MultiGetFileMixin(object):
 
     # Now we iterate over all the files which are not in the store and arrange
     # for them to be copied.
+    hash_calls = []
     for index in file_hashes:
 
       # Move the tracker from the pending hashes store to the pending files
@@ -588,13 +601,16 @@ class MultiGetFileMixin(object):
           length = file_tracker["size_to_download"] % self.CHUNK_SIZE
         else:
           length = self.CHUNK_SIZE
-        self.CallClient(
-            server_stubs.HashBuffer,
-            pathspec=file_tracker["stat_entry"].pathspec,
-            offset=i * self.CHUNK_SIZE,
-            length=length,
-            next_state="CheckHash",
-            request_data=dict(index=index))
+        hash_calls.append(
+            flow_runner.ClientCall(
+                server_stubs.HashBuffer,
+                pathspec=file_tracker["stat_entry"].pathspec,
+                offset=i * self.CHUNK_SIZE,
+                length=length,
+                next_state="CheckHash",
+                request_data=dict(index=index)))
+
+    self.CallClientBatch(hash_calls)
 
     if self.state.files_hashed % 100 == 0:
       self.Log("Hashed %d files, skipped %s already stored.",
@@ -780,6 +796,21 @@ class MultiGetFile(MultiGetFileMixin, flow.GRRFlow):
     self.SendReply(stat_entry)
 
 
+# Threads shared by all FileStoreCreateFile batches. This has to be separate
+# from the file store's hash pool, which the threads here wait on.
+_ADD_FILE_POOL_SIZE = 4
+_add_file_pool = None
+_add_file_pool_lock = threading.Lock()
+
+
+def _GetAddFilePool():
+  global _add_file_pool
+  with _add_file_pool_lock:
+    if _add_file_pool is None:
+      _add_file_pool = pool.ThreadPool(processes=_ADD_FILE_POOL_SIZE)
+    return _add_file_pool
+
+
 class FileStoreCreateFile(events.EventListener):
   """Receive an event about a new file and add it to the file store.
 
@@ -796,16 +827,24 @@ class FileStoreCreateFile(events.EventListener):
   def ProcessMessages(self, msgs=None, token=None):
     """Process the new file and add to the file store."""
 
-    filestore_fd = aff4.FACTORY.Create(
-        filestore.FileStore.PATH, filestore.FileStore, mode="w", token=token)
-
-    for vfs_urn in msgs:
+    def AddFile(vfs_urn):
+      # AFF4 objects are not thread safe, so every file gets its own file
+      # store object.
+      filestore_fd = aff4.FACTORY.Create(
+          filestore.FileStore.PATH, filestore.FileStore, mode="w", token=token)
       with aff4.FACTORY.Open(vfs_urn, mode="rw", token=token) as vfs_fd:
         try:
           filestore_fd.AddFile(vfs_fd)
         except Exception as e:  # pylint: disable=broad-except
           logging.error("Exception while adding file to filestore: %s", e)
 
+    if len(msgs) <= 1:
+      for vfs_urn in msgs:
+        AddFile(vfs_urn)
+      return
+
+    _GetAddFilePool().map(AddFile, msgs)
+
 
 class GetMBRArgs(rdf_structs.RDFProtoStruct):
   protobuf = flows_pb2.GetMBRArgs
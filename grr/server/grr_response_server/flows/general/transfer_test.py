@@ -298,6 +298,7 @@ class TestTransfer(flow_test_lib.FlowTestsBaseclass):
         args=args):
       # Check up on the internal flow state.
       flow_obj = aff4.FACTORY.Open(session_id, mode="r", token=self.token)
+      flow_obj.LoadIncrementalState()
       flow_state = flow_obj.state
       # All the pathspecs should be in this list.
       self.assertEqual(len(flow_state.indexed_pathspecs), 30)
@@ -3,6 +3,7 @@
 
 import logging
 import operator
+import threading
 import time
 
 from grr import config
@@ -14,6 +15,7 @@ from grr.lib import stats
 from grr.lib import utils
 from grr.lib.rdfvalues import client as rdf_client
 from grr.lib.rdfvalues import flows as rdf_flows
+from grr.lib.rdfvalues import objects as rdf_objects
 from grr.server.grr_response_server import access_control
 from grr.server.grr_response_server import aff4
 from grr.server.grr_response_server import client_index
@@ -28,12 +30,104 @@ from grr.server.grr_response_server import threadpool
 from grr.server.grr_response_server.aff4_objects import aff4_grr
 
 
+class ClientMetadataBatcher(object):
+  """Collects client metadata updates and writes them in batches.
+
+  Every client poll updates the client's ping, clock and ip in the relational
+  database. With a non-zero flush_interval, these updates are buffered - later
+  updates for a client overriding earlier ones - and written with a single
+  MultiWriteClientMetadata call every flush_interval seconds or as soon as
+  max_batch_size clients are pending. With a zero flush_interval every update
+  is written immediately.
+  """
+
+  def __init__(self, flush_interval=0, max_batch_size=1000):
+    self.flush_interval = flush_interval
+    self.max_batch_size = max_batch_size
+    self._pending = {}
+    self._lock = threading.Lock()
+    self._flusher_thread = None
+
+    if self.flush_interval:
+      self._flusher_thread = utils.InterruptableThread(
+          name="ClientMetadataFlusher",
+          target=self._PeriodicFlush,
+          sleep_time=self.flush_interval)
+      self._flusher_thread.start()
+
+  def Add(self, client_id, metadata):
+    """Schedules a metadata update for a client.
+
+    Args:
+      client_id: A GRR client id string, e.g. "C.ea3b2b71840d6fa7".
+      metadata: An rdfvalues.objects.ClientMetadata with the fields to update.
+    """
+    with self._lock:
+      pending = self._pending.get(client_id)
+      if pending is None:
+        self._pending[client_id] = metadata
+      else:
+        for type_descriptor, value in metadata.ListSetFields():
+          pending.Set(type_descriptor.name, value)
+
+      flush_now = (not self.flush_interval or
+                   len(self._pending) >= self.max_batch_size)
+
+    if flush_now:
+      self.Flush()
+
+  def Flush(self):
+    """Writes all pending updates to the relational database."""
+    with self._lock:
+      pending = self._pending
+      self._pending = {}
+
+    if not pending:
+      return
+
+    try:
+      data_store.REL_DB.MultiWriteClientMetadata(pending)
+    except Exception:  # pylint: disable=broad-except
+      if len(pending) == 1:
+        raise
+
+      # A single bad client must not cost the updates of the whole batch, so
+      # the clients are retried one at a time and unknown ones are skipped.
+      for client_id, metadata in pending.iteritems():
+        try:
+          data_store.REL_DB.MultiWriteClientMetadata({client_id: metadata})
+        except db.UnknownClientError:
+          logging.debug("Dropping metadata update for unknown client %s.",
+                        client_id)
+
+    stats.STATS.RecordEvent("frontend_client_metadata_batch_size",
+                            len(pending))
+
+  def _PeriodicFlush(self):
+    try:
+      self.Flush()
+    except Exception as e:  # pylint: disable=broad-except
+      logging.exception("Failed to write client metadata batch: %s", e)
+
+  def Stop(self):
+    """Stops the background flusher and writes remaining updates."""
+    if self._flusher_thread:
+      self._flusher_thread.Stop()
+      self._flusher_thread = None
+    self.Flush()
+
+
 class ServerCommunicator(communicator.Communicator):
   """A communicator which stores certificates using AFF4."""
 
-  def __init__(self, certificate, private_key, token=None):
+  def __init__(self,
+               certificate,
+               private_key,
+               token=None,
+               metadata_batcher=None):
     self.client_cache = utils.FastStore(1000)
     self.token = token
+    self.metadata_batcher = metadata_batcher or ClientMetadataBatcher()
     super(ServerCommunicator, self).__init__(
         certificate=certificate, private_key=private_key)
     self.pub_key_cache = utils.FastStore(max_size=50000)
@@ -163,12 +257,13 @@ class ServerCommunicator(communicator.Communicator):
 
         if ping or clock or last_ip:
           try:
-            data_store.REL_DB.WriteClientMetadata(
+            self.metadata_batcher.Add(
                 client_id.Basename(),
-                last_ip=last_ip,
-                last_clock=clock,
-                last_ping=ping,
-                fleetspeak_enabled=False)
+                rdf_objects.ClientMetadata(
+                    ip=last_ip,
+                    clock=clock,
+                    ping=ping,
+                    fleetspeak_enabled=False))
           except db.UnknownClientError:
             pass
 
@@ -181,9 +276,10 @@ class ServerCommunicator(communicator.Communicator):
 class RelationalServerCommunicator(communicator.Communicator):
   """A communicator which stores certificates using the relational db."""
 
-  def __init__(self, certificate, private_key):
+  def __init__(self, certificate, private_key, metadata_batcher=None):
     super(RelationalServerCommunicator, self).__init__(
         certificate=certificate, private_key=private_key)
+    self.metadata_batcher = metadata_batcher or ClientMetadataBatcher()
     self.pub_key_cache = utils.FastStore(max_size=50000)
     self.common_name = self.certificate.GetCN()
 
@@ -279,12 +375,13 @@ class RelationalServerCommunicator(communicator.Communicator):
       else:
         last_ip = None
 
-      data_store.REL_DB.WriteClientMetadata(
+      self.metadata_batcher.Add(
           client_id,
-          last_ip=last_ip,
-          last_clock=client_time,
-          last_ping=rdfvalue.RDFDatetime.Now(),
-          fleetspeak_enabled=False)
+          rdf_objects.ClientMetadata(
+              ip=last_ip,
+              clock=client_time,
+              ping=rdfvalue.RDFDatetime.Now(),
+              fleetspeak_enabled=False))
 
     except communicator.UnknownClientCert:
       pass
@@ -318,12 +415,21 @@ class FrontEndServer(object):
         username="GRRFrontEnd", reason="Implied.")
     self.token.supervisor = True
 
+    self.metadata_batcher = ClientMetadataBatcher(
+        flush_interval=config.CONFIG["Frontend.client_metadata_flush_interval"],
+        max_batch_size=config.CONFIG["Frontend.client_metadata_batch_size"])
+
     if data_store.RelationalDBReadEnabled():
       self._communicator = RelationalServerCommunicator(
-          certificate=certificate, private_key=private_key)
+          certificate=certificate,
+          private_key=private_key,
+          metadata_batcher=self.metadata_batcher)
     else:
       self._communicator = ServerCommunicator(
-          certificate=certificate, private_key=private_key, token=self.token)
+          certificate=certificate,
+          private_key=private_key,
+          token=self.token,
+          metadata_batcher=self.metadata_batcher)
 
     self.message_expiry_time = message_expiry_time
     self.max_retransmission_time = max_retransmission_time
@@ -354,6 +460,10 @@ class FrontEndServer(object):
         for flow_name in whitelist & available_wkf_set
     }
 
+  def Stop(self):
+    """Writes all pending client metadata updates before shutting down."""
+    self.metadata_batcher.Stop()
+
   @stats.Counted("grr_frontendserver_handle_num")
   @stats.Timed("grr_frontendserver_handle_time")
   def HandleMessageBundles(self, request_comms, response_comms):
@@ -684,3 +794,4 @@ class FrontendInit(registry.InitHook):
 
     stats.STATS.RegisterCounterMetric(
         "grr_pub_key_cache", fields=[("type", str)])
+    stats.STATS.RegisterEventMetric("frontend_client_metadata_batch_size")
@@ -26,6 +26,7 @@ from grr.lib.rdfvalues import objects as rdf_objects
 from grr.lib.rdfvalues import protodict as rdf_protodict
 from grr.server.grr_response_server import aff4
 from grr.server.grr_response_server import data_store
+from grr.server.grr_response_server import db
 from grr.server.grr_response_server import fleetspeak_connector
 from grr.server.grr_response_server import flow
 from grr.server.grr_response_server import frontend_lib
@@ -1417,6 +1418,60 @@ class RelationalClientCommsTest(ClientCommsTest):
     self.assertEqual(now, metadata.ping)
     self.assertEqual(client_now, metadata.clock)
 
+  def testClientMetadataIsBatched(self):
+    """Check metadata updates are only written when the batch is flushed."""
+
+    self._MakeClientRecord()
+    batcher = frontend_lib.ClientMetadataBatcher(
+        flush_interval=3600, max_batch_size=1000)
+    try:
+      self.server_communicator = frontend_lib.RelationalServerCommunicator(
+          certificate=self.server_certificate,
+          private_key=self.server_private_key,
+          metadata_batcher=batcher)
+
+      now = rdfvalue.RDFDatetime.Now()
+      client_now = now - 20
+      with test_lib.FakeTime(now):
+        self.ClientServerCommunicate(timestamp=client_now)
+
+      metadata = data_store.REL_DB.ReadClientMetadata(self.client_id)
+      self.assertFalse(metadata.HasField("ping"))
+
+      batcher.Flush()
+
+      metadata = data_store.REL_DB.ReadClientMetadata(self.client_id)
+      self.assertEqual(now, metadata.ping)
+      self.assertEqual(client_now, metadata.clock)
+    finally:
+      batcher.Stop()
+
+  def testUnknownClientDoesNotDropMetadataBatch(self):
+    known_id = "C.1000000000000000"
+    unknown_id = "C.2000000000000000"
+    data_store.REL_DB.WriteClientMetadata(known_id, fleetspeak_enabled=False)
+
+    write = data_store.REL_DB.MultiWriteClientMetadata
+
+    def MultiWriteClientMetadata(metadatas):
+      if unknown_id in metadatas:
+        raise db.UnknownClientError(unknown_id)
+      write(metadatas)
+
+    now = rdfvalue.RDFDatetime.Now()
+    batcher = frontend_lib.ClientMetadataBatcher(flush_interval=3600)
+    try:
+      with mock.patch.object(data_store.REL_DB, "MultiWriteClientMetadata",
+                             MultiWriteClientMetadata):
+        batcher.Add(known_id, rdf_objects.ClientMetadata(ping=now))
+        batcher.Add(unknown_id, rdf_objects.ClientMetadata(ping=now))
+        batcher.Flush()
+    finally:
+      batcher.Stop()
+
+    metadata = data_store.REL_DB.ReadClientMetadata(known_id)
+    self.assertEqual(now, metadata.ping)
+
 
 class RelationalHTTPClientTests(HTTPClientTests):
 
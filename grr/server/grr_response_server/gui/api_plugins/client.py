@@ -298,12 +298,16 @@ class ApiSearchClientsHandler(api_call_handler_base.ApiCallHandler):
     if data_store.RelationalDBReadEnabled():
       index = client_index.ClientIndex()
 
-      clients = sorted(
-          index.LookupClients(keywords))[args.offset:args.offset + end]
+      limit = None
+      if args.count:
+        limit = args.offset + args.count
+      clients = index.LookupClients(keywords, limit=limit)[args.offset:]
 
       client_infos = data_store.REL_DB.MultiReadClientFullInfo(clients)
-      for client_info in client_infos.itervalues():
-        api_clients.append(ApiClient().InitFromClientInfo(client_info))
+      for client_id in clients:
+        if client_id in client_infos:
+          api_clients.append(ApiClient().InitFromClientInfo(
+              client_infos[client_id]))
 
     else:
       index = client_index.CreateClientIndex(token=token)
@@ -341,50 +345,33 @@ class ApiLabelsRestrictedSearchClientsHandler(
 
     return False
 
-  def _VerifyLabels(self, labels):
-    for label in labels:
-      if (label.name in self.labels_whitelist and
-          label.owner in self.labels_owners_whitelist):
-        return True
-    return False
-
   def Handle(self, args, token=None):
     if args.count:
       end = args.offset + args.count
-      # Read <count> clients ahead in case some of them fail to open / verify.
-      batch_size = end + args.count
     else:
       end = sys.maxint
-      batch_size = end
 
     keywords = shlex.split(args.query)
     api_clients = []
 
     if data_store.RelationalDBReadEnabled():
-      index = client_index.ClientIndex()
+      if not self.labels_whitelist or not self.labels_owners_whitelist:
+        return ApiSearchClientsResult(items=api_clients)
 
-      # TODO(amoser): We could move the label verification into the
-      # database making this method more efficient. Label restrictions
-      # should be on small subsets though so this might not be worth
-      # it.
-      all_client_ids = set()
-      for label in self.labels_whitelist:
-        label_filter = ["label:" + label] + keywords
-        all_client_ids.update(index.LookupClients(label_filter))
+      # The label restrictions are checked by the database as part of the
+      # search, so every returned client is allowed.
+      index = client_index.ClientIndex()
+      clients = index.LookupClients(
+          keywords,
+          label_names=self.labels_whitelist,
+          label_owners=self.labels_owners_whitelist,
+          limit=end if args.count else None)[args.offset:]
 
-      index = 0
-      for cid_batch in utils.Grouper(sorted(all_client_ids), batch_size):
-        client_infos = data_store.REL_DB.MultiReadClientFullInfo(cid_batch)
-
-        for _, client_info in sorted(client_infos.items()):
-          if not self._VerifyLabels(client_info.labels):
-            continue
-          if index >= args.offset and index < end:
-            api_clients.append(ApiClient().InitFromClientInfo(client_info))
-          index += 1
-          if index >= end:
-            UpdateClientsFromFleetspeak(api_clients)
-            return ApiSearchClientsResult(items=api_clients)
+      client_infos = data_store.REL_DB.MultiReadClientFullInfo(clients)
+      for client_id in clients:
+        if client_id in client_infos:
+          api_clients.append(ApiClient().InitFromClientInfo(
+              client_infos[client_id]))
 
     else:
       index = client_index.CreateClientIndex(token=token)
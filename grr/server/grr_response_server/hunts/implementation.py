@@ -32,6 +32,7 @@ from grr.server.grr_response_server import grr_collections
 from grr.server.grr_response_server import multi_type_collection
 from grr.server.grr_response_server import notification as notification_lib
 from grr.server.grr_response_server import output_plugin as output_plugin_lib
+from grr.server.grr_response_server import profiler
 from grr.server.grr_response_server import queue_manager
 from grr.server.grr_response_server.aff4_objects import aff4_grr
 from grr.server.grr_response_server.hunts import results as hunts_results
@@ -96,6 +97,7 @@ class HuntRunner(object):
 
     self.outbound_lock = threading.Lock()
     self.hunt_obj = hunt_obj
+    self.profiling = profiler.Enabled()
 
     # Initialize from a new runner args proto.
     if runner_args is not None:
@@ -239,8 +241,15 @@ class HuntRunner(object):
             "Flow %s has no state method %s" %
             (self.hunt_obj.__class__.__name__, method))
 
-      method(
-          direct_response=direct_response, request=request, responses=responses)
+      with profiler.StateTimer(
+          self.hunt_obj.__class__.__name__,
+          method.__name__,
+          len(responses or []),
+          enabled=self.profiling):
+        method(
+            direct_response=direct_response,
+            request=request,
+            responses=responses)
 
     # We don't know here what exceptions can be thrown in the flow but we have
     # to continue. Thus, we catch everything.
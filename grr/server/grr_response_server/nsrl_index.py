@@ -0,0 +1,229 @@
+#!/usr/bin/env python
+"""A compact on-disk index of NSRL SHA-1 hashes.
+
+An index file consists of a short header followed by the binary SHA-1 digests
+of all indexed files, sorted and without duplicates. This makes lookups a
+simple binary search and keeps the index at 20 bytes per hash. The digests are
+followed by a bloom filter over all of them and a fixed size trailer, so most
+lookups of unknown hashes are answered without touching the digests at all.
+
+Indexes of other digests, e.g. SHA-256 blob identifiers, use the same format
+with a different digest size.
+"""
+
+import bisect
+import heapq
+import mmap
+import os
+import struct
+import tempfile
+
+INDEX_MAGIC = "GRRNSRL1"
+DIGEST_SIZE = 20
+
+# Number of digests and size of the bloom filter in bytes.
+_TRAILER = struct.Struct(">QQ")
+
+# Hash digests are uniformly distributed, so the bloom filter takes its bit
+# positions from the 32 bit slices of the digest, five for a SHA-1 digest.
+# With 10 bits per hash the false positive rate is about 1%.
+_BLOOM_BITS_PER_DIGEST = 10
+
+
+def _BloomProbeFormat(digest_size):
+  return struct.Struct(">%dI" % (digest_size // 4))
+
+
+def _BloomPositions(probe_format, digest, num_bits):
+  return [pos % num_bits for pos in probe_format.unpack(digest)]
+
+
+def _ReadDigests(fd, digest_size):
+  """Yields consecutive digests from a file of concatenated digests."""
+  while True:
+    data = fd.read(digest_size * 4096)
+    if not data:
+      return
+    for offset in xrange(0, len(data), digest_size):
+      yield data[offset:offset + digest_size]
+
+
+class IndexWriter(object):
+  """Writes an index file from SHA-1 hashes added in any order.
+
+  Hashes are collected in memory and written out in sorted runs once there are
+  too many of them. Close() merges all runs into the final index, so memory
+  use stays bounded no matter how many hashes are added.
+  """
+
+  # Number of digests kept in memory before a sorted run is written to disk.
+  RUN_SIZE = 1000000
+
+  def __init__(self, path, run_size=None, digest_size=DIGEST_SIZE):
+    self.path = path
+    self.run_size = run_size or self.RUN_SIZE
+    self.digest_size = digest_size
+    self.digests = []
+    self.run_paths = []
+    self.total = 0
+
+  def Add(self, sha1):
+    """Adds a SHA-1 hash, given as a hex string."""
+    try:
+      self.AddDigest(sha1.decode("hex"))
+    except (TypeError, ValueError):
+      raise ValueError("Invalid hash: %s" % sha1)
+
+  def AddDigest(self, digest):
+    """Adds a binary digest."""
+    if len(digest) != self.digest_size:
+      raise ValueError("Invalid digest length: %d" % len(digest))
+
+    self.digests.append(digest)
+    self.total += 1
+    if len(self.digests) >= self.run_size:
+      self._WriteRun()
+
+  def _TempFile(self):
+    dirname = os.path.dirname(os.path.abspath(self.path))
+    fd, path = tempfile.mkstemp(
+        prefix=".%s." % os.path.basename(self.path), dir=dirname)
+    return os.fdopen(fd, "wb"), path
+
+  def _WriteRun(self):
+    self.digests.sort()
+    fd, path = self._TempFile()
+    self.run_paths.append(path)
+    with fd:
+      fd.write("".join(self.digests))
+    self.digests = []
+
+  def _RemoveRuns(self):
+    for path in self.run_paths:
+      os.remove(path)
+    self.run_paths = []
+    self.digests = []
+
+  def Close(self):
+    """Writes the index file and removes all temporary files.
+
+    Returns:
+      The number of distinct hashes in the index.
+    """
+    self.digests.sort()
+    runs = [open(path, "rb") for path in self.run_paths]
+    fd, tmp_path = self._TempFile()
+    count = 0
+    # Duplicates are only known after the merge, so the bloom filter is sized
+    # for all added hashes.
+    num_bits = max(self.total, 1) * _BLOOM_BITS_PER_DIGEST
+    bloom = bytearray((num_bits + 7) // 8)
+    probe_format = _BloomProbeFormat(self.digest_size)
+    try:
+      with fd:
+        fd.write(INDEX_MAGIC)
+        last = None
+        merged = heapq.merge(
+            self.digests,
+            *[_ReadDigests(run, self.digest_size) for run in runs])
+        for digest in merged:
+          if digest != last:
+            fd.write(digest)
+            for pos in _BloomPositions(probe_format, digest, len(bloom) * 8):
+              bloom[pos >> 3] |= 1 << (pos & 7)
+            last = digest
+            count += 1
+        fd.write(bloom)
+        fd.write(_TRAILER.pack(count, len(bloom)))
+      os.rename(tmp_path, self.path)
+    finally:
+      for run in runs:
+        run.close()
+      if os.path.exists(tmp_path):
+        os.remove(tmp_path)
+      self._RemoveRuns()
+
+    return count
+
+  def __enter__(self):
+    return self
+
+  def __exit__(self, exc_type, unused_value, unused_traceback):
+    if exc_type is None:
+      self.Close()
+    else:
+      self._RemoveRuns()
+
+
+class _Digests(object):
+  """A read only sequence view of the digests in a mapped index file."""
+
+  def __init__(self, data, count, digest_size):
+    self.data = data
+    self.count = count
+    self.digest_size = digest_size
+
+  def __len__(self):
+    return self.count
+
+  def __getitem__(self, i):
+    offset = len(INDEX_MAGIC) + i * self.digest_size
+    return self.data[offset:offset + self.digest_size]
+
+
+class HashIndex(object):
+  """A memory mapped index file written by IndexWriter.
+
+  The file is mapped read only, so it is shared by all processes on a host
+  using the same index and only the pages needed for lookups are ever read.
+  """
+
+  def __init__(self, path, digest_size=DIGEST_SIZE):
+    with open(path, "rb") as fd:
+      self._data = mmap.mmap(fd.fileno(), 0, access=mmap.ACCESS_READ)
+
+    size = len(self._data)
+    if (size < len(INDEX_MAGIC) + _TRAILER.size or
+        self._data[:len(INDEX_MAGIC)] != INDEX_MAGIC):
+      self.Close()
+      raise ValueError("%s is not an NSRL index file." % path)
+
+    count, bloom_size = _TRAILER.unpack_from(self._data, size - _TRAILER.size)
+    bloom_offset = len(INDEX_MAGIC) + count * digest_size
+    if bloom_offset + bloom_size + _TRAILER.size != size or not bloom_size:
+      self.Close()
+      raise ValueError("NSRL index file %s is truncated." % path)
+
+    self._digests = _Digests(self._data, count, digest_size)
+    self._digest_size = digest_size
+    self._probe_format = _BloomProbeFormat(digest_size)
+    self._bloom_offset = bloom_offset
+    self._bloom_bits = bloom_size * 8
+
+  def __len__(self):
+    return len(self._digests)
+
+  def __contains__(self, digest):
+    """Checks for a binary digest."""
+    if len(digest) != self._digest_size:
+      return False
+
+    # Most hashes checked against the NSRL are not in it, the bloom filter
+    # rules those out without a search through the digests.
+    for pos in _BloomPositions(self._probe_format, digest, self._bloom_bits):
+      byte = self._data[self._bloom_offset + (pos >> 3)]
+      if not ord(byte) & (1 << (pos & 7)):
+        return False
+
+    i = bisect.bisect_left(self._digests, digest)
+    return i < len(self._digests) and self._digests[i] == digest
+
+  def ContainsSHA1(self, sha1):
+    """Checks for a SHA-1 hash given as a hex string."""
+    try:
+      return sha1.decode("hex") in self
+    except TypeError:
+      return False
+
+  def Close(self):
+    self._data.close()
@@ -0,0 +1,117 @@
+#!/usr/bin/env python
+"""Tests for the NSRL hash index."""
+
+import hashlib
+import os
+
+from grr.lib import flags
+from grr.server.grr_response_server import nsrl_index
+from grr.test_lib import test_lib
+
+
+class IndexWriterTest(test_lib.GRRBaseTest):
+
+  def _ReadIndex(self, path):
+    index = nsrl_index.HashIndex(path)
+    try:
+      return [index._digests[i] for i in range(len(index))]
+    finally:
+      index.Close()
+
+  def testWritesSortedDistinctDigests(self):
+    path = os.path.join(self.temp_dir, "nsrl.idx")
+    digests = [hashlib.sha1(str(i % 50)).digest() for i in range(120)]
+
+    # A small run size makes the writer merge several sorted runs.
+    with nsrl_index.IndexWriter(path, run_size=16) as writer:
+      for digest in digests:
+        writer.Add(digest.encode("hex"))
+
+    self.assertEqual(self._ReadIndex(path), sorted(set(digests)))
+    self.assertEqual(os.listdir(self.temp_dir), ["nsrl.idx"])
+
+  def testCloseReturnsCount(self):
+    writer = nsrl_index.IndexWriter(os.path.join(self.temp_dir, "nsrl.idx"))
+    for i in range(10):
+      writer.Add(hashlib.sha1(str(i)).hexdigest())
+    writer.Add(hashlib.sha1("0").hexdigest())
+
+    self.assertEqual(writer.Close(), 10)
+
+  def testInvalidHashesAreRejected(self):
+    writer = nsrl_index.IndexWriter(os.path.join(self.temp_dir, "nsrl.idx"))
+    with self.assertRaises(ValueError):
+      writer.Add("abcd")
+
+
+class HashIndexTest(test_lib.GRRBaseTest):
+
+  def setUp(self):
+    super(HashIndexTest, self).setUp()
+    self.path = os.path.join(self.temp_dir, "nsrl.idx")
+    self.digests = [hashlib.sha1(str(i)).digest() for i in range(1000)]
+    with nsrl_index.IndexWriter(self.path, run_size=100) as writer:
+      for digest in self.digests:
+        writer.Add(digest.encode("hex"))
+
+    self.index = nsrl_index.HashIndex(self.path)
+
+  def tearDown(self):
+    self.index.Close()
+    super(HashIndexTest, self).tearDown()
+
+  def testContainsIndexedDigests(self):
+    self.assertEqual(len(self.index), 1000)
+    for digest in self.digests:
+      self.assertIn(digest, self.index)
+      self.assertTrue(self.index.ContainsSHA1(digest.encode("hex")))
+
+  def testDoesNotContainOtherDigests(self):
+    for i in range(1000, 2000):
+      self.assertNotIn(hashlib.sha1(str(i)).digest(), self.index)
+
+    self.assertNotIn("", self.index)
+    self.assertFalse(self.index.ContainsSHA1("not a hash"))
+
+  def testEmptyIndex(self):
+    path = os.path.join(self.temp_dir, "empty.idx")
+    nsrl_index.IndexWriter(path).Close()
+
+    index = nsrl_index.HashIndex(path)
+    self.assertEqual(len(index), 0)
+    self.assertNotIn(self.digests[0], index)
+    index.Close()
+
+  def testOtherDigestSizes(self):
+    path = os.path.join(self.temp_dir, "sha256.idx")
+    digests = [hashlib.sha256(str(i)).digest() for i in range(100)]
+    with nsrl_index.IndexWriter(path, digest_size=32) as writer:
+      for digest in digests:
+        writer.AddDigest(digest)
+
+    index = nsrl_index.HashIndex(path, digest_size=32)
+    self.assertEqual(len(index), 100)
+    for digest in digests:
+      self.assertIn(digest, index)
+    self.assertNotIn(hashlib.sha256("100").digest(), index)
+    self.assertNotIn(hashlib.sha1("0").digest(), index)
+    index.Close()
+
+  def testInvalidFilesAreRejected(self):
+    with open(self.path, "rb") as fd:
+      data = fd.read()
+
+    for invalid in ["GRRNSRL0" + data[8:], data[:-1]]:
+      path = os.path.join(self.temp_dir, "invalid.idx")
+      with open(path, "wb") as fd:
+        fd.write(invalid)
+      with self.assertRaises(ValueError):
+        nsrl_index.HashIndex(path)
+
+
+def main(argv):
+  test_lib.main(argv)
+
+
+if __name__ == "__main__":
+  flags.StartMain(main)
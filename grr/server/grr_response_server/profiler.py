@@ -0,0 +1,206 @@
+#!/usr/bin/env python
+"""Opt-in profiling of flow state methods.
+
+With Worker.profiling set, every flow and hunt state method run records its
+wall time, CPU time, time spent in data store calls and the number of
+responses it was called with. These are exported as stats metrics per flow
+class and state, and also summed up in a process wide profile that the worker
+logs when it receives SIGUSR2, sorted by wall time like a cProfile dump.
+"""
+
+import functools
+import inspect
+import logging
+import resource
+import signal
+import sys
+import threading
+import time
+
+from grr import config
+from grr.lib import registry
+from grr.lib import stats
+from grr.server.grr_response_server import data_store
+
+# Only Linux accounts resource usage per thread, elsewhere the CPU time of the
+# whole process is used.
+if sys.platform.startswith("linux"):
+  _RUSAGE_THREAD = getattr(resource, "RUSAGE_THREAD", 1)
+else:
+  _RUSAGE_THREAD = None
+
+PROFILE_SIGNAL = signal.SIGUSR2
+
+_local = threading.local()
+
+
+class ProfilerInit(registry.InitHook):
+  """Registers the flow profiling metrics."""
+
+  def RunOnce(self):
+    fields = [("flow", str), ("state", str)]
+    stats.STATS.RegisterEventMetric("flow_state_wall_time", fields=fields)
+    stats.STATS.RegisterEventMetric("flow_state_cpu_time", fields=fields)
+    stats.STATS.RegisterEventMetric("flow_state_datastore_time", fields=fields)
+    stats.STATS.RegisterEventMetric(
+        "flow_state_responses",
+        bins=[0, 1, 10, 100, 1000, 10000],
+        fields=fields)
+    stats.STATS.RegisterEventMetric("worker_flow_lock_time")
+
+
+def Enabled():
+  return config.CONFIG["Worker.profiling"]
+
+
+def _ThreadCpuTime():
+  if _RUSAGE_THREAD is None:
+    return time.clock()
+
+  usage = resource.getrusage(_RUSAGE_THREAD)
+  return usage.ru_utime + usage.ru_stime
+
+
+def DataStoreTime():
+  """Returns the time the calling thread spent in data store calls."""
+  return getattr(_local, "datastore_time", 0.0)
+
+
+def _TimeDataStoreMethod(method):
+  """Adds the time spent in method to the calling thread's data store time."""
+
+  @functools.wraps(method)
+  def Timed(*args, **kwargs):
+    # Data store methods call each other, only the outermost call is timed.
+    if getattr(_local, "in_datastore", False):
+      return method(*args, **kwargs)
+
+    _local.in_datastore = True
+    start = time.time()
+    try:
+      return method(*args, **kwargs)
+    finally:
+      _local.in_datastore = False
+      _local.datastore_time = DataStoreTime() + time.time() - start
+
+  return Timed
+
+
+def InstrumentDataStore(db=None):
+  """Makes the data store account the time spent in its calls per thread.
+
+  Args:
+    db: The data store to instrument, data_store.DB by default.
+  """
+  if db is None:
+    db = data_store.DB
+
+  if getattr(db, "_profiler_instrumented", False):
+    return
+
+  for name in dir(data_store.DataStore):
+    if not name[:1].isupper():
+      continue
+
+    method = getattr(db, name, None)
+    if inspect.ismethod(method):
+      setattr(db, name, _TimeDataStoreMethod(method))
+
+  db._profiler_instrumented = True  # pylint: disable=protected-access
+
+
+class Profile(object):
+  """The resources used by flow states, summed up since the last reset."""
+
+  def __init__(self):
+    self.lock = threading.Lock()
+    self.entries = {}
+
+  def Add(self, flow_name, state, wall, cpu, datastore, responses):
+    with self.lock:
+      entry = self.entries.setdefault((flow_name, state),
+                                      [0, 0.0, 0.0, 0.0, 0])
+      entry[0] += 1
+      entry[1] += wall
+      entry[2] += cpu
+      entry[3] += datastore
+      entry[4] += responses
+
+  def Reset(self):
+    with self.lock:
+      self.entries = {}
+
+  def Dump(self):
+    """Returns the profile as a table sorted by wall time."""
+    # This runs in a signal handler, possibly interrupting a thread holding
+    # the lock, so the entries are copied without it.
+    entries = sorted(self.entries.items(), key=lambda x: x[1][1], reverse=True)
+
+    lines = [
+        "%8s %10s %10s %10s %10s %10s  %s" % ("calls", "wall", "cpu",
+                                              "datastore", "python",
+                                              "responses", "flow.state")
+    ]
+    for (flow_name, state), entry in entries:
+      calls, wall, cpu, datastore, responses = entry
+      lines.append("%8d %10.3f %10.3f %10.3f %10.3f %10d  %s.%s" %
+                   (calls, wall, cpu, datastore, wall - datastore, responses,
+                    flow_name, state))
+
+    return "\n".join(lines)
+
+
+PROFILE = Profile()
+
+
+class StateTimer(object):
+  """Records the resources used by a flow state method run.
+
+  Does nothing unless enabled. Runners check Enabled() once when they are
+  set up and pass the result, so state method runs don't read the config.
+  """
+
+  def __init__(self, flow_name, state, responses=0, enabled=False):
+    self.flow_name = flow_name
+    self.state = state
+    self.responses = responses
+    self.enabled = enabled
+
+  def __enter__(self):
+    if self.enabled:
+      self.start_wall = time.time()
+      self.start_cpu = _ThreadCpuTime()
+      self.start_datastore = DataStoreTime()
+    return self
+
+  def __exit__(self, unused_type, unused_value, unused_traceback):
+    if not self.enabled:
+      return
+
+    wall = time.time() - self.start_wall
+    cpu = _ThreadCpuTime() - self.start_cpu
+    datastore = DataStoreTime() - self.start_datastore
+
+    fields = [self.flow_name, self.state]
+    stats.STATS.RecordEvent("flow_state_wall_time", wall, fields=fields)
+    stats.STATS.RecordEvent("flow_state_cpu_time", cpu, fields=fields)
+    stats.STATS.RecordEvent(
+        "flow_state_datastore_time", datastore, fields=fields)
+    stats.STATS.RecordEvent(
+        "flow_state_responses", self.responses, fields=fields)
+
+    PROFILE.Add(self.flow_name, self.state, wall, cpu, datastore,
+                self.responses)
+
+
+def _DumpProfile(unused_signum, unused_frame):
+  logging.info("Flow state profile:\n%s", PROFILE.Dump())
+
+
+def InstallSignalHandler():
+  """Logs the profile whenever the process receives PROFILE_SIGNAL."""
+  if threading.current_thread().name != "MainThread":
+    logging.warning("Signal handlers can only be installed by the main thread.")
+    return
+
+  signal.signal(PROFILE_SIGNAL, _DumpProfile)
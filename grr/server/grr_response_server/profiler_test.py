@@ -0,0 +1,126 @@
+#!/usr/bin/env python
+"""Tests for the flow profiler."""
+
+import time
+
+import mock
+
+from grr.lib import flags
+from grr.lib import stats
+from grr.server.grr_response_server import profiler
+from grr.test_lib import flow_test_lib
+from grr.test_lib import test_lib
+
+
+class FakeDataStore(object):
+  """A data store whose calls take one second each."""
+
+  def __init__(self, clock):
+    self.clock = clock
+
+  def ResolvePrefix(self, *unused_args):
+    self.clock[0] += 1
+
+  def MultiSet(self, *unused_args):
+    self.clock[0] += 1
+    # Nested calls are not counted twice.
+    self.ResolvePrefix()
+
+
+class ProfilerTest(flow_test_lib.FlowTestsBaseclass):
+
+  def setUp(self):
+    super(ProfilerTest, self).setUp()
+    self.client_id = self.SetupClient(0)
+    profiler.PROFILE.Reset()
+
+  def tearDown(self):
+    profiler.PROFILE.Reset()
+    super(ProfilerTest, self).tearDown()
+
+  def _GetWallTimeCount(self, flow_name, state):
+    return stats.STATS.GetMetricValue(
+        "flow_state_wall_time", fields=[flow_name, state]).count
+
+  def _RunFlow(self):
+    flow_test_lib.TestFlowHelper(
+        flow_test_lib.DummyFlowWithSingleReply.__name__,
+        client_id=self.client_id,
+        token=self.token)
+
+  def testFlowStatesAreNotProfiledByDefault(self):
+    flow_name = flow_test_lib.DummyFlowWithSingleReply.__name__
+    count = self._GetWallTimeCount(flow_name, "SendSomething")
+
+    self._RunFlow()
+
+    self.assertEqual(self._GetWallTimeCount(flow_name, "SendSomething"), count)
+    self.assertEqual(profiler.PROFILE.entries, {})
+
+  def testFlowStatesAreProfiled(self):
+    flow_name = flow_test_lib.DummyFlowWithSingleReply.__name__
+    count = self._GetWallTimeCount(flow_name, "SendSomething")
+
+    with test_lib.ConfigOverrider({"Worker.profiling": True}):
+      self._RunFlow()
+
+    self.assertEqual(
+        self._GetWallTimeCount(flow_name, "SendSomething"), count + 1)
+    self.assertEqual(
+        profiler.PROFILE.entries[(flow_name, "SendSomething")][0], 1)
+    self.assertIn("%s.SendSomething" % flow_name, profiler.PROFILE.Dump())
+
+  def testDataStoreTimeIsAccountedPerThread(self):
+    clock = [1000]
+    db = FakeDataStore(clock)
+    profiler.InstrumentDataStore(db)
+    # Instrumenting twice doesn't time calls twice.
+    profiler.InstrumentDataStore(db)
+
+    with mock.patch.object(time, "time", lambda: clock[0]):
+      start = profiler.DataStoreTime()
+      db.MultiSet()
+      db.ResolvePrefix()
+
+    self.assertEqual(profiler.DataStoreTime() - start, 3)
+
+  def testStateTimerDoesNotReadConfig(self):
+    with test_lib.ConfigOverrider({"Worker.profiling": True}):
+      with profiler.StateTimer("SomeFlow", "SomeState"):
+        pass
+
+    self.assertEqual(profiler.PROFILE.entries, {})
+
+  def testStateTimerRecordsDataStoreTime(self):
+    clock = [1000]
+    db = FakeDataStore(clock)
+    profiler.InstrumentDataStore(db)
+
+    with mock.patch.object(time, "time", lambda: clock[0]):
+      with profiler.StateTimer(
+          "SomeFlow", "SomeState", responses=5, enabled=True):
+        clock[0] += 10
+        db.MultiSet()
+
+    calls, wall, _, datastore, responses = profiler.PROFILE.entries[(
+        "SomeFlow", "SomeState")]
+    self.assertEqual((calls, wall, datastore, responses), (1, 12, 2, 5))
+
+  def testDumpIsSortedByWallTime(self):
+    profiler.PROFILE.Add("Fast", "Start", 1.0, 0.5, 0.2, 0)
+    profiler.PROFILE.Add("Slow", "Start", 5.0, 1.0, 4.0, 10)
+    profiler.PROFILE.Add("Fast", "Start", 1.0, 0.5, 0.2, 0)
+
+    lines = profiler.PROFILE.Dump().splitlines()
+    self.assertEqual(len(lines), 3)
+    self.assertTrue(lines[1].endswith("Slow.Start"))
+    self.assertTrue(lines[2].endswith("Fast.Start"))
+    self.assertEqual(lines[2].split()[0], "2")
+
+
+def main(argv):
+  test_lib.main(argv)
+
+
+if __name__ == "__main__":
+  flags.StartMain(main)
@@ -4,6 +4,8 @@
 import collections
 import logging
 import random
+import threading
+import time
 
 from grr import config
 from grr.lib import queues
@@ -16,6 +18,7 @@ from grr.lib.rdfvalues import flows as rdf_flows
 from grr.lib.rdfvalues import objects as rdf_objects
 from grr.server.grr_response_server import data_store
 from grr.server.grr_response_server import fleetspeak_utils
+from grr.server.grr_response_server import wakeup_channel
 
 
 class Error(Exception):
@@ -34,6 +37,117 @@ session_id_map = {
 
 
 
+class ResponsePrefetcher(object):
+  """Reads responses of completed requests ahead of their processing.
+
+  Responses are read by a background thread in request id order while the
+  caller is processing the responses read before. Before reading a batch and
+  before buffering the responses of each request, the thread waits while the
+  stored size of the responses buffered but not yet consumed is max_bytes or
+  more.
+  """
+
+  # Maximum number of responses read from the data store at once.
+  batch_size = 1000
+
+  def __init__(self, store, completed_requests, max_bytes, timestamp=None):
+    self.data_store = store
+    self.completed_requests = completed_requests
+    self.max_bytes = max_bytes
+    self.timestamp = timestamp
+
+    self._buffer = collections.deque()
+    self._buffered_bytes = 0
+    self._condition = threading.Condition()
+    self._done = False
+    self._stopped = False
+    self._error = None
+
+  def _Batches(self):
+    """Groups the completed requests into batches of limited size."""
+    batch = []
+    batch_responses = 0
+    for request, status in self.completed_requests:
+      if batch and batch_responses + status.response_id > self.batch_size:
+        yield batch
+        batch = []
+        batch_responses = 0
+
+      batch.append(request)
+      batch_responses += status.response_id
+
+    if batch:
+      yield batch
+
+  def _WaitForSpace(self):
+    """Waits until responses can be buffered, returns False once stopped."""
+    with self._condition:
+      while self._buffered_bytes >= self.max_bytes and not self._stopped:
+        self._condition.wait()
+      return not self._stopped
+
+  def _ReadResponses(self):
+    try:
+      for batch in self._Batches():
+        if not self._WaitForSpace():
+          return
+
+        for request, responses, size in (
+            self.data_store.ReadResponsesWithSizes(
+                batch, timestamp=self.timestamp)):
+          # A single batch may hold much more than max_bytes.
+          if not self._WaitForSpace():
+            return
+
+          with self._condition:
+            self._buffer.append((request, responses, size))
+            self._buffered_bytes += size
+            self._condition.notify_all()
+
+    except Exception as e:  # pylint: disable=broad-except
+      logging.exception("Error prefetching responses: %s", e)
+      with self._condition:
+        self._error = e
+
+    finally:
+      with self._condition:
+        self._done = True
+        self._condition.notify_all()
+
+  def Stop(self):
+    """Stops reading ahead, responses not consumed yet are dropped."""
+    with self._condition:
+      self._stopped = True
+      self._buffer.clear()
+      self._buffered_bytes = 0
+      self._condition.notify_all()
+
+  def __iter__(self):
+    thread = threading.Thread(
+        name="ResponsePrefetcher", target=self._ReadResponses)
+    thread.daemon = True
+    thread.start()
+
+    try:
+      while True:
+        with self._condition:
+          while not self._buffer and not self._done:
+            self._condition.wait()
+
+          if not self._buffer:
+            if self._error is not None:
+              raise self._error
+            return
+
+          request, responses, size = self._buffer.popleft()
+          self._buffered_bytes -= size
+          self._condition.notify_all()
+
+        yield request, responses
+    finally:
+      self.Stop()
+
+
 def _GetClientIdFromQueue(q):
   """Returns q's client id, if q is a client task queue, otherwise None.
 
@@ -99,9 +213,26 @@ class QueueManager(object):
   response_limit = 1000000
 
   notification_shard_counters = {}
+  notification_read_shard_counters = {}
 
   notification_expiry_time = 600
 
+  # The number of notification shards of a queue can be changed at runtime
+  # with SetNotificationShardCount. The layout is stored in the data store and
+  # cached by every process for this many seconds.
+  shard_layout_cache_time = 60
+
+  # Cached shard layouts, dicts of attributes to (value, timestamp) tuples
+  # keyed by queue name, together with the time they expire.
+  shard_layouts = {}
+
+  SHARD_COUNT_ATTRIBUTE = "shards:count"
+  SHARD_READ_COUNT_ATTRIBUTE = "shards:read_count"
+
+  # Retired shards are read up to this timestamp, so that notifications
+  # scheduled for the future are migrated as well.
+  MAX_NOTIFICATION_TIMESTAMP = rdfvalue.RDFDatetime((2**63) - 1)
+
   def __init__(self, store=None, token=None):
     self.token = token
     if store is None:
@@ -124,6 +255,150 @@ class QueueManager(object):
 
     self.num_notification_shards = config.CONFIG["Worker.queue_shards"]
 
+  def _ShardLayoutSubject(self, queue):
+    return queue.Add("shard_layout")
+
+  def _GetShardLayout(self, queue, refresh=False):
+    """Returns the stored shard layout of a queue, cached if possible."""
+    queue_name = str(queue)
+    now = time.time()
+    expires, layout = QueueManager.shard_layouts.get(queue_name, (0, None))
+    if refresh or layout is None or expires < now:
+      layout = {}
+      for attribute, value, ts in self.data_store.ResolveMulti(
+          self._ShardLayoutSubject(queue),
+          [self.SHARD_COUNT_ATTRIBUTE, self.SHARD_READ_COUNT_ATTRIBUTE],
+          timestamp=self.data_store.NEWEST_TIMESTAMP):
+        layout[attribute] = (int(value), ts)
+
+      QueueManager.shard_layouts[queue_name] = (
+          now + self.shard_layout_cache_time, layout)
+
+    return layout
+
+  def GetNotificationShardCount(self, queue):
+    """Returns the number of shards new notifications are written to."""
+    layout = self._GetShardLayout(queue)
+    return layout.get(self.SHARD_COUNT_ATTRIBUTE,
+                      (self.num_notification_shards, 0))[0]
+
+  def _GetReadShardCount(self, queue):
+    """Returns the number of shards that might hold notifications."""
+    layout = self._GetShardLayout(queue)
+    return max(
+        self.GetNotificationShardCount(queue),
+        layout.get(self.SHARD_READ_COUNT_ATTRIBUTE, (0, 0))[0])
+
+  def _ShardUrn(self, queue, index):
+    if index > 0:
+      return queue.Add(str(index))
+    else:
+      return queue
+
+  def SetNotificationShardCount(self, queue, count):
+    """Changes the number of notification shards of a queue.
+
+    New notifications are written to the new number of shards once the change
+    has reached all processes, see shard_layout_cache_time. When the number
+    of shards shrinks, the shards that are no longer written to are still
+    read until MigrateRetiredShards has moved all their notifications.
+
+    Args:
+      queue: The queue to reshard, usually rdfvalue.RDFURN("aff4:/W").
+      count: The new number of shards.
+
+    Raises:
+      ValueError: The count is not positive.
+    """
+    if count < 1:
+      raise ValueError("Invalid number of notification shards: %d" % count)
+
+    # Shards that are retired already have to be read until they are empty.
+    self._GetShardLayout(queue, refresh=True)
+    read_count = max(count, self._GetReadShardCount(queue))
+
+    self.data_store.MultiSet(
+        self._ShardLayoutSubject(queue), {
+            self.SHARD_COUNT_ATTRIBUTE: [count],
+            self.SHARD_READ_COUNT_ATTRIBUTE: [read_count]
+        },
+        replace=True)
+    self._GetShardLayout(queue, refresh=True)
+
+  def MigrateRetiredShards(self, queue):
+    """Moves notifications out of shards that are no longer written to.
+
+    Once the retired shards are empty and all processes have picked up the
+    new layout, they are dropped from the layout and not read anymore.
+
+    Args:
+      queue: The queue to migrate, usually rdfvalue.RDFURN("aff4:/W").
+
+    Returns:
+      The number of migrated notifications.
+    """
+    layout = self._GetShardLayout(queue, refresh=True)
+    count = self.GetNotificationShardCount(queue)
+    read_count = self._GetReadShardCount(queue)
+    if read_count <= count:
+      return 0
+
+    migrated = 0
+    for index in range(count, read_count):
+      migrated += self._MigrateShard(queue, self._ShardUrn(queue, index))
+
+    # Processes still using a cached layout might write to the retired shards
+    # until their cache expires.
+    _, changed = layout[self.SHARD_COUNT_ATTRIBUTE]
+    settled = changed + 2 * self.shard_layout_cache_time * 1e6
+    if settled < int(time.time() * 1e6) and self._ShardsEmpty(
+        [self._ShardUrn(queue, index) for index in range(count, read_count)]):
+      self.data_store.MultiSet(
+          self._ShardLayoutSubject(queue),
+          {self.SHARD_READ_COUNT_ATTRIBUTE: [count]},
+          replace=True)
+      self._GetShardLayout(queue, refresh=True)
+
+    return migrated
+
+  def _MigrateShard(self, queue, retired_shard):
+    """Moves all notifications of a retired shard to the current shards."""
+    migrated = 0
+    while True:
+      # Notifications for the future are moved as well, keeping their
+      # timestamps.
+      notifications = list(
+          self.data_store.GetNotifications(retired_shard,
+                                           self.MAX_NOTIFICATION_TIMESTAMP))
+      if not notifications:
+        return migrated
+
+      with self.data_store.GetMutationPool() as mutation_pool:
+        for notification in notifications:
+          mutation_pool.CreateNotifications(
+              self.GetNotificationShard(queue), [notification])
+
+      # Only the notifications that were moved are deleted, others for the
+      # same session may have been written in the meantime.
+      with self.data_store.GetMutationPool() as mutation_pool:
+        for notification in notifications:
+          mutation_pool.DeleteAttributes(
+              retired_shard, [
+                  self.data_store.NOTIFY_PREDICATE_TEMPLATE %
+                  notification.session_id
+              ],
+              start=notification.timestamp,
+              end=notification.timestamp)
+      migrated += len(notifications)
+
+  def _ShardsEmpty(self, shards):
+    for shard in shards:
+      if list(
+          self.data_store.GetNotifications(
+              shard, self.MAX_NOTIFICATION_TIMESTAMP, limit=1)):
+        return False
+    return True
+
   def GetNotificationShard(self, queue):
     """Gets a single shard for a given queue."""
     queue_name = str(queue)
@@ -131,17 +406,23 @@ class QueueManager(object):
     QueueManager.notification_shard_counters[queue_name] += 1
     notification_shard_index = (
         QueueManager.notification_shard_counters[queue_name] %
-        self.num_notification_shards)
-    if notification_shard_index > 0:
-      return queue.Add(str(notification_shard_index))
-    else:
-      return queue
+        self.GetNotificationShardCount(queue))
+    return self._ShardUrn(queue, notification_shard_index)
+
+  def _GetNotificationShardToRead(self, queue):
+    """Gets a single shard to read notifications from, including retired."""
+    queue_name = str(queue)
+    QueueManager.notification_read_shard_counters.setdefault(queue_name, 0)
+    QueueManager.notification_read_shard_counters[queue_name] += 1
+    return self._ShardUrn(
+        queue, QueueManager.notification_read_shard_counters[queue_name] %
+        self._GetReadShardCount(queue))
 
   def GetAllNotificationShards(self, queue):
-    result = [queue]
-    for i in range(1, self.num_notification_shards):
-      result.append(queue.Add(str(i)))
-    return result
+    """Returns all shards of a queue that might hold notifications."""
+    return [
+        self._ShardUrn(queue, i) for i in range(self._GetReadShardCount(queue))
+    ]
 
   def Copy(self):
     """Return a copy of the queue manager.
@@ -207,10 +488,33 @@ class QueueManager(object):
       yield request, status
 
   def FetchCompletedResponses(self, session_id, timestamp=None, limit=10000):
-    """Fetch only completed requests and responses up to a limit."""
+    """Fetch only completed requests and responses up to a limit.
+
+    If Worker.response_prefetch_bytes is set, this streams all completed
+    requests with their responses instead, see StreamCompletedResponses, and
+    the limit does not apply.
+
+    Args:
+      session_id: The session id of the flow.
+      timestamp: A timestamp range as used by the data store.
+      limit: The maximum number of responses to return.
+
+    Yields:
+      Tuples of requests and lists of their responses, by request id.
+
+    Raises:
+      MoreDataException: There are more than limit responses.
+    """
     if timestamp is None:
       timestamp = (0, self.frozen_timestamp or rdfvalue.RDFDatetime.Now())
 
+    prefetch_bytes = config.CONFIG["Worker.response_prefetch_bytes"]
+    if prefetch_bytes:
+      for request, responses in self.StreamCompletedResponses(
+          session_id, timestamp=timestamp, prefetch_bytes=prefetch_bytes):
+        yield request, responses
+      return
+
     completed_requests = collections.deque(
         self.FetchCompletedRequests(session_id, timestamp=timestamp))
 
@@ -242,6 +546,38 @@ class QueueManager(object):
         if total_size > limit:
           raise MoreDataException()
 
+  def StreamCompletedResponses(self,
+                               session_id,
+                               timestamp=None,
+                               prefetch_bytes=None):
+    """Streams all completed requests and their responses.
+
+    Responses are read ahead in the background while the caller processes
+    earlier ones, but only up to prefetch_bytes at a time.
+
+    Args:
+      session_id: The session id of the flow.
+      timestamp: A timestamp range as used by the data store.
+      prefetch_bytes: The maximum size of responses read ahead, defaults to
+        Worker.response_prefetch_bytes.
+
+    Returns:
+      An iterator of tuples of requests and lists of their responses, by
+      request id.
+    """
+    if timestamp is None:
+      timestamp = (0, self.frozen_timestamp or rdfvalue.RDFDatetime.Now())
+
+    if prefetch_bytes is None:
+      prefetch_bytes = config.CONFIG["Worker.response_prefetch_bytes"]
+
+    return iter(
+        ResponsePrefetcher(
+            self.data_store,
+            list(self.FetchCompletedRequests(session_id, timestamp=timestamp)),
+            prefetch_bytes,
+            timestamp=timestamp))
+
   def FetchRequestsAndResponses(self, session_id, timestamp=None):
     """Fetches all outstanding requests and responses for this flow.
 
@@ -348,6 +684,11 @@ class QueueManager(object):
 
       mutation_pool.Flush()
 
+      channel = wakeup_channel.GetChannel()
+      if channel:
+        channel.Signal(
+            set(n.session_id.Queue() for n in self.notifications.itervalues()))
+
     self.request_queue = []
     self.response_queue = []
     self.requests_to_delete = []
@@ -469,7 +810,7 @@ class QueueManager(object):
     """Retrieves session ids for processing grouped by priority."""
     # Check which sessions have new data.
     # Read all the sessions that have notifications.
-    queue_shard = self.GetNotificationShard(queue)
+    queue_shard = self._GetNotificationShardToRead(queue)
     return self._SortByPriority(
         self._GetUnsortedNotifications(queue_shard).values(), queue)
 
@@ -483,8 +824,21 @@ class QueueManager(object):
     Returns:
       dict of notifications objects keyed by priority.
     """
+    return self.GetNotificationsByPriorityForShards(
+        queue, self.GetAllNotificationShards(queue))
+
+  def GetNotificationsByPriorityForShards(self, queue, queue_shards):
+    """Same as GetNotificationsByPriority but for the given shards.
+
+    Args:
+      queue: usually rdfvalue.RDFURN("aff4:/W")
+      queue_shards: The shards of the queue to read, as returned by
+        GetAllNotificationShards.
+    Returns:
+      dict of notifications objects keyed by priority.
+    """
     output_dict = {}
-    for queue_shard in self.GetAllNotificationShards(queue):
+    for queue_shard in queue_shards:
       self._GetUnsortedNotifications(
           queue_shard, notifications_by_session_id=output_dict)
 
@@ -492,7 +846,7 @@ class QueueManager(object):
 
   def GetNotifications(self, queue):
     """Returns all queue notifications sorted by priority."""
-    queue_shard = self.GetNotificationShard(queue)
+    queue_shard = self._GetNotificationShardToRead(queue)
     notifications = self._GetUnsortedNotifications(queue_shard).values()
     notifications.sort(
         key=lambda notification: notification.priority, reverse=True)
@@ -518,6 +872,26 @@ class QueueManager(object):
         key=lambda notification: notification.priority, reverse=True)
     return notifications
 
+  def GetNotificationsForSession(self, session_id):
+    """Returns the pending notifications for a single session.
+
+    Args:
+      session_id: The session id to get notifications for.
+
+    Returns:
+      A list of rdf_flows.GrrNotification objects.
+    """
+    end_time = self.frozen_timestamp or rdfvalue.RDFDatetime.Now()
+    attribute = self.data_store.NOTIFY_PREDICATE_TEMPLATE % session_id
+    notifications = []
+    for queue_shard in self.GetAllNotificationShards(session_id.Queue()):
+      for _, value, _ in self.data_store.ResolveMulti(
+          queue_shard, [attribute], timestamp=(0, end_time)):
+        notifications.append(
+            rdf_flows.GrrNotification.FromSerializedString(value))
+
+    return notifications
+
   def _GetUnsortedNotifications(self,
                                 queue_shard,
                                 notifications_by_session_id=None):
@@ -534,7 +908,13 @@ class QueueManager(object):
     if notifications_by_session_id is None:
       notifications_by_session_id = {}
     end_time = self.frozen_timestamp or rdfvalue.RDFDatetime.Now()
+    depth = 0
+    oldest = None
     for notification in self.data_store.GetNotifications(queue_shard, end_time):
+      depth += 1
+      if notification.first_queued and (
+          oldest is None or notification.first_queued < oldest):
+        oldest = notification.first_queued
 
       existing = notifications_by_session_id.get(notification.session_id)
       if existing:
@@ -553,6 +933,15 @@ class QueueManager(object):
       else:
         notifications_by_session_id[notification.session_id] = notification
 
+    stats.STATS.SetGaugeValue(
+        "notification_shard_depth", depth, fields=[str(queue_shard)])
+    if oldest is not None:
+      stats.STATS.RecordEvent(
+          "notification_shard_latency",
+          (end_time.AsMicrosecondsSinceEpoch() -
+           oldest.AsMicrosecondsSinceEpoch()) / 1e6,
+          fields=[str(queue_shard)])
+
     return notifications_by_session_id
 
   def NotifyQueue(self, notification, **kwargs):
@@ -695,3 +1084,7 @@ class QueueManagerInit(registry.InitHook):
         "notification_queue_count",
         int,
         fields=[("queue_name", str), ("priority", str)])
+    stats.STATS.RegisterGaugeMetric(
+        "notification_shard_depth", int, fields=[("queue_shard", str)])
+    stats.STATS.RegisterEventMetric(
+        "notification_shard_latency", fields=[("queue_shard", str)])
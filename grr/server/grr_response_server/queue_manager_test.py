@@ -9,6 +9,7 @@ from grr.lib import queues
 from grr.lib import rdfvalue
 from grr.lib import stats
 from grr.lib.rdfvalues import flows as rdf_flows
+from grr.lib.rdfvalues import protodict as rdf_protodict
 from grr.server.grr_response_server import data_store
 from grr.server.grr_response_server import queue_manager
 from grr.test_lib import flow_test_lib
@@ -69,6 +70,129 @@ class QueueManagerTest(flow_test_lib.FlowTestsBaseclass):
       # Responses contain just the status message.
       self.assertEqual(len(responses), 1)
 
+  def _QueueCompletedRequests(self, session_id, num_requests, num_responses):
+    with queue_manager.QueueManager(token=self.token) as manager:
+      for request_id in range(1, num_requests + 1):
+        manager.QueueRequest(
+            rdf_flows.RequestState(
+                id=request_id,
+                client_id=test_lib.TEST_CLIENT_ID,
+                next_state="TestState",
+                session_id=session_id))
+
+        for response_id in range(1, num_responses + 1):
+          manager.QueueResponse(
+              rdf_flows.GrrMessage(
+                  session_id=session_id,
+                  request_id=request_id,
+                  response_id=response_id,
+                  payload=rdf_protodict.DataBlob(string="x" * 100)))
+
+        manager.QueueResponse(
+            rdf_flows.GrrMessage(
+                session_id=session_id,
+                request_id=request_id,
+                response_id=num_responses + 1,
+                type=rdf_flows.GrrMessage.Type.STATUS))
+
+  def testStreamCompletedResponses(self):
+    session_id = rdfvalue.SessionID(flow_name="test")
+    self._QueueCompletedRequests(session_id, 5, 3)
+
+    manager = queue_manager.QueueManager(token=self.token)
+    completed = list(
+        manager.StreamCompletedResponses(session_id, prefetch_bytes=1))
+
+    self.assertEqual([request.id for request, _ in completed], [1, 2, 3, 4, 5])
+    for request, responses in completed:
+      self.assertEqual([r.response_id for r in responses], [1, 2, 3, 4])
+      self.assertEqual(responses[0].payload.string, "x" * 100)
+
+  def testStreamCompletedResponsesBoundsPrefetching(self):
+    session_id = rdfvalue.SessionID(flow_name="test")
+    self._QueueCompletedRequests(session_id, 10, 3)
+
+    read_responses = mock.patch.object(
+        data_store.DB,
+        "ReadResponsesWithSizes",
+        wraps=data_store.DB.ReadResponsesWithSizes)
+    batch_size = mock.patch.object(queue_manager.ResponsePrefetcher,
+                                   "batch_size", 1)
+    with read_responses as read_mock, batch_size:
+      manager = queue_manager.QueueManager(token=self.token)
+      completed = manager.StreamCompletedResponses(
+          session_id, prefetch_bytes=400)
+      request, _ = next(completed)
+      self.assertEqual(request.id, 1)
+
+      # The prefetcher reads the next request and then waits for it to be
+      # consumed.
+      for _ in range(100):
+        if read_mock.call_count >= 2:
+          break
+        time.sleep(0.01)
+      time.sleep(0.1)
+      self.assertEqual(read_mock.call_count, 2)
+
+      self.assertEqual([request.id for request, _ in completed], range(2, 11))
+      self.assertEqual(read_mock.call_count, 10)
+
+  def testStreamCompletedResponsesBoundsPrefetchingWithinBatch(self):
+    session_id = rdfvalue.SessionID(flow_name="test")
+    self._QueueCompletedRequests(session_id, 10, 3)
+
+    manager = queue_manager.QueueManager(token=self.token)
+    prefetcher = queue_manager.ResponsePrefetcher(
+        data_store.DB, list(manager.FetchCompletedRequests(session_id)), 400)
+    completed = iter(prefetcher)
+    request, _ = next(completed)
+    self.assertEqual(request.id, 1)
+
+    # All requests are in one batch, but only the next one is buffered.
+    for _ in range(100):
+      if prefetcher._buffer:
+        break
+      time.sleep(0.01)
+    time.sleep(0.1)
+    self.assertEqual([r.id for r, _, _ in prefetcher._buffer], [2])
+
+    self.assertEqual([request.id for request, _ in completed], range(2, 11))
+
+  def testReadResponsesWithSizesUsesStoredSize(self):
+    session_id = rdfvalue.SessionID(flow_name="test")
+    self._QueueCompletedRequests(session_id, 1, 3)
+
+    manager = queue_manager.QueueManager(token=self.token)
+    requests = [r for r, _ in manager.FetchCompletedRequests(session_id)]
+    (_, _, size), = data_store.DB.ReadResponsesWithSizes(requests)
+
+    stored = data_store.DB.ResolvePrefix(
+        data_store.DB.GetFlowResponseSubject(session_id, 1),
+        data_store.DB.FLOW_RESPONSE_PREFIX)
+    self.assertEqual(size, sum(len(value) for _, value, _ in stored))
+
+  def testStreamCompletedResponsesRaisesReadErrors(self):
+    session_id = rdfvalue.SessionID(flow_name="test")
+    self._QueueCompletedRequests(session_id, 2, 1)
+
+    manager = queue_manager.QueueManager(token=self.token)
+    with mock.patch.object(
+        data_store.DB, "ReadResponsesWithSizes", side_effect=IOError("broken")):
+      with self.assertRaises(IOError):
+        list(manager.StreamCompletedResponses(session_id, prefetch_bytes=100))
+
+  def testFetchCompletedResponsesStreamsIfConfigured(self):
+    session_id = rdfvalue.SessionID(flow_name="test")
+    self._QueueCompletedRequests(session_id, 5, 3)
+
+    manager = queue_manager.QueueManager(token=self.token)
+    with self.assertRaises(queue_manager.MoreDataException):
+      list(manager.FetchCompletedResponses(session_id, limit=5))
+
+    with test_lib.ConfigOverrider({"Worker.response_prefetch_bytes": 1024}):
+      completed = list(manager.FetchCompletedResponses(session_id, limit=5))
+    self.assertEqual([request.id for request, _ in completed], [1, 2, 3, 4, 5])
+
   def testDeleteRequest(self):
     """Check that we can efficiently destroy a single flow request."""
     session_id = rdfvalue.SessionID(flow_name="test3")
@@ -594,6 +718,151 @@ class MultiShardedQueueManagerTest(QueueManagerTest):
           self.assertEqual(len(notifications), 0)
 
 
+class ReshardingQueueManagerTest(flow_test_lib.FlowTestsBaseclass):
+  """Tests changing the number of notification shards at runtime."""
+
+  def setUp(self):
+    super(ReshardingQueueManagerTest, self).setUp()
+    queue_manager.QueueManager.shard_layouts.clear()
+
+    self.config_overrider = test_lib.ConfigOverrider({"Worker.queue_shards": 4})
+    self.config_overrider.Start()
+
+  def tearDown(self):
+    self.config_overrider.Stop()
+    queue_manager.QueueManager.shard_layouts.clear()
+    super(ReshardingQueueManagerTest, self).tearDown()
+
+  def _QueueNotifications(self, count):
+    manager = queue_manager.QueueManager(token=self.token)
+    for i in range(count):
+      manager.QueueNotification(
+          session_id=rdfvalue.SessionID(
+              base="aff4:/hunts", queue=queues.HUNTS, flow_name=str(i)))
+      manager.Flush()
+
+  def testShardCountDefaultsToConfig(self):
+    manager = queue_manager.QueueManager(token=self.token)
+    self.assertEqual(manager.GetNotificationShardCount(queues.HUNTS), 4)
+    self.assertEqual(len(manager.GetAllNotificationShards(queues.HUNTS)), 4)
+
+  def testGrowingShardCount(self):
+    manager = queue_manager.QueueManager(token=self.token)
+    manager.SetNotificationShardCount(queues.HUNTS, 6)
+
+    shards = set(manager.GetNotificationShard(queues.HUNTS) for _ in range(12))
+    self.assertEqual(len(shards), 6)
+    self.assertEqual(
+        set(manager.GetAllNotificationShards(queues.HUNTS)), shards)
+
+    # Other processes pick up the layout from the data store.
+    queue_manager.QueueManager.shard_layouts.clear()
+    manager = queue_manager.QueueManager(token=self.token)
+    self.assertEqual(manager.GetNotificationShardCount(queues.HUNTS), 6)
+    # Other queues are not affected.
+    self.assertEqual(manager.GetNotificationShardCount(queues.FLOWS), 4)
+
+  def testInvalidShardCountRaises(self):
+    manager = queue_manager.QueueManager(token=self.token)
+    with self.assertRaises(ValueError):
+      manager.SetNotificationShardCount(queues.HUNTS, 0)
+
+  def testShrinkingShardCountMigratesNotifications(self):
+    with test_lib.FakeTime(1000):
+      self._QueueNotifications(8)
+      manager = queue_manager.QueueManager(token=self.token)
+      manager.SetNotificationShardCount(queues.HUNTS, 2)
+
+      # Retired shards are still read.
+      shards = manager.GetAllNotificationShards(queues.HUNTS)
+      self.assertEqual(len(shards), 4)
+      self.assertEqual(
+          len(manager.GetNotificationsForAllShards(queues.HUNTS)), 8)
+
+      shards_read = set()
+      for _ in range(4):
+        shards_read.update(
+            n.session_id for n in manager.GetNotifications(queues.HUNTS))
+      self.assertEqual(len(shards_read), 8)
+
+      # New notifications only go to the remaining shards.
+      written = set(manager.GetNotificationShard(queues.HUNTS) for _ in range(4))
+      self.assertEqual(written, set(shards[:2]))
+
+    with test_lib.FakeTime(1010):
+      self.assertEqual(manager.MigrateRetiredShards(queues.HUNTS), 4)
+      for shard in shards[2:]:
+        self.assertFalse(
+            list(data_store.DB.GetNotifications(shard,
+                                                rdfvalue.RDFDatetime.Now())))
+      self.assertEqual(
+          len(manager.GetNotificationsForAllShards(queues.HUNTS)), 8)
+
+      # Processes with a stale layout might still write to retired shards.
+      self.assertEqual(manager.MigrateRetiredShards(queues.HUNTS), 0)
+      self.assertEqual(len(manager.GetAllNotificationShards(queues.HUNTS)), 4)
+
+    settled = 1000 + 2 * manager.shard_layout_cache_time + 1
+    with test_lib.FakeTime(settled):
+      self.assertEqual(manager.MigrateRetiredShards(queues.HUNTS), 0)
+      self.assertEqual(len(manager.GetAllNotificationShards(queues.HUNTS)), 2)
+      self.assertEqual(
+          len(manager.GetNotificationsForAllShards(queues.HUNTS)), 8)
+
+  def testMigrationKeepsFutureNotifications(self):
+    manager = queue_manager.QueueManager(token=self.token)
+    with test_lib.FakeTime(1000):
+      manager.SetNotificationShardCount(queues.HUNTS, 2)
+
+    session_id = rdfvalue.SessionID(
+        base="aff4:/hunts", queue=queues.HUNTS, flow_name="future")
+    start_time = rdfvalue.RDFDatetime.FromSecondsSinceEpoch(100000)
+    retired_shard = manager.GetAllNotificationShards(queues.HUNTS)[3]
+    with test_lib.FakeTime(1010):
+      data_store.DB.CreateNotifications(retired_shard, [
+          rdf_flows.GrrNotification(
+              session_id=session_id, timestamp=start_time)
+      ])
+
+    settled = 1000 + 2 * manager.shard_layout_cache_time + 1
+    with test_lib.FakeTime(settled):
+      self.assertEqual(manager.MigrateRetiredShards(queues.HUNTS), 1)
+      self.assertEqual(len(manager.GetAllNotificationShards(queues.HUNTS)), 2)
+
+      # The notification is still delayed.
+      self.assertFalse(manager.GetNotificationsForAllShards(queues.HUNTS))
+
+    with test_lib.FakeTime(100001):
+      notifications = manager.GetNotificationsForAllShards(queues.HUNTS)
+      self.assertEqual([n.session_id for n in notifications], [session_id])
+      self.assertEqual(notifications[0].timestamp, start_time)
+
+  def testShardMetrics(self):
+    with test_lib.FakeTime(1000):
+      self._QueueNotifications(2)
+
+    with test_lib.FakeTime(1030):
+      manager = queue_manager.QueueManager(token=self.token)
+      shards = [str(s) for s in manager.GetAllNotificationShards(queues.HUNTS)]
+      latencies = []
+      for shard in shards:
+        latency = stats.STATS.GetMetricValue(
+            "notification_shard_latency", fields=[shard])
+        latencies.append((latency.count, latency.sum))
+      manager.GetNotificationsForAllShards(queues.HUNTS)
+
+      depths = [
+          stats.STATS.GetMetricValue("notification_shard_depth", fields=[shard])
+          for shard in shards
+      ]
+      self.assertEqual(sorted(depths), [0, 0, 1, 1])
+
+      for shard, depth, (count, total) in zip(shards, depths, latencies):
+        latency = stats.STATS.GetMetricValue(
+            "notification_shard_latency", fields=[shard])
+        self.assertEqual(latency.count - count, depth)
+        self.assertAlmostEqual(latency.sum - total, 30 * depth)
+
 def main(argv):
   test_lib.main(argv)
 
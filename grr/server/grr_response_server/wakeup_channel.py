@@ -0,0 +1,204 @@
+#!/usr/bin/env python
+"""Channels waking up idle workers when new notifications are written.
+
+Without a channel, idle workers poll their queues every few seconds. With a
+channel configured in Worker.wakeup_channel, the queue manager signals the
+channel once notifications are written and idle workers block on it instead,
+so new work is picked up right away. Signals are only a hint, workers still
+poll their queues whenever a wait times out.
+"""
+
+import errno
+import logging
+import os
+import re
+import select
+import socket
+import threading
+import time
+
+from grr import config
+from grr.lib import registry
+
+
+class WakeupChannel(object):
+  """The wakeup channel base class."""
+
+  __metaclass__ = registry.MetaclassRegistry
+
+  def Signal(self, queues):
+    """Wakes up workers waiting for any of the given queues.
+
+    Args:
+      queues: A list of queue urns new notifications were written to.
+    """
+
+  def Wait(self, queues, timeout):
+    """Waits until any of the given queues is signalled.
+
+    Args:
+      queues: A list of queue urns.
+      timeout: The maximum time to wait in seconds.
+
+    Returns:
+      True if one of the queues was signalled, False if the wait timed out.
+    """
+
+  def Close(self):
+    """Releases all resources held by the channel."""
+
+
+class LocalWakeupChannel(WakeupChannel):
+  """A wakeup channel for workers running in the writing process.
+
+  This is meant for tests and single process deployments, signals don't reach
+  other processes.
+  """
+
+  def __init__(self):
+    super(LocalWakeupChannel, self).__init__()
+    self._condition = threading.Condition()
+    self._signalled = set()
+
+  def Signal(self, queues):
+    with self._condition:
+      self._signalled.update(str(queue) for queue in queues)
+      self._condition.notify_all()
+
+  def Wait(self, queues, timeout):
+    names = set(str(queue) for queue in queues)
+    deadline = time.time() + timeout
+    with self._condition:
+      while not self._signalled & names:
+        remaining = deadline - time.time()
+        if remaining <= 0:
+          return False
+        self._condition.wait(remaining)
+
+      self._signalled -= names
+      return True
+
+
+class UnixSocketWakeupChannel(WakeupChannel):
+  """Wakes up workers on the same host through UNIX datagram sockets.
+
+  Every waiting worker binds one socket per queue in a shared directory, the
+  socket name starts with the queue it is waiting for. Signalling a queue
+  sends a single byte to all sockets of that queue. Signals sent while a
+  worker is busy stay in its socket buffer, so the next wait returns at once.
+  """
+
+  def __init__(self, directory=None):
+    super(UnixSocketWakeupChannel, self).__init__()
+    self.directory = (
+        directory or config.CONFIG["UnixSocketWakeupChannel.directory"])
+    self._listening = {}
+    self._lock = threading.Lock()
+    self._sender = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+    self._sender.setblocking(0)
+
+  def _Prefix(self, queue):
+    return re.sub(r"[^A-Za-z0-9_-]", "_", str(queue)) + "."
+
+  def _Listen(self, queue):
+    """Returns the socket receiving signals for the queue."""
+    prefix = self._Prefix(queue)
+    with self._lock:
+      if prefix not in self._listening:
+        try:
+          os.makedirs(self.directory)
+        except OSError as e:
+          if e.errno != errno.EEXIST:
+            raise
+
+        path = os.path.join(self.directory, "%s%d.%s" %
+                            (prefix, os.getpid(), os.urandom(4).encode("hex")))
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+        sock.setblocking(0)
+        sock.bind(path)
+        self._listening[prefix] = (sock, path)
+
+      return self._listening[prefix][0]
+
+  def _Drain(self, sock):
+    while True:
+      try:
+        sock.recv(64)
+      except socket.error as e:
+        if e.errno in (errno.EAGAIN, errno.EWOULDBLOCK):
+          return
+        raise
+
+  def Signal(self, queues):
+    try:
+      names = os.listdir(self.directory)
+    except OSError:
+      # No worker has ever waited here.
+      return
+
+    for queue in queues:
+      prefix = self._Prefix(queue)
+      for name in names:
+        if not name.startswith(prefix):
+          continue
+
+        path = os.path.join(self.directory, name)
+        try:
+          self._sender.sendto("\x00", path)
+        except socket.error as e:
+          if e.errno == errno.ECONNREFUSED:
+            # Left behind by a worker that is gone.
+            try:
+              os.remove(path)
+            except OSError:
+              pass
+          elif e.errno not in (errno.EAGAIN, errno.EWOULDBLOCK, errno.ENOENT):
+            # A full buffer means the worker was signalled already.
+            logging.warning("Unable to signal %s: %s", path, e)
+
+  def Wait(self, queues, timeout):
+    sockets = [self._Listen(queue) for queue in queues]
+    try:
+      readable, _, _ = select.select(sockets, [], [], timeout)
+    except select.error as e:
+      if e.args[0] != errno.EINTR:
+        raise
+      return False
+
+    for sock in readable:
+      self._Drain(sock)
+
+    return bool(readable)
+
+  def Close(self):
+    with self._lock:
+      for sock, path in self._listening.itervalues():
+        sock.close()
+        try:
+          os.remove(path)
+        except OSError:
+          pass
+      self._listening = {}
+
+    self._sender.close()
+
+
+_channel = None
+_channel_lock = threading.Lock()
+
+
+def GetChannel():
+  """Returns the configured wakeup channel or None if there is none."""
+  global _channel  # pylint: disable=global-statement
+
+  name = config.CONFIG["Worker.wakeup_channel"]
+  if not name:
+    return None
+
+  with _channel_lock:
+    if _channel is None or _channel.__class__.__name__ != name:
+      if _channel is not None:
+        _channel.Close()
+      _channel = WakeupChannel.GetPlugin(name)()
+
+    return _channel
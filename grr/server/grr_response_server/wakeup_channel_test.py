@@ -0,0 +1,140 @@
+#!/usr/bin/env python
+"""Tests for the worker wakeup channels."""
+
+import os
+import threading
+import time
+
+from grr.lib import flags
+from grr.lib import queues
+from grr.lib import rdfvalue
+from grr.server.grr_response_server import queue_manager
+from grr.server.grr_response_server import wakeup_channel
+from grr.test_lib import test_lib
+
+
+class WakeupChannelTestMixin(object):
+  """Tests shared by all wakeup channels."""
+
+  def CreateChannel(self):
+    raise NotImplementedError()
+
+  def setUp(self):
+    super(WakeupChannelTestMixin, self).setUp()
+    self.channel = self.CreateChannel()
+
+  def tearDown(self):
+    self.channel.Close()
+    super(WakeupChannelTestMixin, self).tearDown()
+
+  def testWaitTimesOut(self):
+    self.channel.Wait([queues.FLOWS], 0)
+
+    start = time.time()
+    self.assertFalse(self.channel.Wait([queues.FLOWS], 0.1))
+    self.assertGreaterEqual(time.time() - start, 0.09)
+
+  def testSignalBeforeWait(self):
+    self.channel.Wait([queues.FLOWS], 0)
+
+    self.channel.Signal([queues.FLOWS])
+    self.channel.Signal([queues.FLOWS])
+    self.assertTrue(self.channel.Wait([queues.FLOWS], 10))
+    # Signals are coalesced.
+    self.assertFalse(self.channel.Wait([queues.FLOWS], 0))
+
+  def testSignalWakesUpWaitingThread(self):
+    self.channel.Wait([queues.FLOWS], 0)
+
+    results = []
+    waiter = threading.Thread(
+        target=lambda: results.append(self.channel.Wait([queues.FLOWS], 10)))
+    waiter.start()
+    time.sleep(0.1)
+
+    start = time.time()
+    self.channel.Signal([queues.FLOWS])
+    waiter.join()
+
+    self.assertEqual(results, [True])
+    self.assertLess(time.time() - start, 5)
+
+  def testOtherQueuesAreNotSignalled(self):
+    self.channel.Wait([queues.FLOWS], 0)
+
+    self.channel.Signal([queues.HUNTS])
+    self.assertFalse(self.channel.Wait([queues.FLOWS], 0))
+
+  def testWaitOnMultipleQueues(self):
+    self.channel.Wait([queues.FLOWS, queues.HUNTS], 0)
+
+    self.channel.Signal([queues.HUNTS])
+    self.assertTrue(self.channel.Wait([queues.FLOWS, queues.HUNTS], 10))
+
+
+class LocalWakeupChannelTest(WakeupChannelTestMixin, test_lib.GRRBaseTest):
+
+  def CreateChannel(self):
+    return wakeup_channel.LocalWakeupChannel()
+
+
+class UnixSocketWakeupChannelTest(WakeupChannelTestMixin,
+                                  test_lib.GRRBaseTest):
+
+  def CreateChannel(self):
+    self.directory = os.path.join(self.temp_dir, "wakeup")
+    return wakeup_channel.UnixSocketWakeupChannel(directory=self.directory)
+
+  def testSignalsReachOtherChannels(self):
+    other = wakeup_channel.UnixSocketWakeupChannel(directory=self.directory)
+    try:
+      other.Wait([queues.FLOWS], 0)
+      self.channel.Wait([queues.FLOWS], 0)
+
+      self.channel.Signal([queues.FLOWS])
+      self.assertTrue(other.Wait([queues.FLOWS], 10))
+      self.assertTrue(self.channel.Wait([queues.FLOWS], 10))
+    finally:
+      other.Close()
+
+  def testSocketsOfClosedChannelsAreRemoved(self):
+    other = wakeup_channel.UnixSocketWakeupChannel(directory=self.directory)
+    other.Wait([queues.FLOWS], 0)
+    self.assertEqual(len(os.listdir(self.directory)), 1)
+    other.Close()
+
+    self.assertEqual(os.listdir(self.directory), [])
+
+  def testSignalWithoutWaitingWorkers(self):
+    # The directory doesn't even exist yet.
+    self.channel.Signal([queues.FLOWS])
+
+
+class QueueManagerWakeupTest(test_lib.GRRBaseTest):
+
+  def testFlushSignalsNotifiedQueues(self):
+    with test_lib.ConfigOverrider({
+        "Worker.wakeup_channel": "LocalWakeupChannel"
+    }):
+      channel = wakeup_channel.GetChannel()
+      self.assertIsInstance(channel, wakeup_channel.LocalWakeupChannel)
+      self.assertFalse(channel.Wait([queues.FLOWS], 0))
+
+      manager = queue_manager.QueueManager(token=self.token)
+      manager.QueueNotification(
+          session_id=rdfvalue.SessionID(flow_name="123456"))
+      manager.Flush()
+
+      self.assertTrue(channel.Wait([queues.FLOWS], 0))
+      self.assertFalse(channel.Wait([queues.HUNTS], 0))
+
+  def testNoChannelByDefault(self):
+    self.assertIsNone(wakeup_channel.GetChannel())
+
+
+def main(argv):
+  test_lib.main(argv)
+
+
+if __name__ == "__main__":
+  flags.StartMain(main)
@@ -1,8 +1,13 @@
 #!/usr/bin/env python
 """Module with GRRWorker implementation."""
 
+import collections
 import logging
+import os
 import pdb
+import random
+import socket
+import threading
 import time
 import traceback
 
@@ -20,11 +25,13 @@ from grr.server.grr_response_server import data_store
 from grr.server.grr_response_server import flow
 from grr.server.grr_response_server import handler_registry
 from grr.server.grr_response_server import master
+from grr.server.grr_response_server import profiler
 from grr.server.grr_response_server import queue_manager as queue_manager_lib
 # pylint: disable=unused-import
 from grr.server.grr_response_server import server_stubs
 # pylint: enable=unused-import
 from grr.server.grr_response_server import threadpool
+from grr.server.grr_response_server import wakeup_channel
 
 
 class Error(Exception):
@@ -35,6 +42,397 @@ class FlowProcessingError(Error):
   """Raised when flow requests/responses can't be processed."""
 
 
+class ShardLeases(object):
+  """Divides the notification shards of queues among the running workers.
+
+  Every worker announces itself in a list of workers per queue and leases an
+  equal share of the queue's notification shards using data store subject
+  locks. When workers join or leave, the share changes and workers release
+  or pick up shards on their next Update(). Shards held by a worker that is
+  gone become available once its leases expire.
+  """
+
+  WORKER_PREFIX = "worker:"
+
+  def __init__(self, queues, worker_id=None, lease_time=None, token=None):
+    self.queues = queues
+    self.worker_id = worker_id or "%s:%d:%s" % (
+        socket.gethostname(), os.getpid(), os.urandom(4).encode("hex"))
+    if lease_time is None:
+      lease_time = config.CONFIG["Worker.shard_lease_time"].seconds
+    self.lease_time = lease_time
+    self.token = token
+
+    # Held leases by queue, dicts of shard urns to DBSubjectLock objects.
+    self.leases = {}
+    self.last_update = 0
+
+  def _WorkersSubject(self, queue):
+    return queue.Add("shard_workers")
+
+  def _LeaseSubject(self, queue, shard_index):
+    return queue.Add("shard_leases").Add(str(shard_index))
+
+  def _CountLiveWorkers(self, queue):
+    """Announces this worker and returns the number of live workers."""
+    subject = self._WorkersSubject(queue)
+    now = int(time.time() * 1e6)
+    data_store.DB.MultiSet(
+        subject, {
+            self.WORKER_PREFIX + self.worker_id:
+                [now + int(self.lease_time * 1e6)]
+        },
+        replace=True)
+
+    live = 0
+    expired = []
+    for attribute, expires, _ in data_store.DB.ResolvePrefix(
+        subject, self.WORKER_PREFIX):
+      if int(expires) > now:
+        live += 1
+      else:
+        expired.append(attribute)
+
+    if expired:
+      data_store.DB.DeleteAttributes(subject, expired)
+
+    return max(live, 1)
+
+  def _UpdateQueue(self, queue):
+    """Renews, releases and acquires leases on shards of a queue."""
+    shards = queue_manager_lib.QueueManager(
+        token=self.token).GetAllNotificationShards(queue)
+    share = -(-len(shards) // self._CountLiveWorkers(queue))
+
+    held = self.leases.setdefault(queue, {})
+    for shard, lease in held.items():
+      if shard not in shards or not lease.CheckLease():
+        # Another worker might hold this shard by now.
+        del held[shard]
+        continue
+      lease.UpdateLease(self.lease_time)
+
+    while len(held) > share:
+      shard = random.choice(held.keys())
+      held.pop(shard).Release()
+
+    free = [(i, shard) for i, shard in enumerate(shards) if shard not in held]
+    random.shuffle(free)
+    for i, shard in free:
+      if len(held) >= share:
+        break
+
+      try:
+        held[shard] = data_store.DB.DBSubjectLock(
+            self._LeaseSubject(queue, i), lease_time=self.lease_time)
+      except data_store.DBSubjectLockError:
+        pass
+
+    stats.STATS.SetGaugeValue(
+        "worker_leased_shards", len(held), fields=[queue.Basename()])
+
+  def Update(self, force=False):
+    """Updates the leases unless this was done recently."""
+    if not force and time.time() - self.last_update < self.lease_time / 4.0:
+      return
+
+    self.last_update = time.time()
+    for queue in self.queues:
+      self._UpdateQueue(queue)
+
+  def GetShards(self, queue):
+    """Returns the shards of a queue this worker holds a lease on."""
+    return sorted(self.leases.get(queue, {}))
+
+  def ReleaseAll(self):
+    """Releases all leases and leaves the lists of workers."""
+    for queue, held in self.leases.iteritems():
+      for lease in held.itervalues():
+        lease.Release()
+      data_store.DB.DeleteAttributes(
+          self._WorkersSubject(queue), [self.WORKER_PREFIX + self.worker_id])
+
+    self.leases = {}
+
+
+class WorkerHeartbeat(object):
+  """Heartbeats of a worker and the leases of the flows it is processing.
+
+  A worker with heartbeats locks flows with a short lease that is renewed on
+  every heartbeat, and records the flows it is processing in the data store.
+  Once a worker stops heartbeating, e.g. because it crashed, the other
+  workers' reapers notify its flows again, and the flows are picked up again
+  as soon as their leases have run out.
+  """
+
+  WORKERS_URN = rdfvalue.RDFURN("aff4:/workers")
+  HEARTBEAT_PREFIX = "heartbeat:"
+  FLOW_PREFIX = "flow:"
+
+  def __init__(self, worker_id, interval=None, token=None):
+    self.worker_id = worker_id
+    if interval is None:
+      interval = config.CONFIG["Worker.heartbeat_interval"].seconds
+    self.interval = interval
+    # Leases survive two missed heartbeats.
+    self.lease_time = 3 * interval
+    self.token = token
+
+    self.flows = {}
+    self.lock = threading.Lock()
+    self.last_reap = 0
+    self.thread = None
+    self.stopped = threading.Event()
+
+  def _FlowsSubject(self, worker_id):
+    return self.WORKERS_URN.Add(worker_id)
+
+  def Register(self, flow_obj):
+    """Keeps the lease of a locked flow until it is unregistered."""
+    data_store.DB.Set(
+        self._FlowsSubject(self.worker_id),
+        self.FLOW_PREFIX + str(flow_obj.session_id), str(flow_obj.session_id))
+    with self.lock:
+      self.flows[flow_obj.session_id] = flow_obj
+
+  def Unregister(self, flow_obj):
+    """Stops renewing the lease of a flow, must be called before closing it."""
+    with self.lock:
+      self.flows.pop(flow_obj.session_id, None)
+    data_store.DB.DeleteAttributes(
+        self._FlowsSubject(self.worker_id),
+        [self.FLOW_PREFIX + str(flow_obj.session_id)])
+
+  def HeartBeat(self):
+    """Announces that the worker is alive and renews its flow leases."""
+    expires = int((time.time() + self.lease_time) * 1e6)
+    data_store.DB.MultiSet(
+        self.WORKERS_URN, {self.HEARTBEAT_PREFIX + self.worker_id: [expires]},
+        replace=True)
+
+    with self.lock:
+      for session_id, flow_obj in self.flows.items():
+        try:
+          flow_obj.UpdateLease(self.lease_time)
+        except aff4.LockError as e:
+          logging.warning("Lost the lease on %s: %s", session_id, e)
+          del self.flows[session_id]
+
+  def ReapDeadWorkers(self):
+    """Notifies the flows of workers that stopped heartbeating again.
+
+    Returns:
+      The number of reclaimed flows.
+    """
+    now = int(time.time() * 1e6)
+    dead_workers = []
+    for attribute, expires, _ in data_store.DB.ResolvePrefix(
+        self.WORKERS_URN, self.HEARTBEAT_PREFIX):
+      worker_id = attribute[len(self.HEARTBEAT_PREFIX):]
+      if int(expires) < now and worker_id != self.worker_id:
+        dead_workers.append(worker_id)
+
+    reclaimed = 0
+    for worker_id in dead_workers:
+      subject = self._FlowsSubject(worker_id)
+      session_ids = [
+          rdfvalue.SessionID(value) for _, value, _ in
+          data_store.DB.ResolvePrefix(subject, self.FLOW_PREFIX)
+      ]
+
+      if session_ids:
+        logging.info("Worker %s is gone, reclaiming flows: %s", worker_id,
+                     ", ".join(str(s) for s in session_ids))
+        with queue_manager_lib.QueueManager(token=self.token) as manager:
+          for session_id in session_ids:
+            manager.QueueNotification(session_id=session_id)
+
+      data_store.DB.DeleteSubject(subject)
+      data_store.DB.DeleteAttributes(self.WORKERS_URN,
+                                     [self.HEARTBEAT_PREFIX + worker_id])
+      stats.STATS.IncrementCounter("worker_dead_workers")
+      stats.STATS.IncrementCounter("worker_reclaimed_flows", len(session_ids))
+      reclaimed += len(session_ids)
+
+    return reclaimed
+
+  def MaybeReapDeadWorkers(self):
+    """Looks for dead workers unless this was done recently."""
+    if time.time() - self.last_reap < self.interval:
+      return 0
+
+    self.last_reap = time.time()
+    return self.ReapDeadWorkers()
+
+  def _Run(self):
+    while not self.stopped.wait(self.interval):
+      try:
+        self.HeartBeat()
+      except Exception as e:  # pylint: disable=broad-except
+        logging.exception("Worker heartbeat failed: %s", e)
+
+  def Start(self):
+    """Sends the first heartbeat and keeps sending them in a thread."""
+    self.HeartBeat()
+    self.thread = threading.Thread(name="WorkerHeartbeat", target=self._Run)
+    self.thread.daemon = True
+    self.thread.start()
+
+  def Stop(self):
+    """Stops heartbeating and leaves the list of workers."""
+    self.stopped.set()
+    if self.thread:
+      self.thread.join()
+    data_store.DB.DeleteAttributes(self.WORKERS_URN,
+                                   [self.HEARTBEAT_PREFIX + self.worker_id])
+
+
+class FairScheduler(object):
+  """Shares a thread pool among lanes of work according to their weights.
+
+  Tasks wait in the queue of their lane and are only handed to the thread
+  pool when it has a thread to spare. The next task is taken from the lane
+  that has received the smallest share of the pool relative to its weight, so
+  a lane with weight 10 gets ten tasks run for every task of a lane with
+  weight 1 as long as both have work queued. Lanes that were idle don't
+  accumulate credit.
+  """
+
+  def __init__(self, thread_pool, weights, max_running=None, max_queued=1000):
+    """Constructor.
+
+    Args:
+      thread_pool: The thread pool to run the tasks on.
+      weights: A dict mapping lane names to positive weights.
+      max_running: The maximum number of tasks handed to the pool at once,
+        defaults to the maximum number of threads in the pool.
+      max_queued: The maximum number of tasks waiting in each lane.
+    """
+    self.thread_pool = thread_pool
+    self.weights = weights
+    self.max_running = max_running or thread_pool.max_threads
+    self.max_queued = max_queued
+    self.lanes = dict((lane, collections.deque()) for lane in weights)
+    self.passes = dict((lane, 0.0) for lane in weights)
+    self.queued_keys = set()
+    self.virtual_time = 0.0
+    self.running = 0
+    self.condition = threading.Condition()
+
+  def AddTask(self,
+              lane,
+              target,
+              args,
+              name="Unnamed task",
+              key=None,
+              blocking=True):
+    """Queues a task in a lane.
+
+    Args:
+      lane: The name of the lane to queue the task in.
+      target: A callable to run.
+      args: A tuple of arguments to target.
+      name: The name of the task.
+      key: If given, the task is dropped while a task with the same key is
+        waiting to be run already.
+      blocking: If True, wait while the lane is full, otherwise raise
+        threadpool.Full.
+
+    Returns:
+      True if the task was queued, False if it was dropped as a duplicate.
+
+    Raises:
+      threadpool.Full: The lane is full and blocking is False.
+    """
+    while True:
+      with self.condition:
+        if key is not None and key in self.queued_keys:
+          return False
+
+        queue = self.lanes[lane]
+        if len(queue) < self.max_queued:
+          if not queue:
+            self.passes[lane] = max(self.passes[lane], self.virtual_time)
+          queue.append((target, args, name, time.time(), key))
+          if key is not None:
+            self.queued_keys.add(key)
+          stats.STATS.SetGaugeValue(
+              "worker_lane_queue_depth", len(queue), fields=[lane])
+          break
+
+        if not blocking:
+          raise threadpool.Full("Lane %s is full." % lane)
+        self.condition.wait(1)
+
+      # The pool may have been busy with other work the last time tasks were
+      # dispatched.
+      self.Dispatch()
+
+    self.Dispatch()
+    return True
+
+  def _NextTask(self):
+    """Takes the next task to run from the lanes, None if they are empty."""
+    lanes = [lane for lane, queue in self.lanes.iteritems() if queue]
+    if not lanes or self.running >= self.max_running:
+      return None
+
+    lane = min(lanes, key=lambda lane: self.passes[lane])
+    self.virtual_time = self.passes[lane]
+    self.passes[lane] += 1.0 / self.weights[lane]
+    self.running += 1
+
+    target, args, name, queued, key = self.lanes[lane].popleft()
+    stats.STATS.SetGaugeValue(
+        "worker_lane_queue_depth", len(self.lanes[lane]), fields=[lane])
+    stats.STATS.RecordEvent(
+        "worker_lane_wait_time", time.time() - queued, fields=[lane])
+    self.condition.notify_all()
+    return lane, target, args, name, key
+
+  def Dispatch(self):
+    """Hands queued tasks to the thread pool while it has capacity."""
+    while True:
+      with self.condition:
+        task = self._NextTask()
+        if task is None:
+          return
+
+      lane, target, args, name, key = task
+      try:
+        self.thread_pool.AddTask(
+            target=self._RunTask,
+            args=(target, args),
+            name=name,
+            blocking=False,
+            inline=False)
+      except threadpool.Full:
+        # The pool is busy with other work, try again once a task finishes.
+        with self.condition:
+          self.running -= 1
+          self.lanes[lane].appendleft((target, args, name, time.time(), key))
+        return
+
+      # Once a task runs, a new task with the same key has to run again.
+      with self.condition:
+        self.queued_keys.discard(key)
+
+  def _RunTask(self, target, args):
+    try:
+      target(*args)
+    finally:
+      with self.condition:
+        self.running -= 1
+        self.condition.notify_all()
+      self.Dispatch()
+
+  def Join(self):
+    """Waits until all queued tasks have run."""
+    with self.condition:
+      while self.running or any(self.lanes.itervalues()):
+        self.condition.wait(1)
+
+
 class GRRWorker(object):
   """A GRR worker."""
 
@@ -47,12 +445,20 @@ class GRRWorker(object):
   # Time in seconds to wait between trying to lease message handlers.
   MH_LEASE_INTERVAL = 15
 
+  # Time in seconds between moving notifications out of retired shards.
+  SHARD_MIGRATION_INTERVAL = 60
+
   # target maximum time to spend on RunOnce
   RUN_ONCE_MAX_SECONDS = 300
 
   # A class global threadpool to be used for all workers.
   thread_pool = None
 
+  # Lanes of the fair scheduler.
+  LANE_INTERACTIVE = "interactive"
+  LANE_HUNTS = "hunts"
+  LANE_SYSTEM = "system"
+
   # Duration of a flow lease time in seconds.
   flow_lease_time = 3600
   # Duration of a well known flow lease time in seconds.
@@ -98,12 +504,53 @@ class GRRWorker(object):
     self.token = token
     self.last_active = 0
     self.last_mh_lease_attempt = 0
+    self.last_shard_migration = 0
+    self.flow_batch_time = config.CONFIG["Worker.flow_batch_time"].seconds
+
+    self.scheduler = None
+    if config.CONFIG["Worker.fair_scheduling"]:
+      self.scheduler = FairScheduler(
+          self.__class__.thread_pool, {
+              self.LANE_INTERACTIVE:
+                  config.CONFIG["Worker.interactive_lane_weight"],
+              self.LANE_HUNTS:
+                  config.CONFIG["Worker.hunts_lane_weight"],
+              self.LANE_SYSTEM:
+                  config.CONFIG["Worker.system_lane_weight"],
+          },
+          max_queued=config.CONFIG["Worker.lane_queue_size"])
+
+    self.worker_id = "%s:%d:%s" % (socket.gethostname(), os.getpid(),
+                                   os.urandom(4).encode("hex"))
+
+    self.shard_leases = None
+    if config.CONFIG["Worker.shard_leasing"]:
+      self.shard_leases = ShardLeases(
+          queues, worker_id=self.worker_id, token=token)
+
+    self.heartbeat = None
+    if config.CONFIG["Worker.heartbeat_interval"].seconds:
+      self.heartbeat = WorkerHeartbeat(self.worker_id, token=token)
+
+    self.profiling = profiler.Enabled()
+    if self.profiling:
+      profiler.InstrumentDataStore()
+
+    self.wakeup_channel = wakeup_channel.GetChannel()
+    # Number of notification shards still to be read after a wakeup.
+    self.unread_shards = 0
 
     # Well known flows are just instantiated.
     self.well_known_flows = flow.WellKnownFlow.GetAllWellKnownFlows(token=token)
 
   def Run(self):
     """Event loop."""
+    if self.heartbeat:
+      self.heartbeat.Start()
+
+    if self.profiling:
+      profiler.InstallSignalHandler()
+
     try:
       while 1:
         if master.MASTER_WATCHER.IsMaster():
@@ -113,19 +560,53 @@ class GRRWorker(object):
           time.sleep(60)
 
         if processed == 0:
+          if self.unread_shards:
+            self.unread_shards -= 1
+            continue
+
           if time.time() - self.last_active > self.SHORT_POLL_TIME:
             interval = self.POLLING_INTERVAL
           else:
             interval = self.SHORT_POLLING_INTERVAL
 
-          time.sleep(interval)
+          if self.WaitForNotifications(interval) and not self.shard_leases:
+            # RunOnce reads a single notification shard per queue, so all of
+            # them have to be read to be sure to find the new notifications.
+            manager = queue_manager_lib.QueueManager(token=self.token)
+            self.unread_shards = max(
+                len(manager.GetAllNotificationShards(queue))
+                for queue in self.queues) - 1
         else:
           self.last_active = time.time()
 
     except KeyboardInterrupt:
       logging.info("Caught interrupt, exiting.")
+      if self.shard_leases:
+        self.shard_leases.ReleaseAll()
+      if self.heartbeat:
+        self.heartbeat.Stop()
       self.__class__.thread_pool.Join()
 
+  def WaitForNotifications(self, timeout):
+    """Waits for new notifications to be signalled, at most timeout seconds.
+
+    Args:
+      timeout: The maximum time to wait in seconds.
+
+    Returns:
+      True if new notifications were signalled, False if the wait timed out
+      or there is no wakeup channel to wait on.
+    """
+    if self.wakeup_channel is None:
+      time.sleep(timeout)
+      return False
+
+    if self.wakeup_channel.Wait(self.queues, timeout):
+      stats.STATS.IncrementCounter("worker_wakeups")
+      return True
+
+    return False
+
   def _ProcessMessageHandlerRequests(self):
     """Processes message handler requests."""
 
@@ -174,15 +655,32 @@ class GRRWorker(object):
     start_time = time.time()
     processed = self._ProcessMessageHandlerRequests()
 
+    if self.shard_leases:
+      self.shard_leases.Update()
+
+    if self.heartbeat:
+      self.heartbeat.MaybeReapDeadWorkers()
+
     queue_manager = queue_manager_lib.QueueManager(token=self.token)
+    if (time.time() - self.last_shard_migration >
+        self.SHARD_MIGRATION_INTERVAL):
+      self.last_shard_migration = time.time()
+      for queue in self.queues:
+        queue_manager.MigrateRetiredShards(queue)
+
     for queue in self.queues:
       # Freezeing the timestamp used by queue manager to query/delete
       # notifications to avoid possible race conditions.
       queue_manager.FreezeTimestamp()
 
       fetch_messages_start = time.time()
-      notifications_by_priority = queue_manager.GetNotificationsByPriority(
-          queue)
+      if self.shard_leases:
+        notifications_by_priority = (
+            queue_manager.GetNotificationsByPriorityForShards(
+                queue, self.shard_leases.GetShards(queue)))
+      else:
+        notifications_by_priority = queue_manager.GetNotificationsByPriority(
+            queue)
       stats.STATS.RecordEvent("worker_time_to_retrieve_notifications",
                               time.time() - fetch_messages_start)
 
@@ -272,15 +770,43 @@ class GRRWorker(object):
         if time_limit and time.time() - now > time_limit:
           break
 
-        processed += 1
         self.queued_flows.Put(notification.session_id, 1)
-        self.__class__.thread_pool.AddTask(
-            target=self._ProcessMessages,
-            args=(notification, queue_manager.Copy()),
-            name=self.__class__.__name__)
+        if self.scheduler:
+          try:
+            if not self.scheduler.AddTask(
+                self.GetLane(notification.session_id),
+                target=self._ProcessMessages,
+                args=(notification, queue_manager.Copy()),
+                name=self.__class__.__name__,
+                key=notification.session_id,
+                blocking=False):
+              continue
+          except threadpool.Full:
+            # The notification stays in the data store and is picked up
+            # again by a later poll, flows in other lanes keep going.
+            self.queued_flows.ExpireObject(notification.session_id)
+            continue
+        else:
+          self.__class__.thread_pool.AddTask(
+              target=self._ProcessMessages,
+              args=(notification, queue_manager.Copy()),
+              name=self.__class__.__name__)
+        processed += 1
 
     return processed
 
+  def GetLane(self, session_id):
+    """Returns the scheduler lane for processing the given session."""
+    path = session_id.Path()
+    if path.startswith("/hunts/"):
+      return self.LANE_HUNTS
+
+    if (path.startswith("/cron/") or
+        session_id.FlowName() in self.well_known_flows):
+      return self.LANE_SYSTEM
+
+    return self.LANE_INTERACTIVE
+
   def _ProcessRegularFlowMessages(self, flow_obj, notification):
     """Processes messages for a given flow."""
     session_id = notification.session_id
@@ -302,12 +828,43 @@ class GRRWorker(object):
       logging.error("Flow %s: %s", flow_obj, e)
       raise FlowProcessingError(e)
 
+  def _ProcessFlowBatch(self, flow_obj, start_time):
+    """Keeps processing a locked flow as long as new notifications come in.
+
+    The flow stays locked and in memory until there are no more notifications
+    for it or Worker.flow_batch_time has passed, it is only written back when
+    the caller closes it. Requests issued by the flow are not sent before
+    that, so only responses to earlier requests are picked up here.
+
+    Args:
+      flow_obj: The locked flow object.
+      start_time: The time processing of the flow started.
+    """
+    session_id = flow_obj.session_id
+    runner = flow_obj.GetRunner()
+    while (time.time() - start_time < self.flow_batch_time and
+           runner.IsRunning()):
+      # The worker's queue manager has a frozen timestamp and would not see
+      # any new notifications.
+      manager = queue_manager_lib.QueueManager(token=self.token)
+      notifications = manager.GetNotificationsForSession(session_id)
+      if not notifications:
+        return
+
+      notification = max(notifications, key=lambda n: n.timestamp)
+      notification.last_status = max(n.last_status for n in notifications)
+      manager.DeleteNotification(session_id, end=notification.timestamp)
+
+      stats.STATS.IncrementCounter("worker_batched_notifications")
+      self._ProcessRegularFlowMessages(flow_obj, notification)
+
   def _ProcessMessages(self, notification, queue_manager):
     """Does the real work with a single flow."""
     flow_obj = None
     session_id = notification.session_id
 
     try:
+      lock_start = time.time()
       # Take a lease on the flow:
       flow_name = session_id.FlowName()
       if flow_name in self.well_known_flows:
@@ -321,14 +878,19 @@ class GRRWorker(object):
             blocking=False,
             token=self.token)
       else:
+        lease_time = self.flow_lease_time
+        if self.heartbeat:
+          lease_time = self.heartbeat.lease_time
         flow_obj = aff4.FACTORY.OpenWithLock(
             session_id,
-            lease_time=self.flow_lease_time,
+            lease_time=lease_time,
             blocking=False,
             token=self.token)
 
       now = time.time()
       logging.debug("Got lock on %s", session_id)
+      if self.profiling:
+        stats.STATS.RecordEvent("worker_flow_lock_time", now - lock_start)
 
       # If we get here, we now own the flow. We can delete the notifications
       # we just retrieved but we need to make sure we don't delete any that
@@ -351,7 +913,16 @@ class GRRWorker(object):
 
       else:
         with flow_obj:
-          self._ProcessRegularFlowMessages(flow_obj, notification)
+          if self.heartbeat:
+            self.heartbeat.Register(flow_obj)
+          try:
+            self._ProcessRegularFlowMessages(flow_obj, notification)
+            if self.flow_batch_time:
+              self._ProcessFlowBatch(flow_obj, now)
+          finally:
+            # The lease must not be renewed once the flow lock is released.
+            if self.heartbeat:
+              self.heartbeat.Unregister(flow_obj)
 
       elapsed = time.time() - now
       logging.debug("Done processing %s: %s sec", session_id, elapsed)
@@ -403,3 +974,13 @@ class WorkerInit(registry.InitHook):
     stats.STATS.RegisterEventMetric(
         "worker_flow_processing_time", fields=[("flow", str)])
     stats.STATS.RegisterEventMetric("worker_time_to_retrieve_notifications")
+    stats.STATS.RegisterCounterMetric("worker_wakeups")
+    stats.STATS.RegisterCounterMetric("worker_batched_notifications")
+    stats.STATS.RegisterCounterMetric("worker_dead_workers")
+    stats.STATS.RegisterCounterMetric("worker_reclaimed_flows")
+    stats.STATS.RegisterGaugeMetric(
+        "worker_lane_queue_depth", int, fields=[("lane", str)])
+    stats.STATS.RegisterEventMetric(
+        "worker_lane_wait_time", fields=[("lane", str)])
+    stats.STATS.RegisterGaugeMetric(
+        "worker_leased_shards", int, fields=[("queue", str)])
@@ -104,6 +104,8 @@ class GRRBaseTest(unittest.TestCase):
     data_store.REL_DB.delegate.ClearTestDB()
 
     aff4.FACTORY.Flush()
+    data_store.DB.blob_existence_cache.Flush()
+    filestore.hash_existence_cache.Flush()
 
     # Create a Foreman and Filestores, they are used in many tests.
     aff4_grr.GRRAFF4Init().Run()